@@ -0,0 +1,73 @@
+"""Compare two benchmark results written by benchmarks.run and flag regressions.
+
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+
+Throughputs (*_per_sec) regress when they drop, latencies (*_ms) when they grow, by more than the threshold relative
+to the baseline. The exit status is 1 if anything regressed.
+"""
+
+import argparse
+import json
+import sys
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Map the dotted path of every throughput and latency metric to its value."""
+    metrics = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            metrics.update(flatten(value, path))
+        elif key.endswith("_per_sec") or key.endswith("_ms"):
+            metrics[path] = value
+    return metrics
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Return (metric, baseline value, current value, relative change, regressed) for every metric in both runs.
+    The relative change is positive when the current run is better."""
+    before = flatten(baseline["stages"])
+    after = flatten(current["stages"])
+    rows = []
+    for metric in sorted(before.keys() & after.keys()):
+        old, new = before[metric], after[metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        if metric.endswith("_ms"):
+            change = -change
+        rows.append((metric, old, new, change, change < -threshold))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown that counts as a regression",
+    )
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    for metric, old, new, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{metric:<50} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{flag}")
+    for stage, result in current["stages"].items():
+        if "error" in result:
+            print(f"{stage} failed: {result['error']}")
+    regressed = any(row[4] for row in rows) or any(
+        "error" in result for result in current["stages"].values()
+    )
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""In-process stand-ins for the services the pipeline talks to, so the benchmarks measure this code and not the network:
+a weaviate client that keeps collections in memory, an encoder that turns text into deterministic vectors without a
+model, and an OpenAI-compatible client that streams a canned answer."""
+
+import hashlib
+import time
+import uuid as uuid_lib
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import numpy as np
+
+DIMENSIONS = 384  # same as multi-qa-MiniLM-L6-cos-v1
+
+
+class HashEncoder:
+    """Encodes text to a unit vector seeded by its hash. It has the interface of SentenceTransformer.encode and costs
+    next to nothing, so it can stand in for the model when only the surrounding code is measured.
+    """
+
+    def __init__(self, dimensions: int = DIMENSIONS):
+        self.dimensions = dimensions
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.array([self._encode_one(text) for text in texts])
+
+    def _encode_one(self, text: str):
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+class FakeCollection:
+    """The subset of a weaviate v4 collection used by RAG_builder, backed by a dict. Objects inserted without a
+    vector are vectorized with the encoder, like the text2vec module does."""
+
+    def __init__(self, encoder):
+        self._encoder = encoder
+        # uuid -> (properties, vector), in insertion order.
+        self._objects = {}
+        self.batch = SimpleNamespace(
+            fixed_size=lambda **kwargs: self._batcher(),
+            dynamic=lambda: self._batcher(),
+            failed_objects=[],
+        )
+        self.query = SimpleNamespace(
+            near_vector=self._near_vector,
+            near_text=self._near_text,
+            fetch_objects=self._fetch_objects,
+        )
+        self.data = SimpleNamespace(delete_many=self._delete_many)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def add(self, properties: dict, vector, uuid=None):
+        if vector is None:
+            vector = self._encoder.encode(properties["content"])
+        self._objects[str(uuid or uuid_lib.uuid4())] = (
+            properties,
+            np.asarray(vector, dtype=np.float32),
+        )
+
+    @contextmanager
+    def _batcher(self):
+        yield SimpleNamespace(add_object=self.add)
+
+    def _near_vector(self, near_vector, limit, return_properties=None):
+        uuids = list(self._objects)
+        vectors = np.array([self._objects[uuid][1] for uuid in uuids])
+        scores = vectors @ np.asarray(near_vector, dtype=np.float32)
+        top = np.argsort(scores)[::-1][:limit]
+        return SimpleNamespace(objects=[self._object(uuids[i]) for i in top])
+
+    def _near_text(self, query, limit, return_properties=None):
+        return self._near_vector(self._encoder.encode(query), limit)
+
+    def _fetch_objects(
+        self,
+        limit,
+        after=None,
+        filters=None,
+        include_vector=False,
+        return_properties=None,
+    ):
+        if filters is not None:
+            uuids = [str(uuid) for uuid in filters.value if str(uuid) in self._objects]
+        else:
+            uuids = list(self._objects)
+            if after is not None:
+                start = uuids.index(str(after)) + 1
+                uuids = uuids[start:]
+        return SimpleNamespace(objects=[self._object(uuid) for uuid in uuids[:limit]])
+
+    def _delete_many(self, where):
+        doomed = [
+            uuid
+            for uuid, (properties, _) in self._objects.items()
+            if properties.get(where.target) == where.value
+        ]
+        for uuid in doomed:
+            del self._objects[uuid]
+        return SimpleNamespace(successful=len(doomed))
+
+    def _object(self, uuid: str):
+        properties, vector = self._objects[uuid]
+        return SimpleNamespace(
+            uuid=uuid, properties=properties, vector={"default": vector.tolist()}
+        )
+
+
+class FakeWeaviateClient:
+    """The subset of a weaviate v4 client used by RAG_builder."""
+
+    def __init__(self, encoder=None):
+        self._encoder = encoder or HashEncoder()
+        self._collections = {}
+        self.collections = SimpleNamespace(
+            exists=lambda name: name in self._collections,
+            create=self._create,
+            get=lambda name: self._collections[name],
+            delete=lambda name: self._collections.pop(name, None),
+        )
+
+    def _create(self, name, **kwargs):
+        self._collections[name] = FakeCollection(self._encoder)
+        return self._collections[name]
+
+    def is_ready(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeLLMClient:
+    """Streams a fixed answer one token per chunk like llamafile's OpenAI-compatible endpoint, optionally sleeping
+    token_delay seconds per token."""
+
+    def __init__(self, answer_tokens: int = 64, token_delay: float = 0.0):
+        self._answer_tokens = answer_tokens
+        self._token_delay = token_delay
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, stream=False, **kwargs):
+        tokens = [f" token{i}" for i in range(self._answer_tokens)]
+        if not stream:
+            message = SimpleNamespace(content="".join(tokens))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return self._stream(tokens)
+
+    def _stream(self, tokens):
+        for token in tokens:
+            if self._token_delay:
+                time.sleep(self._token_delay)
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
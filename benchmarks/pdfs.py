@@ -0,0 +1,64 @@
+"""Synthetic PDF files with a known number of pages and sentences, so every benchmark run extracts the same text."""
+
+import random
+
+WORDS = (
+    "the model retrieves relevant context from uploaded documents and answers questions about them "
+    "vector search ranks chunks by cosine similarity between the query embedding and each chunk "
+    "pages are extracted in parallel worker processes before the text is split into sentences"
+).split()
+
+
+def make_sentences(count: int, seed: int = 0) -> list:
+    """Return count pseudo-random sentences of 8 to 16 words."""
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(8, 16))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return sentences
+
+
+def make_pdf(pages: list) -> bytes:
+    """Build a minimal pdf file. Each page is a list of text lines, or a single line as a string."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for lines in pages:
+        if isinstance(lines, str):
+            lines = [lines]
+        text = " T* ".join(f"({line})Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 36 756 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n".encode()
+    out += f"startxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def make_document(pages: int, sentences_per_page: int = 20, seed: int = 0) -> bytes:
+    """Build a pdf of the given number of pages, each with sentences_per_page sentences on their own lines."""
+    sentences = make_sentences(pages * sentences_per_page, seed)
+    page_lines = []
+    for start in range(0, len(sentences), sentences_per_page):
+        stop = start + sentences_per_page
+        page_lines.append(sentences[start:stop])
+    return make_pdf(page_lines)
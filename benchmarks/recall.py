@@ -0,0 +1,150 @@
+"""Recall and speed of the numpy vector store for each way of storing the vectors. The same corpus is indexed as
+float32, float16 and int8, with and without the float32 re-ranking of a shortlist, and the chunks every configuration
+returns are compared with the exact float32 nearest neighbours.
+
+    python -m benchmarks.recall --corpus-size 50000 --output recall.json
+    python -m benchmarks.recall --fake-embedding --k 3,10 --rerank 0,2,4
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import pdfs
+from benchmarks.run import _int_list, _latency
+from src.tools import embedding, vector_store
+
+SESSION_ID = "bench-recall"
+
+
+def clustered_vectors(count: int, dimensions: int, seed: int = 0):
+    """Unit vectors scattered around a few hundred centres, which gives close neighbours like sentence embeddings of
+    related text do. Uniformly random vectors are all about equally far apart, which would make recall meaningless.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, count // 100), dimensions))
+    vectors = centres[rng.integers(len(centres), size=count)]
+    vectors = vectors + 0.5 * rng.standard_normal((count, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def sentence_vectors(count: int, seed: int = 0):
+    """Embeddings of synthetic sentences by the configured sentence-transformers model."""
+    return np.asarray(
+        embedding.encode_chunks(pdfs.make_sentences(count, seed=seed)),
+        dtype=np.float32,
+    )
+
+
+def evaluate(corpus, queries, ks: list, dtypes: list, reranks: list) -> dict:
+    """Index the corpus once per dtype and measure recall@k of every re-ranking factor against exact search.
+    Returns:
+        a dict keyed by "<dtype>" or "<dtype>_rerank<factor>", with the recall at each k, the bytes each vector takes
+        in the searched index and the query latency at the largest k.
+    """
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    # The exact neighbours of each query, nearest first.
+    exact = [np.argsort(corpus @ query)[::-1].tolist() for query in queries]
+    chunks = [str(index) for index in range(len(corpus))]
+    results = {}
+    for dtype in dtypes:
+        # float32 has nothing to re-rank.
+        for rerank in [0] if dtype == "float32" else reranks:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                store = vector_store.NumpyStore(
+                    root=tmp_dir, dtype=dtype, rerank=rerank
+                )
+                store.add(SESSION_ID, chunks, 0, vectors=corpus, uuids=chunks)
+                index = store._load(SESSION_ID)
+                bytes_per_vector = index.vectors.itemsize * index.vectors.shape[1]
+                if index.scales is not None:
+                    bytes_per_vector += index.scales.itemsize
+
+                hits = {k: 0 for k in ks}
+                samples = []
+                for query, truth in zip(queries, exact):
+                    start = time.perf_counter()
+                    found = store.search_vector(SESSION_ID, query, max(ks))
+                    samples.append(time.perf_counter() - start)
+                    for k in ks:
+                        returned = {int(chunk["uuid"]) for chunk in found[:k]}
+                        hits[k] += len(returned & set(truth[:k]))
+
+            name = dtype if rerank == 0 else f"{dtype}_rerank{rerank}"
+            results[name] = {
+                **{f"recall_at_{k}": hits[k] / (k * len(queries)) for k in ks},
+                "bytes_per_vector": bytes_per_vector,
+                "search": _latency(samples),
+            }
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="file to write the JSON to, or stdout")
+    parser.add_argument("--corpus-size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=_int_list, default=[3, 10])
+    parser.add_argument(
+        "--dtypes",
+        default=",".join(vector_store.DTYPES),
+        help=f"comma separated dtypes, out of {', '.join(vector_store.DTYPES)}",
+    )
+    parser.add_argument(
+        "--rerank",
+        type=_int_list,
+        default=[0, 4],
+        help="comma separated shortlist factors, 0 for no re-ranking",
+    )
+    parser.add_argument(
+        "--fake-embedding",
+        action="store_true",
+        help="use clustered random vectors instead of sentence-transformers embeddings",
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=384,
+        help="dimensions of the fake embeddings",
+    )
+    args = parser.parse_args(argv)
+    args.dtypes = [dtype for dtype in args.dtypes.split(",") if dtype]
+    unknown = set(args.dtypes) - set(vector_store.DTYPES)
+    if unknown:
+        parser.error(f"unknown dtypes: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    count = args.corpus_size + args.queries
+    if args.fake_embedding:
+        vectors = clustered_vectors(count, args.dimensions)
+    else:
+        vectors = sentence_vectors(count)
+    # The queries are held out of the corpus, like questions about a document are not part of it.
+    queries, corpus = np.split(vectors, [args.queries])
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "corpus_size": args.corpus_size,
+            "queries": args.queries,
+            "embedding": "fake" if args.fake_embedding else embedding.DEFAULT_MODEL,
+        },
+        "results": evaluate(corpus, queries, args.k, args.dtypes, args.rerank),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""Stage-level benchmarks of the RAG pipeline. Each stage runs the code of the app on synthetic input, with weaviate
+and the LLM replaced by the in-process stand-ins from benchmarks.fakes, and the results are written as JSON so runs of
+two releases can be compared with benchmarks.compare.
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --stages search,chat --corpus-sizes 1000,100000
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+
+from benchmarks import fakes, pdfs
+from src.tools import (
+    RAG_builder,
+    chunk_cache,
+    context_builder,
+    embedding,
+    utils,
+    vector_store,
+    weaviate_store,
+)
+
+STAGES = ("extract", "chunk", "embed", "ingest", "search", "chat")
+QUERY = "how does vector search rank the chunks of the uploaded documents"
+
+
+def bench_extract(pages: int, files: int, workers: int = None) -> dict:
+    """Pages per second of text extraction, once with a single worker process and once with the worker pool."""
+    documents = [pdfs.make_document(pages, seed=seed) for seed in range(files)]
+    total_pages = pages * files
+    result = {"pages": total_pages}
+    for name, max_workers in (("serial", 1), ("parallel", workers)):
+        start = time.perf_counter()
+        utils.extract_pages(documents, max_workers=max_workers)
+        seconds = time.perf_counter() - start
+        result[name] = {"seconds": seconds, "pages_per_sec": total_pages / seconds}
+    return result
+
+
+def bench_chunk(sentences: int) -> dict:
+    """Sentences per second of RAG_builder.chunk_text, sentence splitting included."""
+    text = " ".join(pdfs.make_sentences(sentences))
+    start = time.perf_counter()
+    chunks = RAG_builder.chunk_text(text, RAG_builder.CHUNK_SIZE)
+    seconds = time.perf_counter() - start
+    return {
+        "sentences": sentences,
+        "chunks": len(chunks),
+        "seconds": seconds,
+        "sentences_per_sec": sentences / seconds,
+    }
+
+
+def bench_embed(chunks: int, batch_size: int, encoder) -> dict:
+    """Chunks per second of encoding chunk texts in batches."""
+    sentences = iter(pdfs.make_sentences(chunks * RAG_builder.CHUNK_SIZE))
+    texts = [
+        " ".join(next(sentences) for _ in range(RAG_builder.CHUNK_SIZE))
+        for _ in range(chunks)
+    ]
+    encoder.encode(texts[:batch_size], batch_size=batch_size)  # warm up
+    start = time.perf_counter()
+    encoder.encode(texts, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    return {
+        "chunks": chunks,
+        "batch_size": batch_size,
+        "seconds": seconds,
+        "chunks_per_sec": chunks / seconds,
+    }
+
+
+def bench_ingest(pages: int, files: int, encoder) -> dict:
+    """End-to-end RAG_builder.build_rag into each vector store backend: a cold run that extracts, chunks and
+    vectorizes everything, and a warm run into a second session that is served from the chunk cache.
+    """
+    # Like File objects uploaded before hashing: build_rag hashes the bytes itself.
+    documents = [
+        SimpleNamespace(
+            id=seed,
+            filename=f"doc{seed}.pdf",
+            sha256=None,
+            source=pdfs.make_document(pages, seed=seed),
+        )
+        for seed in range(files)
+    ]
+    result = {"pages": pages * files}
+    for backend in vector_store.BACKENDS:
+        result[backend] = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store, client = _store(backend, tmp_dir, encoder)
+            cache = chunk_cache.ChunkCache(root=os.path.join(tmp_dir, "cache"))
+            with _stand_ins(store, client, encoder), patch.object(
+                chunk_cache, "get_cache", return_value=cache
+            ):
+                for run in ("cold", "warm"):
+                    start = time.perf_counter()
+                    reports = RAG_builder.build_rag(documents, f"bench-{run}")
+                    seconds = time.perf_counter() - start
+                    objects = sum(report["objects"] for report in reports)
+                    result[backend][run] = {
+                        "chunks": objects,
+                        "seconds": seconds,
+                        "chunks_per_sec": objects / seconds,
+                    }
+    return result
+
+
+def bench_search(corpus_sizes: list, queries: int, chunk_num: int, encoder) -> dict:
+    """Latency of RAG_builder.search_chunks as the index grows: with weaviate in the near_vector mode, where the
+    stand-in does the nearest neighbour search, and in the local mode, where every vector is pulled and scored in
+    Python, and with the numpy store, which scores the memory-mapped vectors with one matrix-vector product.
+    """
+    result = {}
+    for size in corpus_sizes:
+        result[str(size)] = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for backend, mode in (
+                ("weaviate", "near_vector"),
+                ("weaviate", "local"),
+                ("numpy", "near_vector"),
+            ):
+                store, client = _store(backend, tmp_dir, encoder)
+                _fill(store, client, size, "bench-search", encoder)
+                samples = []
+                with _stand_ins(store, client, encoder):
+                    for i in range(queries):
+                        start = time.perf_counter()
+                        RAG_builder.search_chunks(
+                            f"{QUERY} {i}", chunk_num, "bench-search", mode=mode
+                        )
+                        samples.append(time.perf_counter() - start)
+                name = "numpy" if backend == "numpy" else mode
+                result[str(size)][name] = _latency(samples)
+    return result
+
+
+def bench_chat(corpus_size: int, queries: int, answer_tokens: int, encoder) -> dict:
+    """Time the app spends on a chat turn besides generation: retrieval, prompt packing and relaying the streamed
+    tokens from the LLM stand-in, which answers instantly."""
+    store, client = _store("weaviate", None, encoder)
+    _fill(store, client, corpus_size, "bench-chat", encoder)
+    llm = fakes.FakeLLMClient(answer_tokens=answer_tokens)
+    first_token, total = [], []
+    with _stand_ins(store, client, encoder):
+        for i in range(queries):
+            query = f"{QUERY} {i}"
+            start = time.perf_counter()
+            chunks = RAG_builder.search_chunks(query, 3, "bench-chat")
+            messages, _ = context_builder.build_messages(
+                query, [chunk["content"] for chunk in chunks], []
+            )
+            stream = llm.chat.completions.create(
+                model="LLaMA_CPP", messages=messages, stream=True
+            )
+            for index, _ in enumerate(stream):
+                if index == 0:
+                    first_token.append(time.perf_counter() - start)
+            total.append(time.perf_counter() - start)
+    return {
+        "corpus_size": corpus_size,
+        "answer_tokens": answer_tokens,
+        "time_to_first_token": _latency(first_token),
+        "total": _latency(total),
+    }
+
+
+def run(stages, config) -> dict:
+    """Run the given stages and return the results with some metadata about the run. A stage that fails is recorded
+    with its error instead of aborting the remaining stages."""
+    encoder = fakes.HashEncoder() if config.fake_embedding else embedding.get_model()
+    benches = {
+        "extract": lambda: bench_extract(config.pages, config.files, config.workers),
+        "chunk": lambda: bench_chunk(config.sentences),
+        "embed": lambda: bench_embed(config.chunks, config.batch_size, encoder),
+        "ingest": lambda: bench_ingest(config.pages, config.files, encoder),
+        "search": lambda: bench_search(
+            config.corpus_sizes, config.queries, config.chunk_num, encoder
+        ),
+        "chat": lambda: bench_chat(
+            config.corpus_sizes[0], config.queries, config.answer_tokens, encoder
+        ),
+    }
+    results = {}
+    for stage in stages:
+        start = time.perf_counter()
+        try:
+            results[stage] = benches[stage]()
+        except Exception as e:
+            results[stage] = {"error": f"{type(e).__name__}: {e}"}
+        print(
+            f"{stage}: {time.perf_counter() - start:.1f}s", file=sys.stderr, flush=True
+        )
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "encoder": "hash" if config.fake_embedding else embedding.DEFAULT_MODEL,
+            "config": {
+                key: value
+                for key, value in vars(config).items()
+                if key not in ("output", "stages")
+            },
+        },
+        "stages": results,
+    }
+
+
+def _store(backend: str, root: str, encoder) -> tuple:
+    """Return a vector store of the backend and, for weaviate, the stand-in client it talks to."""
+    if backend == "numpy":
+        return vector_store.NumpyStore(root=os.path.join(root, "vector_store")), None
+    return weaviate_store.WeaviateStore(), fakes.FakeWeaviateClient(encoder)
+
+
+@contextmanager
+def _stand_ins(store, client, encoder):
+    """Make RAG_builder use the store, route weaviate connections to the stand-in client and encode with the
+    encoder."""
+
+    @contextmanager
+    def connection():
+        yield client
+
+    def encode_chunks(texts, **kwargs):
+        return encoder.encode(texts)
+
+    with patch.object(vector_store, "get_store", return_value=store), patch.object(
+        weaviate_store.weaviate_pool, "connection", connection
+    ), patch.object(embedding, "encode_query", encoder.encode), patch.object(
+        embedding, "encode_chunks", encode_chunks
+    ):
+        yield
+
+
+def _fill(store, client, size: int, session_id: str, encoder):
+    """Add size random unit vectors to the session's index."""
+    vectors = np.random.default_rng(0).standard_normal((size, fakes.DIMENSIONS))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    chunks = [f"chunk {index}" for index in range(size)]
+    uuids = [str(uuid.UUID(int=index)) for index in range(size)]
+    with _stand_ins(store, client, encoder):
+        store.create(session_id)
+        store.add(session_id, chunks, 0, vectors=vectors, uuids=uuids)
+
+
+def _latency(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _int_list(value: str) -> list:
+    return [int(item) for item in value.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGES),
+        help=f"comma separated stages to run, out of {', '.join(STAGES)}",
+    )
+    parser.add_argument("--output", help="file to write the JSON to, or stdout")
+    parser.add_argument("--pages", type=int, default=50, help="pages per pdf")
+    parser.add_argument("--files", type=int, default=4, help="pdfs to extract")
+    parser.add_argument("--workers", type=int, help="extraction worker processes")
+    parser.add_argument("--sentences", type=int, default=20000)
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--corpus-sizes", type=_int_list, default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--chunk-num", type=int, default=3)
+    parser.add_argument("--answer-tokens", type=int, default=256)
+    parser.add_argument(
+        "--fake-embedding",
+        action="store_true",
+        help="use a hash encoder instead of the sentence-transformers model",
+    )
+    args = parser.parse_args(argv)
+    args.stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = run(args.stages, args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    failed = [stage for stage, result in results["stages"].items() if "error" in result]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,241 +1,77 @@
-import time
-
-from flask import (
-    Flask,
-    request,
-    redirect,
-    url_for,
-    render_template,
-    flash,
-    session,
-)
-from flask_sqlalchemy import SQLAlchemy
-import weaviate
-
 import os
-from openai import OpenAI
-import tempfile
-import shutil
-import uuid
-
-from src.tools import RAG_builder
-
-# Set up the service of flask app.
-app = Flask(__name__, template_folder="../webpages", static_folder="../static")
-app.config["UPLOAD_FOLDER"] = "../../uploads"
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///../../files.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SECRET_KEY"] = "your_secret_key"  # Needed for flashing messages
-
-# This is the SQL DB, which is used to store uploaded files.
-db = SQLAlchemy(app)
-
-client_map = {}
-
-
-class File(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(100), nullable=False)
-    data = db.Column(db.LargeBinary, nullable=False)
-
-    def __init__(self, filename, data):
-        self.filename = filename
-        self.data = data
-
-
-class UserSession(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(255), nullable=False, unique=True)
-    temp_dir = db.Column(db.String(255), nullable=True)
-
-    def __init__(self, session_id, temp_dir):
-        self.session_id = session_id
-        self.temp_dir = temp_dir
-
-
-class Conversation(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(255), nullable=False)
-    role = db.Column(db.String(50), nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.Integer, default=int(time.time()))
-
-    def __init__(self, session_id, role, content):
-        self.session_id = session_id
-        self.role = role
-        self.content = content
-
-
-with app.app_context():
-    db.create_all()
-
-
-@app.route("/")
-def index():
-    return render_template("index.html")
-
-
-@app.route("/upload", methods=["POST"])
-def upload_file():
-    """This endpoint allows users to upload files to the SQL database. The uploaded files are visible to all users and
-    available for all users to select for semantic search."""
-    if "file" not in request.files:
-        flash("No file part")
-        return redirect(request.url)
-
-    file = request.files["file"]
-    if file.filename == "":
-        flash("No selected file")
-        return redirect(request.url)
-
-    if file:
-        filename = file.filename
-        data = file.read()
-        new_file = File(filename=filename, data=data)
-        db.session.add(new_file)
-        db.session.commit()
-        flash("File successfully uploaded")
-        return redirect(url_for("index"))
-
-
-@app.route("/files")
-def list_files():
-    """This endpoint lists all the files that are currently stored in the SQL database."""
-    files = File.query.all()
-    return render_template("files.html", files=files)
 
+from flask import Flask
+
+from src.app import migrations, views
+from src.app.models import IngestJob, db
+from src.tools import (
+    RAG_builder,
+    answer_cache,
+    chunk_cache,
+    embedding,
+    llm_client,
+    metrics,
+    weaviate_pool,
+)
 
-@app.route("/perform_operation", methods=["POST"])
-def perform_operation():
-    """This endpoint enables user to store the selected files in the vector database so that those files can be used to
-    provide context information for conversation"""
-    selected_files = request.form.getlist("file_ids")
-    if not selected_files:
-        flash("No files selected")
-        return redirect(url_for("list_files"))
-
-    files = [File.query.get(file_id) for file_id in selected_files]
-    temp_dir = tempfile.mkdtemp()
-    session["temp_dir"] = temp_dir
-
-    session_id = str(uuid.uuid4())
-    session["id"] = session_id
-
-    user_session = UserSession(session_id=session_id, temp_dir=temp_dir)
-    db.session.add(user_session)
-    db.session.commit()
-
-    client = weaviate.connect_to_local(host="weaviate", port=8080, grpc_port=50051)
-    client_map[session_id] = client
-    RAG_builder.build_rag(files, client)
-
-    flash("Operation performed successfully")
-    return redirect(url_for("inference_page"))
-
-
-@app.route("/inference", methods=["GET", "POST"])
-def inference_page():
-    """This endpoint enables users to chat with the chatbot. Llamafile will respond to each of user's input"""
-    session_id = session.get("id")
-    if not session_id:
-        flash("No active session found")
-        return redirect(url_for("list_files"))
-
-    user_session = UserSession.query.filter_by(session_id=session_id).first()
-    if not user_session:
-        flash("No Weaviate session found")
-        return redirect(url_for("list_files"))
-
-    conversation = (
-        Conversation.query.filter_by(session_id=session_id)
-        .order_by(Conversation.timestamp)
-        .all()
-    )
-
-    if request.method == "POST":
-        query_text = request.form.get("query_text", "")
-
-        # Save user message
-        user_message = Conversation(
-            session_id=session_id, role="user", content=query_text
-        )
-        db.session.add(user_message)
-        db.session.commit()
-
-        # find the context information from teh vector database with the user input as the query.
-        search_result = RAG_builder.semantic_search(query_text, 3)
-
-        try:
-            base_url = os.environ.get("EXTERNAL_SERVER_URL", "http://localhost:8081")
-            openai_client = OpenAI(
-                base_url=f"{base_url}/v1", api_key="sk-no-key-required"
-            )
-
-            # Prepare conversation history for the API call
-            messages = [
-                {"role": msg.role, "content": msg.content} for msg in conversation[-5:]
-            ]  # Last 5 messages
-            messages.append(
-                {"role": "user", "content": f"{query_text}\nContext: {search_result}"}
-            )
-            before_time = int(time.time())
-            flash(f"user input time: {before_time}")
-
-            completion = openai_client.chat.completions.create(
-                model="LLaMA_CPP", messages=messages
-            )
-
-            ai_response = completion.choices[0].message.content
-            flash(f"response created time: {completion.created}")
-            flash(
-                f"Llamafile response time consumption: {completion.created - before_time}"
-            )
-            flash(f"Llamafile response length: {len(ai_response.split())}")
-
-            # Save AI response
-            ai_message = Conversation(
-                session_id=session_id, role="assistant", content=ai_response
-            )
-            db.session.add(ai_message)
-            db.session.commit()
-
-        except Exception as e:
-            ai_response = f"Error running LlamaFile: {str(e)}"
-            flash(ai_response)
-
-        return redirect(url_for("inference_page"))
-    # Navigate to the same page so that the previous chat log of this conversation is maintained.
-    return render_template("inference.html", conversation=conversation)
-
-
-@app.route("/cleanup")
-def cleanup():
-    """This endpoint performs cleaning up. It removes temporary directory for that user session and delete the user
-    session from the database"""
-    session_id = session.get("id")
-    if not session_id:
-        flash("No active session found")
-        return redirect(url_for("list_files"))
-    user_session = UserSession.query.filter_by(session_id=session["id"]).first()
-
-    # If the session exists
-    if user_session:
-        # Remove the temporary directory if it exists
-        if user_session.temp_dir and os.path.exists(user_session.temp_dir):
-            shutil.rmtree(user_session.temp_dir)
-
-        # Delete the session details from the database
-        db.session.delete(user_session)
-        db.session.commit()
-
-        flash("Temporary data cleaned up")
-    else:
-        flash("No user session found")
-    return redirect(url_for("list_files"))
+# The SQL database every worker process shares. A relative SQLite path is resolved against the instance folder.
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///../../files.db")
+# Signs the session cookie. All worker processes must use the same key, so that any of them can read a session.
+SECRET_KEY = os.environ.get("SECRET_KEY", "your_secret_key")
+
+
+def create_app(config: dict = None) -> Flask:
+    """This function creates the Flask app: it binds the database and registers the pages. The tables are not touched,
+    see init_database. Every worker process of the WSGI server creates its own app, see wsgi.py. The state of a user
+    session lives only in the database, the vector store and the blob store, which all worker processes share, so any
+    of them can serve any request. What stays in a process is caches and connection pools.
+    Args:
+        config: settings that override the defaults, e.g. the database URI of a test
+    """
+    app = Flask(__name__, template_folder="../webpages", static_folder="../static")
+    app.config["UPLOAD_FOLDER"] = "../../uploads"
+    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SECRET_KEY"] = SECRET_KEY  # Needed for flashing messages
+    app.config.update(config or {})
+
+    db.init_app(app)
+    app.register_blueprint(views.bp)
+
+    metrics.register_stats("query_embedding_cache", embedding.cache_stats)
+    metrics.register_stats("answer_cache", lambda: answer_cache.get_cache().stats())
+    metrics.register_stats("chunk_cache", lambda: chunk_cache.get_cache().stats())
+    metrics.register_stats("weaviate_pool", lambda: weaviate_pool.get_pool().stats())
+    metrics.register_stats("llm_queue", lambda: llm_client.get_limiter().stats())
+    metrics.register_stats("llm_backends", lambda: llm_client.get_router().stats())
+    metrics.register_stats("llm_prompt_tokens", llm_client.prompt_token_stats)
+    return app
+
+
+def init_database(app: Flask):
+    """This function creates the tables that are missing and brings the existing ones up to date, see
+    migrations.upgrade. It runs once, before any worker process serves requests: under gunicorn in the master process,
+    see gunicorn_conf.on_starting. Workers that did it each on their own would race to create the same tables. The
+    ingestion jobs that the last run left unfinished are marked failed, so that they can be retried.
+    Args:
+        app: the app whose database is set up
+    """
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade()
+        IngestJob.fail_interrupted()
+        # The master process forks the workers afterwards, and they must not share its connections.
+        db.engine.dispose()
 
 
 if __name__ == "__main__":
+    # The development server. In production the app runs under gunicorn, see gunicorn_conf.py.
     if not os.path.exists("uploads"):
         os.makedirs("uploads")
 
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Load the sentence tokenizer, the vector store and the query encoder before serving, so the first upload or chat
+    # turn does not pay for them.
+    RAG_builder.warmup()
+    app = create_app()
+    init_database(app)
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
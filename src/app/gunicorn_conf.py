@@ -0,0 +1,53 @@
+"""The gunicorn settings of the app: ``gunicorn -c src/app/gunicorn_conf.py src.app.wsgi:app``. Any worker can serve
+any request, since the state of a session lives in the database, the vector store and the blob store. What each worker
+holds for itself is its caches, connection pools and LLM limiter, so LLM_MAX_IN_FLIGHT and LLM_MAX_QUEUE apply per
+worker: divide the parallel slots of the LLM servers over WEB_WORKERS."""
+
+import glob
+import os
+import tempfile
+
+# Address and port the server listens on.
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# Worker processes. Each one loads its own query encoder, so the default of one per core is bounded by memory too.
+# Each keeps its own metrics, which /metrics adds up over METRICS_DIR, see on_starting.
+workers = int(os.environ.get("WEB_WORKERS", str(os.cpu_count() or 1)))
+# Threads per worker. A chat turn mostly waits on the vector store and the LLM, so threads let a worker stream several
+# answers at once.
+threads = int(os.environ.get("WEB_THREADS", "4"))
+worker_class = "gthread"
+# Seconds a request may go without the worker checking in. Answers are streamed for as long as the LLM generates, and
+# uploads of large files take a while, so this is generous.
+timeout = int(os.environ.get("WEB_TIMEOUT", "300"))
+graceful_timeout = 30
+# Idle seconds of a kept-alive connection, e.g. between the polls of the chat page.
+keepalive = 5
+# Each worker imports the app itself instead of forking the master's: the model, the gRPC channels of the vector
+# store and the thread pools do not survive a fork.
+preload_app = False
+accesslog = "-"
+
+
+def on_starting(server):
+    """Create and upgrade the database tables in the master process, once, before any worker is started. See
+    app.init_database. Also give the workers an empty METRICS_DIR to publish their metrics to, so that a scrape of
+    /metrics, whichever worker serves it, reports all of them."""
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+    else:
+        # Set before the app is imported, which the workers inherit.
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+
+    from src.app.app import create_app, init_database
+
+    init_database(create_app())
+
+
+def post_worker_init(worker):
+    """Load the sentence tokenizer, the vector store and the query encoder before the worker takes requests, so the
+    first upload or chat turn it serves does not pay for them."""
+    from src.tools import RAG_builder
+
+    RAG_builder.warmup()
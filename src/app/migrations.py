@@ -0,0 +1,153 @@
+import io
+
+from sqlalchemy import inspect, text
+
+from src.app.models import File, db
+from src.tools import blob_store, uploads
+
+# Values of NOT NULL columns for the rows that predate them, as SQL over the old table, keyed by table and column.
+BACKFILL = {
+    "conversation": {
+        # The order the messages were saved in, counted per session like Conversation.append does.
+        "seq": "ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY id)",
+        "created_at": "COALESCE(timestamp, 0)",
+    },
+}
+
+# Indexes that earlier versions created and nothing queries any more, keyed by table.
+OBSOLETE_INDEXES = {
+    "conversation": ["ix_conversation_session_created"],
+}
+
+
+def upgrade():
+    """This function brings a database created by an earlier version of the app up to the current models. create_all
+    only creates tables that are missing, so columns added to existing tables are added here and filled in for the rows
+    that predate them. Files stored in the database itself are moved to the blob store. It is safe to call it on every
+    start: a database that is up to date is left as it is.
+
+    Earlier versions always used SQLite, and databases of other kinds are created by create_all with the current
+    schema, so only SQLite is upgraded. All changes are made in one transaction, so a failed upgrade leaves the
+    database as it was. A table that an upgrade of an earlier version left renamed is restored first.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+    with db.engine.connect() as connection:
+        # pysqlite only begins a transaction of its own before an INSERT, UPDATE or DELETE, so the renames, creates and
+        # drops before it would each be committed at once. With the driver in autocommit mode, the transaction is
+        # begun and ended here instead.
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("BEGIN")
+        try:
+            # Renaming a table must not rewrite the foreign keys of other tables that point at it.
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+            existing = set(inspect(connection).get_table_names())
+            for table in db.metadata.sorted_tables:
+                if f"_old_{table.name}" in existing:
+                    _restore_table(connection, table)
+            for table in db.metadata.sorted_tables:
+                if table.name in existing:
+                    _upgrade_table(connection, table)
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            connection.exec_driver_sql("COMMIT")
+        except BaseException:
+            connection.exec_driver_sql("ROLLBACK")
+            raise
+    _move_files_to_blob_store()
+
+
+def _restore_table(connection, table):
+    """Put back a table that an interrupted rebuild left renamed to _old_<table>. create_all has since made an empty
+    table under the original name, which is dropped. If that one has rows already, the upgrade stops.
+    """
+    old_name = f"_old_{table.name}"
+    count = connection.execute(text(f'SELECT COUNT(*) FROM "{table.name}"')).scalar()
+    if count:
+        raise RuntimeError(
+            f"Both {table.name} and {old_name} hold rows, merge them by hand"
+        )
+    connection.execute(text(f'DROP TABLE "{table.name}"'))
+    connection.execute(text(f'ALTER TABLE "{old_name}" RENAME TO "{table.name}"'))
+
+
+def _upgrade_table(connection, table):
+    """Add the columns and indexes the table lacks and drop the obsolete indexes. SQLite can neither add a NOT NULL
+    column without a default nor drop NOT NULL from a column, so for those changes the table is rebuilt.
+    """
+    inspector = inspect(connection)
+    columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+    missing = [column for column in table.columns if column.name not in columns]
+    # Columns that are NOT NULL in the database but may be empty in the model.
+    loosened = [
+        name
+        for name, column in columns.items()
+        if name in table.columns
+        if table.columns[name].nullable and not column["nullable"]
+    ]
+    if loosened or any(not column.nullable for column in missing):
+        _rebuild_table(connection, table, columns)
+        return
+
+    for column in missing:
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(
+            text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+        )
+    indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in indexes:
+            index.create(connection)
+    for name in OBSOLETE_INDEXES.get(table.name, []):
+        if name in indexes:
+            connection.execute(text(f'DROP INDEX "{name}"'))
+
+
+def _rebuild_table(connection, table, old_columns):
+    """Recreate the table with the current schema and copy its rows over. Columns the old table lacks are filled from
+    BACKFILL, or left empty."""
+    old_name = f"_old_{table.name}"
+    connection.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"'))
+    # Index names are global in SQLite, and the new table creates them again.
+    for index in inspect(connection).get_indexes(old_name):
+        connection.execute(text(f'DROP INDEX "{index["name"]}"'))
+    table.create(connection)
+
+    fills = BACKFILL.get(table.name, {})
+    names, values = [], []
+    for column in table.columns:
+        if column.name in old_columns:
+            names.append(f'"{column.name}"')
+            values.append(f'"{column.name}"')
+        elif column.name in fills:
+            names.append(f'"{column.name}"')
+            values.append(fills[column.name])
+        elif not column.nullable:
+            raise RuntimeError(
+                f"No value for the new column {table.name}.{column.name}"
+            )
+    connection.execute(
+        text(
+            f'INSERT INTO "{table.name}" ({", ".join(names)}) '
+            f'SELECT {", ".join(values)} FROM "{old_name}"'
+        )
+    )
+    connection.execute(text(f'DROP TABLE "{old_name}"'))
+
+
+def _move_files_to_blob_store():
+    """Copy the contents of files uploaded before the blob store existed into it, record their hash, size and page
+    count, and clear them from the database. One file is read at a time."""
+    legacy_ids = [
+        file_id
+        for (file_id,) in db.session.query(File.id).filter(
+            File.sha256.is_(None), File.data.isnot(None)
+        )
+    ]
+    store = blob_store.get_store() if legacy_ids else None
+    for file_id in legacy_ids:
+        file = db.session.get(File, file_id)
+        file.sha256, file.size = store.put_stream(io.BytesIO(file.data))
+        file.page_count = uploads.page_count(store.path(file.sha256))
+        file.data = None
+        db.session.commit()
+    db.session.remove()
@@ -0,0 +1,243 @@
+import io
+import os
+import sqlite3
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import deferred
+
+from src.tools import blob_store, uploads
+
+# Messages per page of the chat history.
+PAGE_SIZE = int(os.environ.get("CONVERSATION_PAGE_SIZE", "50"))
+# Attempts to save a message when another request of the same session saves one at the same time.
+APPEND_RETRIES = 3
+# Seconds an ingestion job may stay queued or running. A job whose worker process died, e.g. on a restart or a timeout,
+# is failed after that, so the chat of its session does not wait for it forever.
+INGEST_JOB_TIMEOUT = float(os.environ.get("INGEST_JOB_TIMEOUT", "3600"))
+# Milliseconds a write waits for another process to release the SQLite database before it fails.
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+
+# This is the SQL DB, which is used to store uploaded files. It is bound to the app in create_app. Together with the
+# vector store and the blob store it holds all state of the user sessions, so any worker process can serve any request.
+db = SQLAlchemy()
+
+
+@event.listens_for(Engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Let several worker processes share the SQLite database: in WAL mode readers don't wait for a writer, and a
+    writer waits for the lock of another one instead of failing at once."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+class File(db.Model):
+    """The metadata of an uploaded file. The contents live in the blob store under the file's SHA-256, so listing files
+    never has to read them."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(100), nullable=False)
+    # Contents of files uploaded before the blob store existed. Deferred so it is only loaded when asked for.
+    data = deferred(db.Column(db.LargeBinary, nullable=True))
+    # SHA-256 of the contents. Identical uploads are stored once, and indexing work is cached by this hash.
+    sha256 = db.Column(db.String(64), nullable=True, index=True)
+    size = db.Column(db.Integer, nullable=True)
+    page_count = db.Column(db.Integer, nullable=True)
+
+    def __init__(self, filename, sha256, size, page_count=None):
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+        self.page_count = page_count
+
+    @classmethod
+    def from_stream(cls, filename, stream):
+        """Copy the contents into the blob store and return the File describing them."""
+        store = blob_store.get_store()
+        sha256, size = store.put_stream(stream)
+        page_count = uploads.page_count(store.path(sha256))
+        return cls(filename=filename, sha256=sha256, size=size, page_count=page_count)
+
+    @classmethod
+    def from_bytes(cls, filename, data):
+        return cls.from_stream(filename, io.BytesIO(data))
+
+    @property
+    def source(self):
+        """The contents for text extraction: the path of the blob, or the bytes of a file from before the blob store."""
+        store = blob_store.get_store()
+        if self.sha256 and store.exists(self.sha256):
+            return store.path(self.sha256)
+        return self.data
+
+
+class UserSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(255), nullable=False, unique=True)
+    temp_dir = db.Column(db.String(255), nullable=True)
+    # JSON list of the chunk texts at the start of every prompt of the session, see context_builder.build_messages.
+    # Cleared when the indexed files change.
+    pinned_context = db.Column(db.Text, nullable=True)
+
+    def __init__(self, session_id, temp_dir):
+        self.session_id = session_id
+        self.temp_dir = temp_dir
+
+
+class SessionFile(db.Model):
+    """A file that is part of a user session's index."""
+
+    __table_args__ = (db.UniqueConstraint("session_id", "file_id"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(255), nullable=False, index=True)
+    file_id = db.Column(db.Integer, db.ForeignKey("file.id"), nullable=False)
+    file = db.relationship("File")
+
+    def __init__(self, session_id, file_id):
+        self.session_id = session_id
+        self.file_id = file_id
+
+
+class IngestJob(db.Model):
+    """A background job that builds the vector index for a user session."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(255), nullable=False, unique=True)
+    session_id = db.Column(db.String(255), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    files_total = db.Column(db.Integer, nullable=False, default=0)
+    files_done = db.Column(db.Integer, nullable=False, default=0)
+    pages = db.Column(db.Integer, nullable=False, default=0)
+    chunks = db.Column(db.Integer, nullable=False, default=0)
+    failed_chunks = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    started_at = db.Column(db.Float, nullable=True)
+    finished_at = db.Column(db.Float, nullable=True)
+
+    def __init__(self, job_id, session_id, files_total):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.files_total = files_total
+        self.status = "queued"
+        self.files_done = 0
+        self.pages = 0
+        self.chunks = 0
+        self.failed_chunks = 0
+
+    @property
+    def in_progress(self):
+        """Whether the job is still building the index. The chat waits for it, but not for a job that failed."""
+        return self.status in ("queued", "running")
+
+    def fail_if_stale(self):
+        """Mark the job failed if it has been queued or running for longer than INGEST_JOB_TIMEOUT. The thread that
+        runs a job dies with its worker process, and then nothing else would ever end the job.
+        """
+        since = self.started_at or self.created_at
+        if self.in_progress and time.time() - since > INGEST_JOB_TIMEOUT:
+            self.status = "failed"
+            self.error = f"Indexing did not finish within {INGEST_JOB_TIMEOUT:.0f}s"
+            self.finished_at = time.time()
+            db.session.commit()
+
+    @classmethod
+    def fail_interrupted(cls):
+        """Mark the jobs that are still queued or running as failed. This is called when the app starts, before any
+        worker runs jobs, so those jobs were interrupted by the restart."""
+        cls.query.filter(cls.status.in_(("queued", "running"))).update(
+            {"status": "failed", "error": "Interrupted by a restart of the app"}
+        )
+        db.session.commit()
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "ready": self.status == "done",
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "failed_chunks": self.failed_chunks,
+            "elapsed": elapsed,
+            "chunks_per_sec": self.chunks / elapsed if elapsed > 0 else 0.0,
+            "error": self.error,
+        }
+
+
+class Conversation(db.Model):
+    """One message of a chat. Messages are ordered by seq, which counts up per session, so the order does not depend on
+    clocks or on ids handed out across sessions."""
+
+    __table_args__ = (db.UniqueConstraint("session_id", "seq"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(255), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(50), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    # The save time in whole seconds, superseded by created_at. It is still filled in for earlier versions of the app
+    # that read the same database, and it is what the migration fills created_at from for older rows.
+    timestamp = db.Column(db.Integer, default=lambda: int(time.time()))
+
+    def __init__(self, session_id, role, content, seq=None):
+        self.session_id = session_id
+        self.role = role
+        self.content = content
+        self.seq = seq
+
+    @classmethod
+    def append(cls, session_id, role, content):
+        """Save a message after the last one of the session and return it. The unique (session_id, seq) constraint
+        makes a concurrent append of the same session fail, in which case the next free seq is tried.
+        """
+        for attempt in range(APPEND_RETRIES):
+            last = (
+                db.session.query(db.func.max(cls.seq))
+                .filter_by(session_id=session_id)
+                .scalar()
+            )
+            message = cls(session_id, role, content, seq=(last or 0) + 1)
+            db.session.add(message)
+            try:
+                db.session.commit()
+                return message
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == APPEND_RETRIES - 1:
+                    raise
+
+    @classmethod
+    def recent(cls, session_id, limit):
+        """Return the last limit messages of the session, oldest first. Only those rows are read."""
+        messages = (
+            cls.query.filter_by(session_id=session_id)
+            .order_by(cls.seq.desc())
+            .limit(limit)
+            .all()
+        )
+        return messages[::-1]
+
+    @classmethod
+    def history_page(cls, session_id, page, per_page=None):
+        """Return one page of the session's history. Page 1 holds the most recent messages; the items of a page are
+        oldest first."""
+        pagination = (
+            cls.query.filter_by(session_id=session_id)
+            .order_by(cls.seq.desc())
+            .paginate(page=page, per_page=per_page or PAGE_SIZE, error_out=False)
+        )
+        pagination.items.reverse()
+        return pagination
@@ -0,0 +1,638 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+    url_for,
+)
+
+from src.app.models import (
+    Conversation,
+    File,
+    IngestJob,
+    SessionFile,
+    UserSession,
+    db,
+)
+from src.tools import (
+    RAG_builder,
+    answer_cache,
+    context_builder,
+    embedding,
+    jobs,
+    llm_client,
+    metrics,
+    uploads,
+)
+
+logger = logging.getLogger(__name__)
+
+# The pages and API of the app, registered on it by create_app.
+bp = Blueprint("views", __name__)
+
+
+@bp.before_app_request
+def _track_request_start():
+    metrics.request_started(_endpoint_name())
+
+
+@bp.teardown_app_request
+def _track_request_end(exc):
+    # For streamed responses this runs once the stream has ended.
+    metrics.request_finished(_endpoint_name())
+
+
+def _endpoint_name():
+    # Without the blueprint prefix, so the metric labels are the view function names.
+    return (request.endpoint or "unknown").rpartition(".")[2]
+
+
+@bp.app_errorhandler(llm_client.QueueFullError)
+def _llm_busy(error):
+    """Turn chat requests away while the model is saturated, instead of queueing them until they time out."""
+    logger.warning("Rejected chat request: %s", error)
+    return Response(
+        "The model is busy, please try again shortly",
+        status=503,
+        headers={"Retry-After": "5"},
+    )
+
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    """This endpoint exposes the stage timings, in-flight requests and cache statistics of this process in the
+    Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/")
+def index():
+    return render_template("index.html")
+
+
+@bp.route("/upload", methods=["POST"])
+@metrics.timed("upload")
+def upload_file():
+    """This endpoint allows users to upload files to the SQL database. The uploaded files are visible to all users and
+    available for all users to select for semantic search. Several files may be uploaded at once, see upload_files.
+    """
+    try:
+        received = uploads.receive_files(request)
+    except uploads.UploadTooLargeError as error:
+        flash(str(error))
+        return redirect(url_for("views.index"))
+    if not received:
+        flash("No selected file")
+        return redirect(url_for("views.index"))
+
+    saved = _save_uploads(received)
+    for file, duplicate in saved:
+        if duplicate:
+            flash(f"This file was already uploaded as {file.filename}")
+    added = sum(1 for _, duplicate in saved if not duplicate)
+    if added == 1:
+        flash("File successfully uploaded")
+    elif added:
+        flash(f"{added} files successfully uploaded")
+    return redirect(url_for("views.index"))
+
+
+@bp.route("/upload/bulk", methods=["POST"])
+@metrics.timed("upload")
+def upload_files():
+    """This endpoint uploads any number of files in one multipart request, for scripts and API clients. Every file part
+    is streamed to disk and hashed as it arrives, the size limits of uploads.receive_files are enforced while it does,
+    and the metadata of all new files is committed in one transaction.
+    Returns:
+        a JSON object with a "files" list describing each uploaded file in request order, with "duplicate" true for a
+        file whose contents were uploaded before, in which case the earlier file is described.
+    """
+    try:
+        received = uploads.receive_files(request)
+    except uploads.UploadTooLargeError as error:
+        return jsonify({"error": str(error)}), 413
+    if not received:
+        return jsonify({"error": "No files in the upload"}), 400
+
+    files = [
+        {
+            "id": file.id,
+            "filename": file.filename,
+            "sha256": file.sha256,
+            "size": file.size,
+            "page_count": file.page_count,
+            "duplicate": duplicate,
+        }
+        for file, duplicate in _save_uploads(received)
+    ]
+    return jsonify({"files": files}), 201
+
+
+def _save_uploads(received):
+    """Add a File for every upload whose contents are not stored yet, all in one transaction.
+    Returns:
+        a (File, duplicate) pair per upload. For a duplicate, the File is the one uploaded first with those contents.
+    """
+    hashes = {upload.sha256 for upload in received}
+    # Newest first, so the oldest file with the same contents wins.
+    known = {
+        file.sha256: file
+        for file in File.query.filter(File.sha256.in_(hashes)).order_by(File.id.desc())
+    }
+    saved = []
+    for upload in received:
+        file = known.get(upload.sha256)
+        if file is not None:
+            saved.append((file, True))
+            continue
+        file = File(
+            filename=upload.filename,
+            sha256=upload.sha256,
+            size=upload.size,
+            page_count=upload.page_count,
+        )
+        db.session.add(file)
+        known[upload.sha256] = file
+        saved.append((file, False))
+    db.session.commit()
+    return saved
+
+
+@bp.route("/files")
+def list_files():
+    """This endpoint lists all the files that are currently stored in the SQL database. Only their metadata is
+    loaded."""
+    files = File.query.order_by(File.id).all()
+    return render_template("files.html", files=files)
+
+
+@bp.route("/perform_operation", methods=["POST"])
+def perform_operation():
+    """This endpoint enables user to store the selected files in the vector database so that those files can be used to
+    provide context information for conversation. The files are indexed by a background job, see job_status.
+    """
+    selected_files = request.form.getlist("file_ids")
+    if not selected_files:
+        flash("No files selected")
+        return redirect(url_for("views.list_files"))
+
+    files = [File.query.get(file_id) for file_id in selected_files]
+    temp_dir = tempfile.mkdtemp()
+    session["temp_dir"] = temp_dir
+
+    session_id = str(uuid.uuid4())
+    session["id"] = session_id
+
+    user_session = UserSession(session_id=session_id, temp_dir=temp_dir)
+    db.session.add(user_session)
+    _start_ingest_job(session_id, files)
+
+    flash("Indexing started, the chat unlocks once the files are indexed")
+    return redirect(url_for("views.inference_page"))
+
+
+@bp.route("/session/files", methods=["POST"])
+def add_session_files():
+    """This endpoint adds more files to the index of the current session. Only the new files are ingested."""
+    session_id = session.get("id")
+    if not session_id:
+        flash("No active session found")
+        return redirect(url_for("views.list_files"))
+
+    indexed = {
+        session_file.file_id
+        for session_file in SessionFile.query.filter_by(session_id=session_id)
+    }
+    files = [
+        db.session.get(File, int(file_id))
+        for file_id in request.form.getlist("file_ids")
+        if int(file_id) not in indexed
+    ]
+    files = [file for file in files if file is not None]
+    if not files:
+        flash("No new files selected")
+        return redirect(url_for("views.inference_page"))
+
+    _start_ingest_job(session_id, files)
+    flash(f"Adding {len(files)} file(s) to the index")
+    return redirect(url_for("views.inference_page"))
+
+
+@bp.route("/session/files/<int:file_id>/remove", methods=["POST"])
+def remove_session_file(file_id):
+    """This endpoint removes one file's chunks from the index of the current session, keeping the other files."""
+    session_id = session.get("id")
+    if not session_id:
+        flash("No active session found")
+        return redirect(url_for("views.list_files"))
+
+    session_file = SessionFile.query.filter_by(
+        session_id=session_id, file_id=file_id
+    ).first()
+    if not session_file:
+        flash("This file is not part of the session")
+        return redirect(url_for("views.inference_page"))
+
+    removed = RAG_builder.remove_file(session_id, file_id)
+    db.session.delete(session_file)
+    _unpin_context(session_id)
+    db.session.commit()
+    flash(f"Removed {removed} chunks from the index")
+    return redirect(url_for("views.inference_page"))
+
+
+def _start_ingest_job(session_id, files):
+    """Record the files as part of the session and index them in the background. Building the index can take minutes,
+    so the chat page waits for the job instead of the request."""
+    job = IngestJob(
+        job_id=str(uuid.uuid4()), session_id=session_id, files_total=len(files)
+    )
+    db.session.add(job)
+    indexed = {
+        session_file.file_id
+        for session_file in SessionFile.query.filter_by(session_id=session_id)
+    }
+    for file in files:
+        if file.id not in indexed:
+            db.session.add(SessionFile(session_id=session_id, file_id=file.id))
+    _unpin_context(session_id)
+    db.session.commit()
+    jobs.submit(
+        _run_ingest_job,
+        current_app._get_current_object(),
+        job.job_id,
+        [file.id for file in files],
+    )
+    return job
+
+
+def _run_ingest_job(app, job_id, file_ids):
+    """Build the vector index for a job and keep its progress up to date. This runs on a background worker thread,
+    in the context of the app that started the job."""
+    with app.app_context():
+        job = IngestJob.query.filter_by(job_id=job_id).first()
+        job.status = "running"
+        job.started_at = time.time()
+        db.session.commit()
+
+        def progress(report):
+            job.files_done += 1
+            job.pages += report["pages"]
+            job.chunks += report["objects"]
+            job.failed_chunks += report["failed"]
+            db.session.commit()
+
+        try:
+            files = [db.session.get(File, file_id) for file_id in file_ids]
+            RAG_builder.build_rag(files, job.session_id, progress)
+            job.status = "done"
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            # A failed commit of the progress leaves the session unusable until it is rolled back.
+            db.session.rollback()
+            job.status = "failed"
+            job.error = str(e)
+        job.finished_at = time.time()
+        db.session.commit()
+
+
+@bp.route("/jobs/<job_id>")
+def job_status(job_id):
+    """This endpoint reports the progress of an ingestion job: pages and chunks processed so far and the throughput."""
+    job = IngestJob.query.filter_by(job_id=job_id).first()
+    if not job:
+        return jsonify({"error": "No such job"}), 404
+    job.fail_if_stale()
+    return jsonify(job.to_dict())
+
+
+def _latest_job(session_id):
+    """Return the last ingestion job of the session, failed if it is stale, or None."""
+    job = (
+        IngestJob.query.filter_by(session_id=session_id)
+        .order_by(IngestJob.id.desc())
+        .first()
+    )
+    if job:
+        job.fail_if_stale()
+    return job
+
+
+@bp.route("/jobs/<job_id>/retry", methods=["POST"])
+def retry_job(job_id):
+    """This endpoint indexes the files of the current session again after an ingestion job failed. The files that were
+    indexed before the failure are served from the chunk cache."""
+    session_id = session.get("id")
+    job = IngestJob.query.filter_by(job_id=job_id, session_id=session_id).first()
+    if job:
+        job.fail_if_stale()
+    if not job or job.status != "failed":
+        flash("There is no failed indexing job to retry")
+        return redirect(url_for("views.inference_page"))
+
+    files = [
+        session_file.file
+        for session_file in SessionFile.query.filter_by(session_id=session_id)
+    ]
+    _start_ingest_job(session_id, files)
+    flash("Indexing the files again")
+    return redirect(url_for("views.inference_page"))
+
+
+@bp.route("/inference", methods=["GET", "POST"])
+def inference_page():
+    """This endpoint enables users to chat with the chatbot. Llamafile will respond to each of user's input"""
+    session_id = session.get("id")
+    if not session_id:
+        flash("No active session found")
+        return redirect(url_for("views.list_files"))
+
+    user_session = UserSession.query.filter_by(session_id=session_id).first()
+    if not user_session:
+        flash("No Weaviate session found")
+        return redirect(url_for("views.list_files"))
+
+    job = _latest_job(session_id)
+
+    if request.method == "POST":
+        if job and job.in_progress:
+            flash("The files are still being indexed, please wait")
+            return redirect(url_for("views.inference_page"))
+
+        query_text = request.form.get("query_text", "")
+
+        # Only the messages that can make it into the prompt are read.
+        history = Conversation.recent(session_id, context_builder.HISTORY_MESSAGES)
+
+        # find the context information from teh vector database with the user input as the query.
+        chunks = RAG_builder.search_chunks(query_text, 3, session_id)
+        cache_key = _answer_cache_key(query_text, chunks)
+        ai_response = _cached_answer(cache_key)
+        if ai_response is not None:
+            flash("Answer served from the cache")
+            Conversation.append(session_id, "user", query_text)
+            Conversation.append(session_id, "assistant", ai_response)
+            return redirect(url_for("views.inference_page"))
+
+        messages = _chat_messages(user_session, history, query_text, chunks)
+        # The request is admitted before the user message is saved, so one that is turned away with a 503 leaves no
+        # unanswered turn in the history for later prompts.
+        with llm_client.get_limiter().slot():
+            # Save user message
+            Conversation.append(session_id, "user", query_text)
+            try:
+                before_time = time.perf_counter()
+                with metrics.timed("llm_total"), llm_client.get_router().backend(
+                    session_id
+                ) as generation:
+                    completion = generation.client.chat.completions.create(
+                        model="LLaMA_CPP",
+                        messages=messages,
+                        extra_body=llm_client.request_options(session_id),
+                    )
+                    generation.output_tokens = getattr(
+                        completion.usage, "completion_tokens", None
+                    )
+
+                ai_response = completion.choices[0].message.content
+                flash(
+                    f"Llamafile response time consumption: {time.perf_counter() - before_time:.2f}s"
+                )
+                flash(f"Llamafile response length: {len(ai_response.split())}")
+                prompt_tokens = llm_client.record_prompt_tokens(completion)
+                if prompt_tokens:
+                    flash("Prompt tokens: %d cached, %d evaluated" % prompt_tokens)
+                _cache_answer(cache_key, ai_response)
+
+                # Save AI response
+                Conversation.append(session_id, "assistant", ai_response)
+
+            except Exception as e:
+                ai_response = f"Error running LlamaFile: {str(e)}"
+                flash(ai_response)
+
+        return redirect(url_for("views.inference_page"))
+    # Navigate to the same page so that the previous chat log of this conversation is maintained.
+    session_files = (
+        SessionFile.query.filter_by(session_id=session_id)
+        .order_by(SessionFile.id)
+        .all()
+    )
+    indexed = {session_file.file_id for session_file in session_files}
+    other_files = [
+        file for file in File.query.order_by(File.id).all() if file.id not in indexed
+    ]
+    history_page = Conversation.history_page(
+        session_id, request.args.get("page", 1, type=int)
+    )
+    return render_template(
+        "inference.html",
+        conversation=history_page.items,
+        history_page=history_page,
+        job=job,
+        session_files=session_files,
+        other_files=other_files,
+    )
+
+
+@bp.route("/inference/stream", methods=["POST"])
+def inference_stream():
+    """This endpoint is the streaming variant of the chat: the answer from Llamafile is forwarded token by token as
+    server-sent events. The full answer is saved to the conversation once the stream ends, and the last event reports
+    the time to first token and the generation speed."""
+    session_id = session.get("id")
+    if not session_id:
+        return Response("No active session found", status=400)
+    user_session = UserSession.query.filter_by(session_id=session_id).first()
+    if not user_session:
+        return Response("No Weaviate session found", status=400)
+    job = _latest_job(session_id)
+    if job and job.in_progress:
+        return Response("The files are still being indexed", status=409)
+
+    query_text = request.form.get("query_text", "")
+    history = Conversation.recent(session_id, context_builder.HISTORY_MESSAGES)
+
+    chunks = RAG_builder.search_chunks(query_text, 3, session_id)
+    cache_key = _answer_cache_key(query_text, chunks)
+    cached_answer = _cached_answer(cache_key)
+    messages = _chat_messages(user_session, history, query_text, chunks)
+    if cached_answer is None:
+        # Taken before the response starts, so that a full queue is still answered with a 503, and before the user
+        # message is saved, so that a rejected request leaves no unanswered turn in the history.
+        llm_client.get_limiter().acquire()
+    try:
+        Conversation.append(session_id, "user", query_text)
+    except Exception:
+        if cached_answer is None:
+            llm_client.get_limiter().release()
+        raise
+
+    def generate():
+        if cached_answer is not None:
+            Conversation.append(session_id, "assistant", cached_answer)
+            yield _sse_event("token", {"content": cached_answer})
+            yield _sse_event("done", {"cached": True})
+            return
+
+        tokens = []
+        start = time.perf_counter()
+        first_token_time = None
+        chunk = None
+        try:
+            with llm_client.get_router().backend(session_id) as generation:
+                stream = generation.client.chat.completions.create(
+                    model="LLaMA_CPP",
+                    messages=messages,
+                    stream=True,
+                    extra_body=llm_client.request_options(session_id),
+                )
+                for chunk in stream:
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                        metrics.observe(
+                            "llm_time_to_first_token", first_token_time - start
+                        )
+                    tokens.append(chunk.choices[0].delta.content)
+                    yield _sse_event("token", {"content": tokens[-1]})
+                # llama.cpp sends one token per chunk.
+                generation.output_tokens = len(tokens)
+        except Exception as e:
+            yield _sse_event("error", {"message": f"Error running LlamaFile: {str(e)}"})
+            return
+        end_time = time.perf_counter()
+        metrics.observe("llm_total", end_time - start)
+
+        ai_message = Conversation.append(session_id, "assistant", "".join(tokens))
+        _cache_answer(cache_key, ai_message.content)
+        # llama.cpp reports the prompt tokens with the last chunk.
+        prompt_tokens = llm_client.record_prompt_tokens(chunk)
+
+        # llama.cpp sends one token per chunk, so the chunk count is the output token count.
+        first_token_time = first_token_time or end_time
+        generation_time = end_time - first_token_time
+        stats = {
+            "cached": False,
+            "time_to_first_token": first_token_time - start,
+            "total_time": end_time - start,
+            "tokens": len(tokens),
+            "tokens_per_sec": (
+                (len(tokens) - 1) / generation_time if generation_time > 0 else 0.0
+            ),
+        }
+        if prompt_tokens:
+            stats["prompt_tokens_cached"], stats["prompt_tokens_evaluated"] = (
+                prompt_tokens
+            )
+        logger.info(
+            "Streamed %d tokens, time to first token %.2fs, %.1f tokens/sec",
+            stats["tokens"],
+            stats["time_to_first_token"],
+            stats["tokens_per_sec"],
+        )
+        yield _sse_event("done", stats)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if cached_answer is None:
+        # Runs when the stream ends, also when the client disconnects before it started.
+        response.call_on_close(llm_client.get_limiter().release)
+    return response
+
+
+def _answer_cache_key(query_text, chunks):
+    """Return the (query vector, chunk ids) the answer cache is keyed on, or None if the request opted out of the
+    cache with a no_cache form field or a Cache-Control: no-cache header."""
+    if request.form.get("no_cache") or "no-cache" in request.headers.get(
+        "Cache-Control", ""
+    ):
+        return None
+    return embedding.encode_query(query_text), [chunk["uuid"] for chunk in chunks]
+
+
+def _cached_answer(cache_key):
+    if cache_key is None:
+        return None
+    return answer_cache.get_cache().get(*cache_key)
+
+
+def _cache_answer(cache_key, answer):
+    if cache_key is not None and answer:
+        answer_cache.get_cache().put(*cache_key, answer)
+
+
+def _chat_messages(user_session, history, query_text, chunks):
+    """Prepare the messages for the API call, packed into the prompt token budget: the system prompt with the context
+    pinned to the session, the recent history and the user input with the newly retrieved context. The first turn of a
+    session pins its context."""
+    pinned = (
+        json.loads(user_session.pinned_context) if user_session.pinned_context else None
+    )
+    messages, stats = context_builder.build_messages(
+        query_text,
+        [chunk["content"] for chunk in chunks],
+        [{"role": msg.role, "content": msg.content} for msg in history],
+        pinned=pinned,
+    )
+    if pinned is None and stats["pinned"]:
+        user_session.pinned_context = json.dumps(stats["pinned"])
+        db.session.commit()
+    return messages
+
+
+def _unpin_context(session_id):
+    """Forget the pinned context of the session, so the next turn pins context from the changed index."""
+    UserSession.query.filter_by(session_id=session_id).update({"pinned_context": None})
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@bp.route("/cleanup")
+def cleanup():
+    """This endpoint performs cleaning up. It removes temporary directory for that user session, drops its vector index
+    and delete the user session from the database"""
+    session_id = session.get("id")
+    if not session_id:
+        flash("No active session found")
+        return redirect(url_for("views.list_files"))
+    user_session = UserSession.query.filter_by(session_id=session["id"]).first()
+
+    # If the session exists
+    if user_session:
+        # Remove the temporary directory if it exists
+        if user_session.temp_dir and os.path.exists(user_session.temp_dir):
+            shutil.rmtree(user_session.temp_dir)
+
+        # Drop the session's vector index and the list of its files
+        RAG_builder.drop_storage(session_id)
+        SessionFile.query.filter_by(session_id=session_id).delete()
+
+        # Delete the session details from the database
+        db.session.delete(user_session)
+        db.session.commit()
+
+        flash("Temporary data cleaned up")
+    else:
+        flash("No user session found")
+    return redirect(url_for("views.list_files"))
@@ -0,0 +1,7 @@
+"""The WSGI entry point of the app, e.g. ``gunicorn -c src/app/gunicorn_conf.py src.app.wsgi:app``. Every worker
+process imports this module and so builds its own app. The database tables are set up before, once, by the master
+process, see gunicorn_conf.on_starting."""
+
+from src.app.app import create_app
+
+app = create_app()
@@ -1,124 +1,397 @@
-from src.tools import utils
-import weaviate
-import weaviate.classes as wvc
-import nltk
-from nltk.tokenize import sent_tokenize
-from sentence_transformers import SentenceTransformer
-import numpy as np
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
 
-class_name = "TextChunk"
-nltk.download("punkt")
+from src.tools import chunk_cache, embedding, metrics, pipeline, utils, vector_store
 
+# Number of sentences in each chunk.
+CHUNK_SIZE = 3
+RETRIEVAL_MODES = ("near_vector", "near_text", "local")
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "near_vector")
+# Where chunk vectors are computed at ingest. "server" leaves it to the vector store when it can vectorize, "local"
+# encodes the chunks in this process in batches, see embedding.encode_chunks, and writes them with explicit vectors.
+INGEST_EMBEDDING_MODES = ("server", "local")
+INGEST_EMBEDDING = os.environ.get("INGEST_EMBEDDING", "server")
+# Chunks that are vectorized and written to the vector store together. Each batch is searchable as soon as it is
+# written, and only a few batches per stage are in memory at any time, see pipeline.buffered. Not to be confused with
+# weaviate_store.INGEST_BATCH_SIZE, the objects per request weaviate's client splits each of these batches into.
+PIPELINE_BATCH_SIZE = int(os.environ.get("INGEST_PIPELINE_BATCH_SIZE", "256"))
+# A sentence is carried over to the next page in case it continues there, unless it grows past this many characters,
+# which only happens on pages without sentence ends such as long tables.
+MAX_CARRY_CHARS = 10000
+# Directory searched first for nltk's punkt sentence tokenizer, before the NLTK_DATA variable and nltk's default paths.
+# The docker image downloads it there; elsewhere run python -m nltk.downloader -d nltk_data punkt once.
+PUNKT_DATA_DIR = os.environ.get(
+    "PUNKT_DATA_DIR",
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "nltk_data"),
+)
 
-def build_rag(files, weaviate_client):
-    """This function builds up the RAG pipeline. It takes the file and database client as input, initiate the storage
-    and extract the contents of each file to store in the vector database.
+logger = logging.getLogger(__name__)
+
+_sentence_tokenizer = None
+_sentence_tokenizer_lock = threading.Lock()
+
+
+def build_rag(files, session_id: str, progress=None):
+    """This function builds up the RAG pipeline. It initiates the storage of the session and extracts the contents of
+    each file to store in the vector database. It can be called again to add more files to the session's index; the
+    files already in it are left alone. Ingestion streams: pages are extracted in parallel worker processes, split into
+    sentences and chunks as they arrive, and vectorized and written to the vector store in batches of
+    PIPELINE_BATCH_SIZE chunks, with the stages running side by side in threads joined by bounded queues. Memory stays
+    flat however big the files are, and the first chunks of a file are searchable long before the file is done. The
+    pages, chunks and vectors of every file are cached by the hash of its contents, so files that were indexed before
+    skip extraction, chunking and vectorization. Depending on INGEST_EMBEDDING and the vector store, chunks are
+    vectorized by weaviate or encoded in batches in this process.
     Args:
-        files: the files that are to be used in the RAG
-        weaviate_client: the weaviate client for storing file contents in the vector database.
+        files: the files that are to be used in the RAG. Each has an id, a filename, a sha256 and a source, which is
+            the path or the bytes of the pdf.
+        session_id: the user session whose index the files are added to
+        progress: optional callable that is given each file's report as soon as that file is stored
+    Returns:
+        a list with one ingestion report per file, see VectorStore.add. Each report also has the filename, the number of
+        pages and whether the file was served from the cache.
     """
-    initiate_storage(weaviate_client)
-    for file in files:
-        content = utils.extract_content(file.data)
-        chunk_text(content, 3)
+    if INGEST_EMBEDDING not in INGEST_EMBEDDING_MODES:
+        raise ValueError(f"Unknown ingest embedding mode: {INGEST_EMBEDDING}")
+    cache = chunk_cache.get_cache()
+    # Files from before uploads were hashed provide their bytes as source.
+    hashes = [file.sha256 or chunk_cache.file_hash(file.source) for file in files]
+    file_chunks = [
+        cache.iter_chunks(content_hash, CHUNK_SIZE) for content_hash in hashes
+    ]
+
+    # Only the files that were never chunked before need their text extracted. One stream of pages serves them all,
+    # so the worker processes run ahead into the next file while the current one is vectorized.
+    missing = [index for index, chunks in enumerate(file_chunks) if chunks is None]
+    pages_by_file = iter(())
+    # Files with a page range that timed out. Their text is incomplete, so nothing of them is cached.
+    skipped = set()
+    if missing:
+        pages_by_file = _split_by_file(
+            utils.iter_pages(
+                [files[index].source for index in missing],
+                on_skip=lambda position: skipped.add(missing[position]),
+            ),
+            len(missing),
+        )
+
+    store = vector_store.get_store()
+    initiate_storage(session_id)
+    # Stores that cannot vectorize chunks themselves are always given locally computed vectors.
+    encode_locally = INGEST_EMBEDDING == "local" or not store.vectorizes
+    vectors_key = _vectors_key(store, encode_locally)
+    reports = []
+    for index, file in enumerate(files):
+        content_hash, chunks = hashes[index], file_chunks[index]
+        with ExitStack() as writers:
+            page_writer = chunk_writer = None
+            if chunks is None:
+                page_writer = writers.enter_context(cache.page_writer(content_hash))
+                chunk_writer = writers.enter_context(
+                    cache.chunk_writer(content_hash, CHUNK_SIZE)
+                )
+                pages = pipeline.tee(
+                    pipeline.timed(next(pages_by_file), "extract"), page_writer.write
+                )
+                chunks = pipeline.tee(
+                    iter_chunks(split_sentences(pages), CHUNK_SIZE), chunk_writer.write
+                )
+            vectors = cache.get_vectors(content_hash, CHUNK_SIZE, vectors_key)
+            vector_writer = None
+            if vectors is None:
+                vector_writer = writers.enter_context(
+                    cache.vector_writer(content_hash, CHUNK_SIZE, vectors_key)
+                )
+            report = _ingest_file(
+                store,
+                session_id,
+                file.id,
+                content_hash,
+                chunks,
+                vectors,
+                encode_locally,
+                vector_writer,
+            )
+            if index in skipped:
+                logger.warning(
+                    "Not caching %s: some of its pages timed out", file.filename
+                )
+                for writer in (page_writer, chunk_writer, vector_writer):
+                    if writer is not None:
+                        writer.discard()
+        report["filename"] = file.filename
+        if page_writer is None:
+            report["pages"] = cache.get_page_count(content_hash) or 0
+        else:
+            report["pages"] = page_writer.count
+        report["cached"] = page_writer is None
+        logger.info(
+            "Ingested %s: %d objects, %d failed, %.1f objects/sec",
+            file.filename,
+            report["objects"],
+            report["failed"],
+            report["objects_per_sec"],
+        )
+        reports.append(report)
+        if progress:
+            progress(report)
+    cache.evict()
+    return reports
 
 
-def add_text_chunk_to_db(chunk: str):
-    """This function stores the chunk of text in the database, so that it can be used for semantic search later on.
+def _ingest_file(
+    store,
+    session_id: str,
+    file_id: int,
+    content_hash: str,
+    chunks,
+    vectors,
+    encode_locally: bool,
+    vector_writer,
+) -> dict:
+    """Vectorize the chunks of one file and write them to the store batch by batch, as they stream in.
     Args:
-        chunk: the string value of that text chunk
+        chunks: an iterable over the file's chunks
+        vectors: the cached vectors of the chunks, or None
+        encode_locally: whether chunks without cached vectors are encoded in this process or left to the store
+        vector_writer: where the vectors are cached if they were not, or None
+    Returns:
+        the ingestion report of the file, summed over its batches.
     """
-    weaviate_client = weaviate.connect_to_local(
-        host="weaviate", port=8080, grpc_port=50051
+    # Three stages run side by side: chunking in one thread, vectorizing in another and the store writes in this one.
+    batches = pipeline.buffered(
+        pipeline.batched(chunks, PIPELINE_BATCH_SIZE), name="ingest-chunk"
     )
-    try:
-        text_chunk = weaviate_client.collections.get(class_name)
-        result = text_chunk.data.insert(
-            {
-                "content": chunk,
-            }
-        )
-        print(f"content is {chunk}")
-        print(f"result is {result}")
-    finally:
-        weaviate_client.close()
+    batches = pipeline.buffered(
+        _vectorized(batches, vectors, encode_locally), name="ingest-vectorize"
+    )
+    report = {"objects": 0, "failed": 0}
+    start = time.perf_counter()
+    for position, batch, batch_vectors in batches:
+        uuids = [
+            chunk_uuid(content_hash, position + offset) for offset in range(len(batch))
+        ]
+        with metrics.timed("ingest"):
+            batch_report = store.add(
+                session_id, batch, file_id, vectors=batch_vectors, uuids=uuids
+            )
+        report["objects"] += batch_report["objects"]
+        report["failed"] += batch_report["failed"]
+        if vector_writer is None:
+            continue
+        if batch_vectors is None and batch_report["failed"] == 0:
+            batch_vectors = store.get_vectors(session_id, uuids)
+        if batch_vectors is None:
+            # The vectors of the file are incomplete, so none of them are cached.
+            vector_writer.discard()
+            vector_writer = None
+        else:
+            vector_writer.write(batch_vectors)
+    report["seconds"] = time.perf_counter() - start
+    report["objects_per_sec"] = (
+        report["objects"] / report["seconds"] if report["seconds"] > 0 else 0.0
+    )
+    return report
+
+
+def _vectors_key(store, encode_locally: bool) -> str:
+    """Name the cached vectors after where they were computed. Vectors of the store's own vectorizer are kept apart from
+    the ones encoded in this process: it runs its own model runtime on its own rendering of the text, so they do not
+    share a space with the query vectors encoded here, even for the same model.
+    """
+    if encode_locally:
+        return f"local-{embedding.DEFAULT_MODEL}"
+    return store.vectorizer
+
+
+def _vectorized(batches, vectors, encode_locally: bool):
+    """Yield (position of the first chunk, chunks, vectors) for each batch of chunks, see _ingest_file. The vectors are
+    None when the store is left to vectorize the chunks."""
+    position = 0
+    for batch in batches:
+        stop = position + len(batch)
+        if vectors is not None:
+            batch_vectors = vectors[position:stop]
+        elif encode_locally:
+            with metrics.timed("embedding"):
+                batch_vectors = embedding.encode_chunks(batch)
+        else:
+            batch_vectors = None
+        yield position, batch, batch_vectors
+        position = stop
+
+
+def _split_by_file(pages, file_count: int):
+    """Turn a stream of (file index, page text) pairs, see utils.iter_pages, into one iterator over the pages of each
+    file. Each iterator must be used up before the next one is taken."""
+    pages = iter(pages)
+    current = next(pages, None)
+
+    def file_pages(index):
+        nonlocal current
+        while current is not None and current[0] == index:
+            yield current[1]
+            current = next(pages, None)
+
+    for index in range(file_count):
+        yield file_pages(index)
+
+
+def chunk_uuid(content_hash: str, position: int) -> str:
+    """Return the uuid of the chunk at position in the file with the content hash. It is the one weaviate.util's
+    generate_uuid5 gives for (content_hash, position), which is how chunks were always identified.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, str((content_hash, position))))
+
+
+def warmup():
+    """This function loads everything ingestion and retrieval need: the sentence tokenizer, the vector store and the
+    embedding model. Importing this module stays fast because they are all loaded on first use, so servers call it once
+    before taking requests to keep the first upload or chat turn from paying for it.
+    """
+    with metrics.timed("warmup"):
+        _get_sentence_tokenizer()
+        vector_store.get_store()
+        embedding.warmup()
 
 
-def initiate_storage(weaviate_client):
-    """This function initiate the storage of the weaviate database. NOTE: this should only be called once for each user
-    session.
+def initiate_storage(session_id: str):
+    """This function initiates the storage of the session in the vector store. It is safe to call it again for the
+    same session: an existing index is kept as it is.
     Args:
-        weaviate_client: the database client that is used to create the collection.
+        session_id: the user session that owns the index
     """
-    try:
-        weaviate_client.collections.delete_all()  # clear any existing data so that new data is not polluted.
-        weaviate_client.collections.create(
-            name=class_name,
-            vectorizer_config=wvc.config.Configure.Vectorizer.text2vec_transformers(),
-            properties=[
-                wvc.config.Property(
-                    name="content",
-                    data_type=wvc.config.DataType.TEXT,
-                    vectorize_property_name=True,
-                    tokenization=wvc.config.Tokenization.LOWERCASE,
-                ),
-            ],
-        )
-    finally:
-        weaviate_client.close()
+    vector_store.get_store().create(session_id)
+
+
+def remove_file(session_id: str, file_id: int) -> int:
+    """This function removes all chunks of one file from the session's index, leaving the other files untouched.
+    Returns:
+        the number of chunks removed.
+    """
+    return vector_store.get_store().remove_file(session_id, file_id)
 
 
-def chunk_text(text: str, max_chunk_size: int):
+def drop_storage(session_id: str):
+    """This function deletes the session's index with all of its chunks."""
+    vector_store.get_store().drop(session_id)
+
+
+@metrics.timed("chunk")
+def chunk_text(text: str, max_chunk_size: int) -> list:
     """For the text from the entire file, this function tokenizes it by sentences, and then for each sentence, it
-    combines the max_chunk_size number of sentences together as a chunk and process it. The remainder of unprocessed
-    sentences will be processed as a chunk.
+    combines the max_chunk_size number of sentences together as a chunk. The remainder of sentences will be returned as
+    the last chunk.
     Args:
         text: the text from the entire file
         max_chunk_size: the max number of sentences to be included in a chunk
+    Returns:
+        the list of chunks, each being the sentences joined by a space.
     """
-    sentences = sent_tokenize(text)
-    chunks = []
+    return list(iter_chunks(sent_tokenize(text), max_chunk_size))
+
+
+def sent_tokenize(text: str) -> list:
+    """This function splits the text into sentences with nltk's punkt tokenizer."""
+    return _get_sentence_tokenizer()(text)
+
+
+def _get_sentence_tokenizer():
+    """Return nltk's sent_tokenize once the punkt data it needs was found, importing nltk on first use only."""
+    global _sentence_tokenizer
+    if _sentence_tokenizer is None:
+        with _sentence_tokenizer_lock:
+            if _sentence_tokenizer is None:
+                # nltk takes seconds to import, as it pulls in scipy, and is only needed once text is chunked.
+                import nltk
+                from nltk.tokenize import sent_tokenize as tokenize
 
-    for sentence in sentences:
-        chunks.append(sentence)
-        if len(chunks) == max_chunk_size:
-            process_chunk(chunks)
-            chunks = []
-    if chunks:
-        process_chunk(chunks)
+                punkt_dir = os.path.abspath(PUNKT_DATA_DIR)
+                if punkt_dir not in nltk.data.path:
+                    nltk.data.path.insert(0, punkt_dir)
+                try:
+                    nltk.data.find("tokenizers/punkt")
+                except LookupError:
+                    raise LookupError(
+                        f"nltk's punkt sentence tokenizer is not installed. Download it with: "
+                        f"python -m nltk.downloader -d {punkt_dir} punkt"
+                    ) from None
+                _sentence_tokenizer = tokenize
+    return _sentence_tokenizer
 
 
-def process_chunk(chunks: []):
-    """Chunks will be joined together and stored in the database."""
-    content = " ".join(chunks)
-    add_text_chunk_to_db(content)
+def split_sentences(pages):
+    """This function tokenizes the text of a file by sentences one page at a time, so the whole text is never held in
+    memory. The last sentence of each page is carried over to the next one, where it may continue, which gives the same
+    sentences as tokenizing the pages joined by newlines.
+    Args:
+        pages: an iterable over the text of each page
+    Yields:
+        the sentences, in order.
+    """
+    carry = ""
+    for page in pages:
+        with metrics.timed("chunk"):
+            sentences = sent_tokenize(f"{carry}\n{page}" if carry else page)
+        if not sentences:
+            carry = ""
+            continue
+        yield from sentences[:-1]
+        carry = sentences[-1]
+        if len(carry) > MAX_CARRY_CHARS:
+            yield carry
+            carry = ""
+    if carry:
+        yield carry
+
+
+def iter_chunks(sentences, max_chunk_size: int):
+    """This function combines every max_chunk_size sentences together as a chunk, the remainder of sentences being the
+    last chunk, like chunk_text does for a whole text.
+    Args:
+        sentences: an iterable over the sentences of a file
+        max_chunk_size: the max number of sentences to be included in a chunk
+    Yields:
+        the chunks, each being the sentences joined by a space.
+    """
+    for sentences_of_chunk in pipeline.batched(sentences, max_chunk_size):
+        yield " ".join(sentences_of_chunk)
 
 
-def semantic_search(query: str, chunk_num: int) -> str:
+def semantic_search(
+    query: str, chunk_num: int, session_id: str, mode: str = None
+) -> str:
     """This functions takes a query string and chunk_num integer as input. The query string is used as the criterion for
     query: convert the string to a vector and find the chunk_num closest chunks, which combined to be the output.
     Args:
         query: the string that user inputs as the query
         chunk_num: the number of chunks to be used in output, meaning how long would be the context information.
+        session_id: the user session whose index is searched
+        mode: the retrieval mode, see search_chunks
     """
-    client = weaviate.connect_to_local(host="weaviate", port=8080, grpc_port=50051)
-    try:
-        collection = client.collections.get(class_name)
-        response = collection.query.fetch_objects(include_vector=True)
-        vectors = [o.vector["default"] for o in response.objects]
-
-        model = SentenceTransformer("sentence-transformers/multi-qa-MiniLM-L6-cos-v1")
-        query_vector = model.encode(query)
-
-        dot_product = np.dot(vectors, query_vector)
-        query_norm = np.linalg.norm(query_vector)
-        chunk_norms = np.linalg.norm(vectors, axis=1)
-        cosine_sim = dot_product / (query_norm * chunk_norms)
-        max_indices = np.argsort(cosine_sim)[-chunk_num:]
-        most_sim_contents = [
-            response.objects[i].properties["content"] for i in max_indices
-        ]
-        return " ".join(most_sim_contents)
+    chunks = search_chunks(query, chunk_num, session_id, mode)
+    return " ".join(chunk["content"] for chunk in chunks)
+
 
-    finally:
-        client.close()
+@metrics.timed("retrieval")
+def search_chunks(
+    query: str, chunk_num: int, session_id: str, mode: str = None
+) -> list:
+    """This function finds the chunk_num chunks closest to the query in the session's index.
+    Args:
+        query: the string that user inputs as the query
+        chunk_num: the number of chunks to return
+        session_id: the user session whose index is searched
+        mode: one of "near_vector" (default), "near_text" or "local". The first two let weaviate run the nearest
+            neighbour search and only return the winning chunks; "local" scores every stored vector in Python. The
+            numpy store always searches exactly and ignores the mode.
+    Returns:
+        the chunks as dicts with their uuid and content, most similar first.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    return vector_store.get_store().search(session_id, query, chunk_num, mode)
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Maximum number of answers kept. The least recently used answer is evicted first. 0 disables the cache.
+MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_SIZE", "512"))
+# Answers older than this many seconds are not served anymore.
+TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# Minimum cosine similarity between two query embeddings for them to count as the same question.
+SIMILARITY_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+logger = logging.getLogger(__name__)
+
+
+def context_fingerprint(chunk_ids) -> str:
+    """Hash the ids of the retrieved chunks. The order is ignored, so the same context retrieved with slightly
+    different scores still matches."""
+    return hashlib.sha256("\n".join(sorted(chunk_ids)).encode()).hexdigest()
+
+
+class AnswerCache:
+    """A cache of LLM answers. An answer is reused when the new query embedding is close enough to a cached one and
+    exactly the same chunks were retrieved as context, so the answer is grounded in the same text.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MAX_ENTRIES,
+        ttl: float = TTL,
+        threshold: float = SIMILARITY_THRESHOLD,
+    ):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._threshold = threshold
+        # entry id -> (fingerprint, unit query vector, answer, time it was stored), least recently used first.
+        self._entries = OrderedDict()
+        # fingerprint -> ids of the entries for that context, so a lookup only compares against those.
+        self._by_fingerprint = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get(self, query_vector, chunk_ids):
+        """Return the cached answer for a similar query over the same chunks, or None."""
+        fingerprint = context_fingerprint(chunk_ids)
+        query_vector = _unit(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_score = None, self._threshold
+            for entry_id in list(self._by_fingerprint.get(fingerprint, ())):
+                _, vector, _, stored_at = self._entries[entry_id]
+                if now - stored_at > self._ttl:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(vector, query_vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._entries.move_to_end(best_id)
+            answer = self._entries[best_id][2]
+        logger.info("Answer cache hit with query similarity %.3f", best_score)
+        return answer
+
+    def put(self, query_vector, chunk_ids, answer: str):
+        if self._max_entries <= 0:
+            return
+        fingerprint = context_fingerprint(chunk_ids)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (
+                fingerprint,
+                _unit(query_vector),
+                answer,
+                time.monotonic(),
+            )
+            self._by_fingerprint.setdefault(fingerprint, set()).add(entry_id)
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters and occupancy of the cache."""
+        with self._lock:
+            hits = self._counters["hits"]
+            misses = self._counters["misses"]
+            size = len(self._entries)
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "size": size,
+            "capacity": self._max_entries,
+        }
+
+    def clear(self):
+        """Drop all cached answers and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._by_fingerprint.clear()
+            self._counters["hits"] = 0
+            self._counters["misses"] = 0
+
+    def _remove(self, entry_id):
+        """Must be called with the lock held."""
+        fingerprint = self._entries.pop(entry_id)[0]
+        ids = self._by_fingerprint[fingerprint]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_fingerprint[fingerprint]
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> AnswerCache:
+    """Return the process-wide answer cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
@@ -0,0 +1,129 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "uploads")
+# Size of the pieces an upload is copied and hashed in, so it never has to be held in memory at once.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobTooLargeError(ValueError):
+    """Raised when more than its max_bytes is written to a BlobWriter."""
+
+
+class BlobStore:
+    """A content-addressed store for uploaded files. Each blob is saved once under the SHA-256 of its contents, so
+    identical uploads share the same file on disk."""
+
+    def __init__(self, root: str = BLOB_STORE_DIR):
+        # Absolute, so that the paths stay valid in extraction worker processes.
+        self._root = os.path.abspath(root)
+
+    def path(self, content_hash: str) -> str:
+        return os.path.join(self._root, content_hash[:2], content_hash)
+
+    def exists(self, content_hash: str) -> bool:
+        return os.path.exists(self.path(content_hash))
+
+    def put_bytes(self, data) -> tuple:
+        """Store the data and return its (sha256, size)."""
+        return self.put_stream(io.BytesIO(data))
+
+    def put_stream(self, stream, chunk_size: int = COPY_CHUNK_SIZE) -> tuple:
+        """Copy a readable binary stream into the store piece by piece while hashing it.
+        Returns:
+            the (sha256, size) of the stored blob.
+        """
+        writer = self.writer()
+        try:
+            while True:
+                piece = stream.read(chunk_size)
+                if not piece:
+                    break
+                writer.write(piece)
+            return writer.commit()
+        finally:
+            writer.discard()
+
+    def writer(self, max_bytes: int = None) -> "BlobWriter":
+        """Return a BlobWriter to store a blob that arrives in pieces, at most max_bytes long if given."""
+        return BlobWriter(self, max_bytes)
+
+    def open(self, content_hash: str):
+        """Open the blob for streaming reads."""
+        return open(self.path(content_hash), "rb")
+
+    def _commit(self, tmp_path: str, content_hash: str):
+        """Move a fully written temporary file to its content address. If the blob already exists, the copy is
+        dropped."""
+        final_path = self.path(content_hash)
+        if os.path.exists(final_path):
+            os.unlink(tmp_path)
+            return
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+
+
+class BlobWriter:
+    """A writable file object whose contents become a blob. What is written goes straight to a temporary file in the
+    store and is hashed on the way, so the blob is never held in memory; commit() then moves the file to its content
+    address, while discard() drops it. Werkzeug's form parser can stream the file parts of an upload into it, see
+    uploads.receive_files.
+    """
+
+    def __init__(self, store: BlobStore, max_bytes: int = None):
+        self._store = store
+        self._max_bytes = max_bytes
+        self._digest = hashlib.sha256()
+        self.size = 0
+        os.makedirs(store._root, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=store._root, suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data) -> int:
+        if self._max_bytes is not None and self.size + len(data) > self._max_bytes:
+            raise BlobTooLargeError(f"The file is larger than {self._max_bytes} bytes")
+        self._digest.update(data)
+        self._file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        # The form parser rewinds each file part once it is written. Nothing is read back, so the position is left
+        # alone, which keeps the hash in step with the file.
+        return self.size
+
+    def tell(self) -> int:
+        return self.size
+
+    def commit(self) -> tuple:
+        """Store the written contents under their hash.
+        Returns:
+            the (sha256, size) of the stored blob.
+        """
+        self._file.close()
+        content_hash = self._digest.hexdigest()
+        self._store._commit(self._tmp_path, content_hash)
+        return content_hash, self.size
+
+    def discard(self):
+        """Drop the written contents unless they were committed. It is safe to call more than once."""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> BlobStore:
+    """Return the process-wide blob store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore()
+    return _store
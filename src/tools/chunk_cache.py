@@ -0,0 +1,275 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+CACHE_DIR = os.environ.get("CHUNK_CACHE_DIR", "chunk_cache")
+# Once the cache grows past this many bytes, the least recently used files are evicted.
+MAX_BYTES = int(os.environ.get("CHUNK_CACHE_MAX_BYTES", str(2 * 1024**3)))
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(data) -> str:
+    """Return the SHA-256 hex digest of the file contents, which identifies the file in the cache."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ChunkCache:
+    """A persistent cache of the work done to index a file, keyed by the hash of its contents: the extracted pages, the
+    chunks for a given chunk size and the chunk vectors for a given model. Every file has its own directory, and its
+    modification time is refreshed on each read so that eviction drops the least recently used files first.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self._root = root
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def iter_pages(self, content_hash: str):
+        """Return an iterator over the cached pages that reads them one at a time, or None if they are not cached."""
+        return self._read_lines(content_hash, "pages.jsonl")
+
+    def page_writer(self, content_hash: str) -> "EntryWriter":
+        """Return a writer that caches the pages one at a time as they are extracted, see EntryWriter."""
+        return EntryWriter(
+            self._path(content_hash, "pages.jsonl"),
+            on_commit=lambda count: self._write_json(
+                content_hash, "meta.json", {"pages": count}
+            ),
+        )
+
+    def get_page_count(self, content_hash: str):
+        meta = self._read_json(content_hash, "meta.json")
+        return meta["pages"] if meta else None
+
+    def iter_chunks(self, content_hash: str, chunk_size: int):
+        """Return an iterator over the cached chunks that reads them one at a time, or None if they are not cached."""
+        return self._read_lines(content_hash, f"chunks-{chunk_size}.jsonl")
+
+    def chunk_writer(self, content_hash: str, chunk_size: int) -> "EntryWriter":
+        """Return a writer that caches the chunks one at a time as they are made, see EntryWriter."""
+        return EntryWriter(self._path(content_hash, f"chunks-{chunk_size}.jsonl"))
+
+    def get_vectors(self, content_hash: str, chunk_size: int, model_name: str):
+        """Return the cached vectors as a read-only memory-mapped float32 array, or None if they are not cached."""
+        path = self._path(content_hash, self._vectors_name(chunk_size, model_name))
+        if not os.path.exists(path):
+            self._count("misses")
+            return None
+        self._touch(content_hash)
+        self._count("hits")
+        return np.load(path, mmap_mode="r")
+
+    def vector_writer(
+        self, content_hash: str, chunk_size: int, model_name: str
+    ) -> "VectorWriter":
+        """Return a writer that caches the vectors a batch of rows at a time as they are computed, see EntryWriter."""
+        name = self._vectors_name(chunk_size, model_name)
+        return VectorWriter(self._path(content_hash, name))
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits in max_bytes."""
+        if not os.path.isdir(self._root):
+            return
+        entries = []
+        total = 0
+        for prefix in os.listdir(self._root):
+            prefix_dir = os.path.join(self._root, prefix)
+            for content_hash in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, content_hash)
+                try:
+                    size = _dir_size(entry_dir)
+                    entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+                except FileNotFoundError:
+                    continue  # evicted by another process meanwhile
+                total += size
+        for _, size, entry_dir in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            logger.info("Evicted %s from the chunk cache", entry_dir)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def _vectors_name(self, chunk_size: int, model_name: str) -> str:
+        return f"vectors-{chunk_size}-{model_name.replace('/', '--')}.npy"
+
+    def _path(self, content_hash: str, name: str = "") -> str:
+        return os.path.join(self._root, content_hash[:2], content_hash, name)
+
+    def _read_json(self, content_hash: str, name: str):
+        try:
+            with open(self._path(content_hash, name)) as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._touch(content_hash)
+        self._count("hits")
+        return value
+
+    def _read_lines(self, content_hash: str, name: str):
+        try:
+            f = open(self._path(content_hash, name))
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._touch(content_hash)
+        self._count("hits")
+        return _json_lines(f)
+
+    def _write_json(self, content_hash: str, name: str, value):
+        self._write(content_hash, name, lambda f: f.write(json.dumps(value).encode()))
+
+    def _write(self, content_hash: str, name: str, write):
+        """Write to a temporary file and rename it into place, so readers never see a partially written entry."""
+        entry_dir = self._path(content_hash)
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, os.path.join(entry_dir, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _touch(self, content_hash: str):
+        try:
+            os.utime(self._path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+class EntryWriter:
+    """Writes one cache entry a piece at a time, so an entry never has to be held in memory whole. The pieces go to a
+    temporary file that is renamed into place when the writer is closed without an error, so readers never see a
+    partially written entry. Calling discard() drops what was written instead, e.g. when the entry turns out incomplete.
+    Use it as a context manager:
+    with cache.chunk_writer(content_hash, 3) as writer:
+        writer.write(chunk)
+    """
+
+    def __init__(self, path: str, on_commit=None):
+        self._path = path
+        self._on_commit = on_commit
+        self._discarded = False
+        self.count = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, item):
+        """Append one JSON serializable item, stored on a line of its own."""
+        self._file.write(json.dumps(item).encode() + b"\n")
+        self.count += 1
+
+    def discard(self):
+        self._discarded = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is not None or self._discarded:
+            os.unlink(self._tmp_path)
+            return
+        try:
+            self._commit()
+        except BaseException:
+            if os.path.exists(self._tmp_path):
+                os.unlink(self._tmp_path)
+            raise
+        if self._on_commit:
+            self._on_commit(self.count)
+
+    def _commit(self):
+        os.replace(self._tmp_path, self._path)
+
+
+class VectorWriter(EntryWriter):
+    """An EntryWriter of a .npy file of float32 vectors, written a batch of rows at a time. The rows are appended to
+    the temporary file as raw floats, and the .npy header, which needs the final number of rows, is put in front of
+    them on commit. A writer given no rows is discarded, as an empty entry helps nobody.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._dimensions = None
+
+    def write(self, vectors):
+        """Append a 2-D batch of vectors."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._dimensions is None:
+            self._dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self._dimensions:
+            raise ValueError(
+                f"Vectors of {vectors.shape[1]} dimensions written after {self._dimensions}"
+            )
+        self._file.write(np.ascontiguousarray(vectors).tobytes())
+        self.count += len(vectors)
+
+    def _commit(self):
+        if self.count == 0:
+            os.unlink(self._tmp_path)
+            return
+        header = {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+            "fortran_order": False,
+            "shape": (self.count, self._dimensions),
+        }
+        fd, npy_path = tempfile.mkstemp(dir=os.path.dirname(self._path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, open(self._tmp_path, "rb") as rows:
+                np.lib.format.write_array_header_1_0(f, header)
+                shutil.copyfileobj(rows, f)
+            os.replace(npy_path, self._path)
+        except BaseException:
+            os.unlink(npy_path)
+            raise
+        os.unlink(self._tmp_path)
+
+
+def _json_lines(f):
+    with f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    for name in os.listdir(path):
+        try:
+            size += os.path.getsize(os.path.join(path, name))
+        except FileNotFoundError:
+            pass  # a temporary file that was renamed meanwhile
+    return size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ChunkCache:
+    """Return the process-wide chunk cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ChunkCache()
+    return _cache
@@ -0,0 +1,146 @@
+import logging
+import os
+import re
+
+# Upper bound on the prompt tokens sent to the model for one chat turn: history, retrieved context and the query.
+TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1024"))
+# Number of most recent messages that may be included as history.
+HISTORY_MESSAGES = int(os.environ.get("CONTEXT_HISTORY_MESSAGES", "5"))
+# Instructions at the start of every prompt. Together with the pinned context it forms a prefix that stays the same for
+# all turns of a session, which the llama.cpp server can reuse from its prompt cache instead of evaluating it again.
+SYSTEM_PROMPT = os.environ.get(
+    "CHAT_SYSTEM_PROMPT",
+    "You are a helpful assistant. Answer the user's questions using the context from their documents.",
+)
+# Chunks whose word trigrams overlap at least this much with an already selected chunk are dropped.
+DUPLICATE_THRESHOLD = float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+logger = logging.getLogger(__name__)
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of tokens the model sees for the text. Every word and punctuation mark counts as one token,
+    plus one more for every 8 characters of a long word, which is how sub-word tokenizers split rare words. This errs
+    on the high side, so the budget is not exceeded in practice."""
+    return sum(1 + len(piece) // 8 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    if len(words) < 3:
+        return {" ".join(words)}
+    return {" ".join(trigram) for trigram in zip(words, words[1:], words[2:])}
+
+
+def _is_near_duplicate(shingles: set, selected: list, threshold: float) -> bool:
+    """A chunk is a near duplicate if most of it, or most of an already selected chunk, is shared between the two.
+    Comparing against the smaller set also catches chunks that are contained in one another.
+    """
+    for other in selected:
+        overlap = len(shingles & other)
+        if overlap and overlap / min(len(shingles), len(other)) >= threshold:
+            return True
+    return False
+
+
+def select_chunks(chunks: list, budget: int, threshold: float = None) -> list:
+    """Pick chunks in order of relevance, skipping near duplicates and chunks that no longer fit in the budget.
+    Args:
+        chunks: the chunk texts, most relevant first
+        budget: the number of tokens the selected chunks may use together
+        threshold: the overlap above which a chunk counts as a near duplicate, defaults to DUPLICATE_THRESHOLD
+    """
+    threshold = DUPLICATE_THRESHOLD if threshold is None else threshold
+    selected = []
+    selected_shingles = []
+    used = 0
+    for chunk in chunks:
+        shingles = _shingles(chunk)
+        if _is_near_duplicate(shingles, selected_shingles, threshold):
+            continue
+        tokens = count_tokens(chunk)
+        if used + tokens > budget:
+            continue
+        selected.append(chunk)
+        selected_shingles.append(shingles)
+        used += tokens
+    return selected
+
+
+def build_messages(
+    query_text: str, chunks: list, history: list, budget: int = None, pinned=None
+):
+    """This function assembles the messages for one chat turn within a token budget. The prompt starts with what stays
+    the same over the session, so that the server can reuse its cached evaluation of it: the system prompt with the
+    context pinned to the session, then the history, then the query. Chunks retrieved for this turn that are not
+    pinned follow the query, most relevant first and without near duplicates. Whatever budget is left is filled with
+    the most recent history messages, so the oldest ones are trimmed first.
+    Args:
+        query_text: the user input
+        chunks: the retrieved chunk texts, most relevant first
+        history: the earlier messages of the conversation as dicts with role and content, oldest first
+        budget: the token budget, defaults to TOKEN_BUDGET
+        pinned: the chunk texts pinned to the session. None pins the chunks selected for this turn.
+    Returns:
+        the list of messages for the chat completion, and a dict with the token counts before and after packing and
+        the pinned chunk texts.
+    """
+    budget = budget or TOKEN_BUDGET
+    history = history[-HISTORY_MESSAGES:]
+
+    remaining = budget - count_tokens(query_text) - count_tokens(SYSTEM_PROMPT)
+    remaining -= 2 * count_tokens("\nContext: ")
+    if pinned is None:
+        pinned = select_chunks(chunks, max(remaining, 0))
+        fresh = []
+    else:
+        remaining -= count_tokens(" ".join(pinned))
+        fresh = select_chunks(
+            [chunk for chunk in chunks if chunk not in pinned], max(remaining, 0)
+        )
+    remaining -= count_tokens(" ".join(fresh))
+
+    kept_history = []
+    for message in reversed(history):
+        tokens = count_tokens(message["content"])
+        if tokens > remaining:
+            break
+        kept_history.insert(0, message)
+        remaining -= tokens
+
+    messages = [
+        {"role": "system", "content": f"{SYSTEM_PROMPT}\nContext: {' '.join(pinned)}"}
+    ]
+    messages += [
+        {"role": message["role"], "content": message["content"]}
+        for message in kept_history
+    ]
+    query = f"{query_text}\nContext: {' '.join(fresh)}" if fresh else query_text
+    messages.append({"role": "user", "content": query})
+
+    # Without packing, the query would carry every retrieved chunk that is not pinned, after the whole history.
+    unpinned = " ".join(chunk for chunk in chunks if chunk not in pinned)
+    unpacked = sum(count_tokens(message["content"]) for message in history)
+    unpacked += count_tokens(messages[0]["content"])
+    unpacked += count_tokens(
+        f"{query_text}\nContext: {unpinned}" if unpinned else query_text
+    )
+    packed = sum(count_tokens(message["content"]) for message in messages)
+    used_chunks = [chunk for chunk in chunks if chunk in pinned or chunk in fresh]
+    stats = {
+        "tokens": packed,
+        "tokens_saved": unpacked - packed,
+        "chunks_dropped": len(chunks) - len(used_chunks),
+        "history_dropped": len(history) - len(kept_history),
+        "pinned": pinned,
+    }
+    logger.info(
+        "Packed prompt into %d tokens, saved %d tokens (%d chunks and %d history messages dropped)",
+        stats["tokens"],
+        stats["tokens_saved"],
+        stats["chunks_dropped"],
+        stats["history_dropped"],
+    )
+    return messages, stats
@@ -0,0 +1,131 @@
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MODEL = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+# Chunks encoded per forward pass when embedding documents in-process.
+BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+# Threads torch may use for encoding. 0 keeps torch's default, which is one per core.
+THREADS = int(os.environ.get("EMBEDDING_THREADS", "0"))
+
+# Loaded models are shared by every request thread in the process.
+_models = {}
+_models_lock = threading.Lock()
+
+# LRU cache of query embeddings keyed by (model name, normalized query).
+_query_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_counters = {"hits": 0, "misses": 0}
+
+
+def get_model(model_name: str = DEFAULT_MODEL):
+    """This function returns the process-wide SentenceTransformer for model_name, loading it on first use only.
+    Args:
+        model_name: the name of the sentence-transformers model to load
+    """
+    model = _models.get(model_name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = _load_model(model_name)
+                _models[model_name] = model
+    return model
+
+
+def _load_model(model_name: str):
+    # Imported on first use: sentence_transformers pulls in torch and transformers, which take seconds to import.
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+def warmup(model_name: str = DEFAULT_MODEL):
+    """Load the model and run one encode so that the first user query does not pay for loading and graph setup."""
+    get_model(model_name).encode("warmup")
+
+
+def encode_chunks(
+    texts: list,
+    model_name: str = DEFAULT_MODEL,
+    batch_size: int = None,
+    threads: int = None,
+):
+    """This function converts document chunks to vectors in batches, with the same model that encodes the queries.
+    Args:
+        texts: the chunk texts
+        model_name: the name of the sentence-transformers model used for encoding
+        batch_size: chunks per forward pass, defaults to BATCH_SIZE
+        threads: threads torch may use, defaults to THREADS. The setting is process-wide.
+    Returns:
+        a float32 array with one row per chunk.
+    """
+    threads = THREADS if threads is None else threads
+    if threads > 0:
+        import torch
+
+        torch.set_num_threads(threads)
+    return get_model(model_name).encode(
+        texts,
+        batch_size=batch_size or BATCH_SIZE,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+
+
+def normalize_query(query: str) -> str:
+    """Queries that only differ in case or whitespace share one cache entry. The MiniLM tokenizer is uncased, so this
+    does not change the resulting embedding."""
+    return " ".join(query.lower().split())
+
+
+def encode_query(query: str, model_name: str = DEFAULT_MODEL):
+    """This function converts the query to a vector, reusing the cached embedding if the same query was seen recently.
+    Args:
+        query: the string that user inputs as the query
+        model_name: the name of the sentence-transformers model used for encoding
+    """
+    key = (model_name, normalize_query(query))
+    with _cache_lock:
+        vector = _query_cache.get(key)
+        if vector is not None:
+            _query_cache.move_to_end(key)
+            _cache_counters["hits"] += 1
+            return vector
+        _cache_counters["misses"] += 1
+
+    vector = get_model(model_name).encode(key[1])
+    # The same array is handed to every caller that hits the cache, so it must not be mutated in place.
+    vector.setflags(write=False)
+
+    with _cache_lock:
+        _query_cache[key] = vector
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return vector
+
+
+def cache_stats() -> dict:
+    """Return the hit/miss counters and occupancy of the query embedding cache."""
+    with _cache_lock:
+        hits = _cache_counters["hits"]
+        misses = _cache_counters["misses"]
+        size = len(_query_cache)
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "size": size,
+        "capacity": QUERY_CACHE_SIZE,
+    }
+
+
+def clear_cache():
+    """Drop all cached query embeddings and reset the counters."""
+    with _cache_lock:
+        _query_cache.clear()
+        _cache_counters["hits"] = 0
+        _cache_counters["misses"] = 0
@@ -0,0 +1,38 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of ingestion jobs that run at the same time. Each job already fans its pdf extraction out to worker
+# processes, so a small number of job threads is enough.
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide pool that runs background jobs, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=INGEST_WORKERS, thread_name_prefix="ingest"
+                )
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in the background and return its Future. Exceptions that escape fn are logged, since
+    nobody may ever look at the Future."""
+    future = get_executor().submit(fn, *args, **kwargs)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Background job failed", exc_info=future.exception())
@@ -0,0 +1,419 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from src.tools import metrics
+
+# The llamafile server, or any other OpenAI-compatible server.
+SERVER_URL = os.environ.get("EXTERNAL_SERVER_URL", "http://localhost:8081")
+# Comma separated URLs of several such servers to spread the chats over. Defaults to EXTERNAL_SERVER_URL alone.
+BACKENDS = [
+    url.strip().rstrip("/")
+    for url in os.environ.get("LLM_BACKENDS", SERVER_URL).split(",")
+    if url.strip()
+]
+ROUTINGS = ("least_outstanding", "session")
+# "least_outstanding" sends each chat to the backend with the fewest requests in progress. "session" keeps the chats
+# of a session on one backend, so that its prompt cache can be reused.
+ROUTING = os.environ.get("LLM_ROUTING", "least_outstanding")
+# Seconds to wait for a completion before giving up.
+TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "300"))
+# Seconds between health checks of a backend, and how long a health check may take.
+HEALTH_CHECK_INTERVAL = float(os.environ.get("LLM_HEALTH_CHECK_INTERVAL", "30"))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("LLM_HEALTH_CHECK_TIMEOUT", "5"))
+# Consecutive failed requests after which a backend is ejected.
+MAX_FAILURES = int(os.environ.get("LLM_MAX_FAILURES", "2"))
+# A backend whose average time per output token is this many times the fastest backend's is ejected as slow. Per token,
+# so that a backend is not judged by the length of the answers it happened to generate.
+SLOW_FACTOR = float(os.environ.get("LLM_SLOW_FACTOR", "3"))
+# Requests with a known output length a backend must have finished since it was last judged, before it can be
+# ejected as slow or serve as the fastest backend others are compared with.
+SLOW_MIN_SAMPLES = int(os.environ.get("LLM_SLOW_MIN_SAMPLES", "5"))
+# Seconds an ejected backend gets no requests. After that it gets requests again, whether or not it has recovered.
+EJECT_SECONDS = float(os.environ.get("LLM_EJECT_SECONDS", "30"))
+# Weight of the latest request in a backend's average time per output token.
+LATENCY_SMOOTHING = 0.2
+# Generations running at once over all backends. Matches the parallel slots of the servers: more only makes every
+# answer slower.
+MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", str(len(BACKENDS))))
+# Chat requests waiting for a free slot. Requests beyond that are turned away at once with a 503.
+MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "8"))
+# Seconds a chat request waits in the queue before it is turned away.
+QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "60"))
+
+# Ask llama.cpp to keep the evaluated prompt of a request, so the next request with the same prefix only evaluates the
+# rest.
+CACHE_PROMPT = os.environ.get("LLM_CACHE_PROMPT", "1") == "1"
+# Parallel slots of each llama.cpp server (its --parallel). When set, every session is pinned to one slot, so its
+# cached prompt is not overwritten by other sessions in between. Combine with LLM_ROUTING=session for several backends.
+SLOTS = int(os.environ.get("LLM_SLOTS", "0"))
+
+QUEUE_WAIT_STAGE = "llm_queue_wait"
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a generation could not be admitted because the queue is full or the wait timed out."""
+
+
+class Limiter:
+    """Admission control for the LLM: at most max_in_flight generations run at once and at most max_queue requests
+    wait for one of them to finish, first come first served. Requests that find the queue full fail immediately, so
+    the server is not buried under work whose callers have given up by the time it gets to it.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_queue: int = MAX_QUEUE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+    ):
+        self._max_in_flight = max_in_flight
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self._in_flight = 0
+        # Events of the waiting requests, oldest first. A finished generation hands its slot to the first one.
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self._counters = {"admitted": 0, "rejected": 0, "timed_out": 0}
+
+    def acquire(self):
+        """Take a generation slot, waiting in the queue if all are in use. The time spent waiting is recorded as the
+        llm_queue_wait stage."""
+        start = time.perf_counter()
+        with self._lock:
+            if self._in_flight < self._max_in_flight and not self._waiters:
+                self._in_flight += 1
+                self._counters["admitted"] += 1
+                metrics.observe(QUEUE_WAIT_STAGE, 0.0)
+                return
+            if len(self._waiters) >= self._max_queue:
+                self._counters["rejected"] += 1
+                raise QueueFullError(
+                    f"{len(self._waiters)} requests are already waiting for the model"
+                )
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        granted = waiter.wait(self._queue_timeout)
+        with self._lock:
+            # The slot may have been handed over between the timeout and taking the lock.
+            if not granted and not waiter.is_set():
+                self._waiters.remove(waiter)
+                self._counters["timed_out"] += 1
+                raise QueueFullError(
+                    f"No generation slot became free within {self._queue_timeout}s"
+                )
+            self._counters["admitted"] += 1
+        metrics.observe(QUEUE_WAIT_STAGE, time.perf_counter() - start)
+
+    def release(self):
+        """Give the slot back, or straight to the longest waiting request."""
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        """Hold a generation slot for the duration of the with-block."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "max_in_flight": self._max_in_flight,
+                "max_queue": self._max_queue,
+            }
+
+
+def connect(url: str):
+    """Create a client of one backend. It keeps its HTTP connections alive between requests, so a chat turn does not
+    pay for a new connection."""
+    # Imported on first use, like the other heavy clients: the openai package and its models take a while to import.
+    from openai import OpenAI
+
+    return OpenAI(base_url=f"{url}/v1", api_key="sk-no-key-required", timeout=TIMEOUT)
+
+
+class Backend:
+    """One LLM server and what the router knows about it."""
+
+    def __init__(self, url: str, client):
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        # Moving average of the seconds per output token, None until a request reported its output tokens.
+        self.latency = None
+        # Requests that went into the average since it was last reset.
+        self.samples = 0
+        self.ejected_until = 0.0
+        self.checked_at = time.monotonic()
+        # Whether a health check is running.
+        self.checking = False
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+
+class Generation:
+    """One request to a backend, yielded by Router.backend. The caller sets output_tokens once the answer is complete,
+    which lets the router judge the backend by its time per token."""
+
+    def __init__(self, client):
+        self.client = client
+        self.output_tokens = None
+
+
+class Router:
+    """Spreads chat requests over several OpenAI-compatible backends. Backends that fail MAX_FAILURES requests in a row,
+    take SLOW_FACTOR times longer per output token than the fastest one over SLOW_MIN_SAMPLES requests or fail a health
+    check are ejected for EJECT_SECONDS, after which they simply get requests again. Health checks run in the
+    background every HEALTH_CHECK_INTERVAL, ejected backends included, so a backend that is still down is ejected again
+    by its next check or failed requests. If every backend is ejected the requests go to all of them rather than
+    failing outright.
+    """
+
+    def __init__(
+        self,
+        urls: list = None,
+        routing: str = ROUTING,
+        client_factory=connect,
+        health_check_interval: float = HEALTH_CHECK_INTERVAL,
+        eject_seconds: float = EJECT_SECONDS,
+        max_failures: int = MAX_FAILURES,
+        slow_factor: float = SLOW_FACTOR,
+        slow_min_samples: int = SLOW_MIN_SAMPLES,
+    ):
+        if routing not in ROUTINGS:
+            raise ValueError(f"Unknown LLM routing: {routing}")
+        urls = urls or BACKENDS
+        if not urls:
+            raise ValueError("No LLM backends configured")
+        self.backends = [Backend(url, client_factory(url)) for url in urls]
+        self._routing = routing
+        self._health_check_interval = health_check_interval
+        self._eject_seconds = eject_seconds
+        self._max_failures = max_failures
+        self._slow_factor = slow_factor
+        self._slow_min_samples = slow_min_samples
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def backend(self, session_id: str = None):
+        """Pick a backend for one request and yield a Generation with its client. How the with-block ends is recorded:
+        an exception counts as a failure of the backend, leaving normally as a success with its latency.
+        """
+        backend = self.pick(session_id)
+        generation = Generation(backend.client)
+        start = time.perf_counter()
+        try:
+            yield generation
+        except Exception:
+            self._finish(backend, None)
+            raise
+        except BaseException:
+            # Cancelled, for instance a stream closed by the client: says nothing about the backend.
+            self._finish(backend, None, failed=False)
+            raise
+        else:
+            self._finish(backend, time.perf_counter() - start, generation.output_tokens)
+
+    def pick(self, session_id: str = None) -> Backend:
+        """Choose the backend for a request and count it as outstanding. Every call must be matched by a _finish."""
+        now = time.monotonic()
+        with self._lock:
+            for backend in self.backends:
+                self._schedule_check(backend, now)
+            candidates = [b for b in self.backends if b.healthy(now)] or self.backends
+            if self._routing == "session" and session_id:
+                # Rendezvous hashing: a session stays on its backend, and only moves when that one is ejected.
+                backend = max(
+                    candidates,
+                    key=lambda b: hashlib.sha256(
+                        f"{session_id}:{b.url}".encode()
+                    ).digest(),
+                )
+            else:
+                backend = min(
+                    candidates, key=lambda b: (b.outstanding, b.latency or 0.0)
+                )
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def check(self, backend: Backend) -> bool:
+        """Health check one backend by listing its models. A backend that fails it is ejected."""
+        try:
+            backend.client.with_options(timeout=HEALTH_CHECK_TIMEOUT).models.list()
+            healthy = True
+        except Exception as e:
+            logger.warning("LLM backend %s failed its health check: %s", backend.url, e)
+            healthy = False
+        with self._lock:
+            backend.checked_at = time.monotonic()
+            backend.checking = False
+            if healthy:
+                backend.consecutive_failures = 0
+            else:
+                self._eject(backend, "failed health check")
+        return healthy
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        stats = {}
+        with self._lock:
+            for index, backend in enumerate(self.backends):
+                stats[f"{index}_healthy"] = int(backend.healthy(now))
+                stats[f"{index}_outstanding"] = backend.outstanding
+                stats[f"{index}_requests"] = backend.requests
+                stats[f"{index}_failures"] = backend.failures
+                stats[f"{index}_seconds_per_token"] = backend.latency or 0.0
+        return stats
+
+    def _finish(
+        self, backend: Backend, seconds, output_tokens: int = None, failed: bool = True
+    ):
+        """Record the end of a request: its duration in seconds, or None if it did not succeed, and the number of
+        tokens it generated if known."""
+        with self._lock:
+            backend.outstanding -= 1
+            if seconds is None:
+                if failed:
+                    backend.failures += 1
+                    backend.consecutive_failures += 1
+                    if backend.consecutive_failures >= self._max_failures:
+                        self._eject(backend, "failed requests")
+                return
+            backend.consecutive_failures = 0
+            if _is_count(output_tokens) and output_tokens > 0:
+                per_token = seconds / output_tokens
+                if backend.latency is None:
+                    backend.latency = per_token
+                else:
+                    backend.latency += LATENCY_SMOOTHING * (per_token - backend.latency)
+                backend.samples += 1
+                self._eject_if_slow(backend)
+        metrics.observe(f"llm_backend_{self.backends.index(backend)}", seconds)
+
+    def _eject_if_slow(self, backend: Backend):
+        """Eject the backend if it is much slower per token than the fastest other healthy one. Only backends with
+        enough samples are compared, so one unlucky request decides nothing. Must be called with the lock held.
+        """
+        if backend.samples < self._slow_min_samples:
+            return
+        now = time.monotonic()
+        others = [
+            b.latency
+            for b in self.backends
+            if b is not backend
+            if b.healthy(now) and b.samples >= self._slow_min_samples
+        ]
+        if others and backend.latency > self._slow_factor * min(others):
+            self._eject(backend, f"slow, {backend.latency:.3f}s per output token")
+
+    def _eject(self, backend: Backend, reason: str):
+        """Take the backend out of rotation for a while. Its latency is forgotten, so that it is judged afresh when it
+        comes back. Must be called with the lock held."""
+        logger.warning("Ejecting LLM backend %s: %s", backend.url, reason)
+        backend.ejected_until = time.monotonic() + self._eject_seconds
+        backend.consecutive_failures = 0
+        backend.latency = None
+        backend.samples = 0
+
+    def _schedule_check(self, backend: Backend, now: float):
+        """Start a background health check of the backend if one is due. Must be called with the lock held."""
+        if backend.checking:
+            return
+        if now - backend.checked_at >= self._health_check_interval:
+            backend.checking = True
+            threading.Thread(target=self.check, args=(backend,), daemon=True).start()
+
+
+def request_options(session_id: str) -> dict:
+    """Return the llama.cpp specific fields of a chat completion request of the session, for the extra_body argument.
+    OpenAI-compatible servers that do not know them ignore them."""
+    options = {"cache_prompt": CACHE_PROMPT}
+    if SLOTS > 0:
+        slot = int.from_bytes(hashlib.sha256(session_id.encode()).digest()[:4], "big")
+        # llama.cpp calls the field id_slot, the older server in llamafile calls it slot_id.
+        options["id_slot"] = options["slot_id"] = slot % SLOTS
+    return options
+
+
+def record_prompt_tokens(response):
+    """Add the cached and evaluated prompt tokens reported for a completion, or for the last chunk of a stream, to the
+    totals and return them as a (cached, evaluated) pair. Returns None if the server reports neither. llama.cpp puts
+    them in a timings object next to the usage, newer versions also in usage.prompt_tokens_details.cached_tokens.
+    """
+    extra = getattr(response, "model_extra", None)
+    timings = extra.get("timings") if isinstance(extra, dict) else None
+    timings = timings if isinstance(timings, dict) else {}
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "prompt_tokens", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+
+    evaluated = timings.get("prompt_n")
+    cached = timings.get("cache_n", getattr(details, "cached_tokens", None))
+    if cached is None and _is_count(total) and _is_count(evaluated):
+        cached = total - evaluated
+    if evaluated is None and _is_count(total) and _is_count(cached):
+        evaluated = total - cached
+    if not (_is_count(cached) and _is_count(evaluated)):
+        return None
+    with _lock:
+        _prompt_tokens["cached"] += cached
+        _prompt_tokens["evaluated"] += evaluated
+    return cached, evaluated
+
+
+def prompt_token_stats() -> dict:
+    """Return the prompt tokens served from the server's cache and the ones it evaluated, summed over all requests."""
+    with _lock:
+        return dict(_prompt_tokens)
+
+
+def _is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+_prompt_tokens = {"cached": 0, "evaluated": 0}
+_router = None
+_limiter = None
+_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    """Return the process-wide router over the configured LLM backends, creating it on first use."""
+    global _router
+    if _router is None:
+        with _lock:
+            if _router is None:
+                _router = Router()
+    return _router
+
+
+def get_limiter() -> Limiter:
+    """Return the process-wide admission control of the LLM, creating it on first use."""
+    global _limiter
+    if _limiter is None:
+        with _lock:
+            if _limiter is None:
+                _limiter = Limiter()
+    return _limiter
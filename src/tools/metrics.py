@@ -0,0 +1,253 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the histogram buckets. They span from a cached query embedding to a long generation.
+BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+# Directory where every worker process of the WSGI server publishes its metrics, so that a scrape served by any of them
+# reports all of them. Unset, a process reports only its own metrics. gunicorn_conf sets it up for the workers.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+# Seconds between two publications of a process's metrics to METRICS_DIR. A scrape may miss what the other processes
+# recorded since their last one.
+PUBLISH_INTERVAL = float(os.environ.get("METRICS_PUBLISH_INTERVAL", "1"))
+
+STAGE_METRIC = "rag_stage_duration_seconds"
+IN_FLIGHT_METRIC = "rag_requests_in_flight"
+
+
+class Histogram:
+    """Counts observations per bucket like a Prometheus histogram, along with their sum and count."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list:
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+_lock = threading.Lock()
+# stage -> Histogram of its durations
+_stages = {}
+# endpoint -> number of requests being handled
+_in_flight = {}
+# name -> callable returning a dict of numbers, exported as gauges
+_stats = {}
+# time.monotonic() of the last publication to METRICS_DIR
+_published_at = 0.0
+
+
+def observe(stage: str, seconds: float):
+    """Record one duration of the stage."""
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = Histogram()
+        histogram.observe(seconds)
+    publish()
+
+
+@contextmanager
+def timed(stage: str):
+    """Record how long the with-block takes as one duration of the stage. Also works as a function decorator:
+    @metrics.timed("chunk")
+    def chunk_text(...):
+        ...
+    A block that raises is recorded as well, since failures take time too.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def request_started(endpoint: str):
+    with _lock:
+        _in_flight[endpoint] = _in_flight.get(endpoint, 0) + 1
+
+
+def request_finished(endpoint: str):
+    with _lock:
+        _in_flight[endpoint] = _in_flight.get(endpoint, 0) - 1
+    publish()
+
+
+def register_stats(name: str, stats):
+    """Export the numbers returned by stats() as gauges named rag_<name>_<key> on every scrape."""
+    with _lock:
+        _stats[name] = stats
+
+
+def snapshot() -> dict:
+    """Return the count, sum and cumulative bucket counts of every stage, and the in-flight requests per endpoint."""
+    with _lock:
+        return {
+            "stages": {
+                stage: {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": dict(
+                        zip(
+                            histogram.buckets + (float("inf"),),
+                            histogram.cumulative_counts(),
+                        )
+                    ),
+                }
+                for stage, histogram in _stages.items()
+            },
+            "in_flight": dict(_in_flight),
+        }
+
+
+def publish(force: bool = False):
+    """Save the metrics of this process to METRICS_DIR, at most once per PUBLISH_INTERVAL unless forced. Does nothing
+    when METRICS_DIR is not set."""
+    global _published_at
+    now = time.monotonic()
+    if not METRICS_DIR or not force and now - _published_at < PUBLISH_INTERVAL:
+        return
+    _published_at = now
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    # Written aside and renamed, so that readers never see half a file.
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(_state(), f)
+    os.replace(temp_path, path)
+
+
+def _state() -> dict:
+    """Return the metrics of this process as plain data: the histogram of every stage, the in-flight requests and the
+    numbers of every registered stats."""
+    with _lock:
+        state = {
+            "stages": {
+                stage: {
+                    "counts": list(histogram.counts),
+                    "sum": histogram.sum,
+                    "count": histogram.count,
+                }
+                for stage, histogram in _stages.items()
+            },
+            "in_flight": dict(_in_flight),
+        }
+        stats = dict(_stats)
+    state["stats"] = {
+        name: {
+            key: value
+            for key, value in collect().items()
+            if isinstance(value, (int, float))
+        }
+        for name, collect in stats.items()
+    }
+    return state
+
+
+def _states() -> dict:
+    """Return the state of every process that published to METRICS_DIR by pid, or of this process alone."""
+    if not METRICS_DIR:
+        return {os.getpid(): _state()}
+    publish(force=True)
+    states = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        with open(path) as f:
+            states[int(os.path.basename(path)[: -len(".json")])] = json.load(f)
+    return states
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text exposition format. With METRICS_DIR set, the stage durations are summed
+    over all processes, including those that exited so that the counts never go down, and the in-flight requests over
+    the live ones. The registered stats belong to a process each, so they are labelled with its pid.
+    """
+    states = _states()
+    labelled = METRICS_DIR is not None
+    live = [pid for pid in sorted(states) if not labelled or _alive(pid)]
+    stages, in_flight = {}, {}
+    for pid, state in states.items():
+        for stage, histogram in state["stages"].items():
+            total = stages.setdefault(stage, Histogram())
+            total.counts = [a + b for a, b in zip(total.counts, histogram["counts"])]
+            total.sum += histogram["sum"]
+            total.count += histogram["count"]
+    for pid in live:
+        for endpoint, count in states[pid]["in_flight"].items():
+            in_flight[endpoint] = in_flight.get(endpoint, 0) + count
+
+    lines = [
+        f"# HELP {STAGE_METRIC} Time spent in each stage of the RAG pipeline.",
+        f"# TYPE {STAGE_METRIC} histogram",
+    ]
+    for stage, histogram in sorted(stages.items()):
+        bounds = histogram.buckets + (float("inf"),)
+        for bound, count in zip(bounds, histogram.cumulative_counts()):
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{STAGE_METRIC}_bucket{{stage="{stage}",le="{le}"}} {count}')
+        lines.append(f'{STAGE_METRIC}_sum{{stage="{stage}"}} {histogram.sum!r}')
+        lines.append(f'{STAGE_METRIC}_count{{stage="{stage}"}} {histogram.count}')
+
+    lines.append(f"# HELP {IN_FLIGHT_METRIC} Requests currently being handled.")
+    lines.append(f"# TYPE {IN_FLIGHT_METRIC} gauge")
+    for endpoint, count in sorted(in_flight.items()):
+        lines.append(f'{IN_FLIGHT_METRIC}{{endpoint="{endpoint}"}} {count}')
+
+    gauges = {}
+    for pid in live:
+        for name, values in states[pid]["stats"].items():
+            for key, value in values.items():
+                label = f'{{pid="{pid}"}}' if labelled else ""
+                gauges.setdefault(f"rag_{name}_{key}", []).append(f"{label} {value!r}")
+    for metric, samples in sorted(gauges.items()):
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f"{metric}{sample}" for sample in samples)
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Forget all recorded durations and in-flight counts. Registered stats are kept."""
+    with _lock:
+        _stages.clear()
+        _in_flight.clear()
@@ -0,0 +1,102 @@
+import itertools
+import os
+import queue
+import threading
+import time
+
+from src.tools import metrics
+
+# Items a buffered stage may run ahead of its consumer. Once the queue is full the stage blocks, which holds back every
+# stage before it, so memory stays bounded however long the stream is.
+QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "2"))
+# Seconds a blocked stage waits before checking whether its consumer went away.
+_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+def batched(items, size: int):
+    """Yield lists of size items from the iterable; the last one holds the remainder."""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def tee(items, consume):
+    """Yield every item of the iterable after handing it to consume, e.g. the write method of a cache writer."""
+    for item in items:
+        consume(item)
+        yield item
+
+
+def timed(items, stage: str):
+    """Yield the items of the iterable and record the total time spent producing them as one duration of the stage,
+    once the iterable is exhausted. A lazy stage is only at work while its consumer asks for the next item.
+    """
+    items = iter(items)
+    seconds = 0.0
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            break
+        finally:
+            seconds += time.perf_counter() - start
+        yield item
+    metrics.observe(stage, seconds)
+
+
+def buffered(items, maxsize: int = None, name: str = "pipeline"):
+    """Run the iterable in a background thread and yield its items through a bounded queue, so it works on the next
+    items while the consumer handles the current one. Chaining buffered stages overlaps them like a pipeline, with
+    back-pressure: a stage blocks once maxsize items wait for its consumer. An exception raised by the iterable is
+    raised to the consumer, and a consumer that stops early stops the thread.
+    Args:
+        items: the iterable to run, typically a generator of the previous stage
+        maxsize: items queued ahead of the consumer, defaults to QUEUE_SIZE
+        name: the name of the thread
+    """
+    handoff = queue.Queue(maxsize=maxsize or QUEUE_SIZE)
+    stopped = threading.Event()
+
+    def put(entry) -> bool:
+        while not stopped.is_set():
+            try:
+                handoff.put(entry, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((None, item)):
+                    return
+            put((_DONE, None))
+        except BaseException as error:
+            put((error, None))
+        finally:
+            # Release what the stage holds, e.g. the worker processes of utils.iter_pages, in this thread.
+            close = getattr(items, "close", None)
+            if close:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            marker, item = handoff.get()
+            if marker is _DONE:
+                return
+            if marker is not None:
+                raise marker
+            yield item
+    finally:
+        stopped.set()
+        # Wait for the item in progress, so nothing of the stage runs on once the consumer has moved on.
+        thread.join()
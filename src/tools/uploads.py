@@ -0,0 +1,111 @@
+import os
+from collections import namedtuple
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser
+from werkzeug.wsgi import get_input_stream
+
+from src.tools import blob_store, utils
+
+# Largest file an upload may contain, in bytes. A part that grows past it stops the upload as soon as it does.
+MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_BYTES", str(512 * 1024**2)))
+# Largest request body of an upload with all of its files, in bytes. A request that announces more is refused before
+# anything is read.
+MAX_TOTAL_BYTES = int(os.environ.get("UPLOAD_MAX_TOTAL_BYTES", str(2 * 1024**3)))
+# Most files one upload may contain.
+MAX_FILES = int(os.environ.get("UPLOAD_MAX_FILES", "100"))
+# Largest non-file form field, which is the only part of an upload held in memory.
+MAX_FORM_MEMORY_BYTES = 64 * 1024
+
+# A file of an upload that was stored in the blob store. page_count is None when it is not a readable pdf.
+Upload = namedtuple("Upload", ["filename", "sha256", "size", "page_count"])
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload breaks one of its size limits. Nothing of it is kept."""
+
+
+def receive_files(
+    request,
+    store=None,
+    max_file_bytes: int = None,
+    max_total_bytes: int = None,
+    max_files: int = None,
+) -> list:
+    """This function reads a multipart upload with any number of files and stores every file in the blob store. Each
+    file part is streamed to disk in the pieces werkzeug's parser reads, hashed on the way, so neither a file nor the
+    request body is ever held in memory, and the limits are enforced while the data arrives rather than once it is all
+    in. The page count of each file is read from the stored blob, which only touches the pdf's page tree.
+    Args:
+        request: the werkzeug or flask request, whose body must not have been read yet
+        store: the blob store, defaults to blob_store.get_store()
+        max_file_bytes: the largest file allowed, defaults to MAX_FILE_BYTES
+        max_total_bytes: the largest request body allowed, defaults to MAX_TOTAL_BYTES
+        max_files: the most files allowed, defaults to MAX_FILES
+    Returns:
+        an Upload per file, in the order of the request. Parts without a filename, sent by a file input left empty,
+        are skipped.
+    Raises:
+        UploadTooLargeError: when a limit is exceeded. The files stored so far are dropped.
+    """
+    store = store or blob_store.get_store()
+    max_file_bytes = max_file_bytes or MAX_FILE_BYTES
+    max_total_bytes = max_total_bytes or MAX_TOTAL_BYTES
+    max_files = max_files or MAX_FILES
+    writers = []
+
+    def stream_factory(
+        total_content_length, content_type, filename, content_length=None
+    ):
+        if len(writers) >= max_files:
+            raise UploadTooLargeError(
+                f"An upload may contain at most {max_files} files"
+            )
+        writer = store.writer(max_bytes=max_file_bytes)
+        writers.append(writer)
+        return writer
+
+    parser = FormDataParser(
+        stream_factory=stream_factory,
+        max_form_memory_size=MAX_FORM_MEMORY_BYTES,
+        silent=False,
+    )
+    try:
+        try:
+            stream = get_input_stream(
+                request.environ, max_content_length=max_total_bytes
+            )
+            _, _, files = parser.parse(
+                stream,
+                request.mimetype,
+                request.content_length,
+                request.mimetype_params,
+            )
+        except RequestEntityTooLarge as error:
+            raise UploadTooLargeError(
+                f"An upload may be at most {max_total_bytes} bytes"
+            ) from error
+        except blob_store.BlobTooLargeError as error:
+            raise UploadTooLargeError(str(error)) from error
+
+        uploads = []
+        for _, part in files.items(multi=True):
+            if not part.filename:
+                continue
+            sha256, size = part.stream.commit()
+            uploads.append(
+                Upload(part.filename, sha256, size, page_count(store.path(sha256)))
+            )
+        return uploads
+    finally:
+        # Parts that were committed are left alone, the rest were skipped or cut short.
+        for writer in writers:
+            writer.discard()
+
+
+def page_count(path: str):
+    """Return the number of pages of the pdf file at path, or None if it is not a readable pdf."""
+    try:
+        return utils.count_pages(path)
+    except Exception:
+        return None
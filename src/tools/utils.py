@@ -1,7 +1,33 @@
+import collections
 import io
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
 import socket
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
 import PyPDF2
 
+# Number of worker processes used to extract text from pdf files.
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", os.cpu_count() or 1))
+# Documents with at least this many pages are split into page ranges of PAGES_PER_TASK pages that are extracted in
+# parallel. Smaller documents are extracted whole by a single worker, so many small files run side by side.
+PAGE_SPLIT_THRESHOLD = int(os.environ.get("EXTRACT_PAGE_SPLIT_THRESHOLD", "20"))
+PAGES_PER_TASK = int(os.environ.get("EXTRACT_PAGES_PER_TASK", "4"))
+# Seconds a single page may take before its text is given up on.
+PAGE_TIMEOUT = float(os.environ.get("EXTRACT_PAGE_TIMEOUT", "30"))
+# Page ranges each worker may have extracted ahead of the consumer of iter_pages. This bounds how many page texts are
+# held in memory at once, whatever the size of the files.
+LOOKAHEAD = int(os.environ.get("EXTRACT_LOOKAHEAD", "2"))
+# Pdf files each worker process keeps open between the page ranges it extracts.
+WORKER_OPEN_FILES = 2
+
+logger = logging.getLogger(__name__)
+
 
 def find_available_port(start_port=8000, max_port=9000):
     """Find the next available port between start_port and max_port, which defaults to 8000 and 9000."""
@@ -23,3 +49,171 @@ def extract_content(file_data):
         page = pdf_reader.pages[page_num]
         text.append(page.extract_text())
     return "\n".join(text)
+
+
+@contextmanager
+def open_pdf(source):
+    """Open a pdf file given either its bytes or the path of the file on disk. A path is read lazily, so only the parts
+    of the file that are needed are loaded."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield PyPDF2.PdfReader(io.BytesIO(source))
+    else:
+        with open(source, "rb") as f:
+            yield PyPDF2.PdfReader(f)
+
+
+def count_pages(source) -> int:
+    """Return the number of pages in the pdf file provided, given as bytes or a path."""
+    with open_pdf(source) as pdf_reader:
+        return len(pdf_reader.pages)
+
+
+def _extract_pages(path: str, start: int, stop: int) -> list:
+    """Extract the text of pages [start, stop) of the pdf file at path. This runs inside the worker processes."""
+    pdf_reader = _worker_reader(path)
+    return [
+        pdf_reader.pages[page_num].extract_text() for page_num in range(start, stop)
+    ]
+
+
+# Per worker process: (path, modification time, size) -> (open file, PdfReader), least recently used first.
+_worker_readers = collections.OrderedDict()
+
+
+def _worker_reader(path: str):
+    """Return a reader of the pdf file at path that stays open in this worker process, so the page ranges of a big
+    document it is given one after another parse the file once rather than once per range.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    entry = _worker_readers.pop(key, None)
+    if entry is None:
+        while len(_worker_readers) >= WORKER_OPEN_FILES:
+            _, (old_file, _) = _worker_readers.popitem(last=False)
+            old_file.close()
+        pdf_file = open(path, "rb")
+        entry = (pdf_file, PyPDF2.PdfReader(pdf_file))
+    _worker_readers[key] = entry
+    return entry[1]
+
+
+def extract_pages(
+    files_data: list, max_workers: int = None, page_timeout: float = None
+) -> list:
+    """This function extracts the text data from many pdf files in parallel, see iter_pages.
+    Returns:
+        the list of page texts of each file, in the same order as files_data.
+    """
+    pages = [[] for _ in files_data]
+    for index, page in iter_pages(files_data, max_workers, page_timeout):
+        pages[index].append(page)
+    return pages
+
+
+def iter_pages(
+    files_data: list,
+    max_workers: int = None,
+    page_timeout: float = None,
+    lookahead: int = None,
+    on_skip=None,
+):
+    """This function extracts the text data from many pdf files in parallel with a process pool, and yields the pages
+    as they come in rather than once every file is done. Big documents are split by page ranges, small ones are handled
+    one file per worker, even when there is a single one. Only lookahead page ranges per worker are extracted ahead of
+    the consumer, so a slow consumer holds back the workers instead of piling up text in memory. A page range that
+    takes longer than page_timeout seconds per page is skipped (its pages yield empty text) so that one pathological
+    pdf cannot stall the whole batch.
+    Args:
+        files_data: each pdf file, given as its bytes or its path. The workers are only ever handed paths: bytes are
+            written to a temporary file once, instead of being sent along with every page range.
+        max_workers: the number of worker processes, defaults to EXTRACT_WORKERS
+        page_timeout: seconds allowed per page, defaults to PAGE_TIMEOUT
+        lookahead: page ranges queued per worker, defaults to LOOKAHEAD
+        on_skip: optional callable that is given the file index of a skipped page range, before its empty pages are
+            yielded, so that callers can tell the text of that file is incomplete
+    Yields:
+        (file index, page text) pairs, the files in the order of files_data and the pages of each file in order.
+    """
+    max_workers = max_workers or EXTRACT_WORKERS
+    page_timeout = page_timeout or PAGE_TIMEOUT
+    lookahead = lookahead or LOOKAHEAD
+
+    tasks = []  # (file index, first page, page after the last one)
+    for index, file_data in enumerate(files_data):
+        page_count = count_pages(file_data)
+        if page_count == 0:
+            continue
+        step = PAGES_PER_TASK if page_count >= PAGE_SPLIT_THRESHOLD else page_count
+        for start in range(0, page_count, step):
+            tasks.append((index, start, min(start + step, page_count)))
+
+    # Even a single page range goes to a worker process: only there can it be given up on when it hangs.
+    if not tasks:
+        return
+
+    spill_dir = None
+    paths = {}
+
+    def path_of(index: int) -> str:
+        nonlocal spill_dir
+        source = files_data[index]
+        if not isinstance(source, (bytes, bytearray, memoryview)):
+            return source
+        if index not in paths:
+            spill_dir = spill_dir or tempfile.mkdtemp(prefix="extract-")
+            paths[index] = os.path.join(spill_dir, f"{index}.pdf")
+            with open(paths[index], "wb") as f:
+                f.write(source)
+        return paths[index]
+
+    workers = min(max_workers, len(tasks))
+    # Spawn rather than fork: the web process runs threads and holds grpc/torch state that must not be forked.
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    timed_out = False
+    queued = iter(tasks)
+    pending = collections.deque()
+
+    def submit(count: int):
+        for index, start, stop in itertools.islice(queued, count):
+            future = executor.submit(_extract_pages, path_of(index), start, stop)
+            pending.append((index, start, stop, future))
+
+    try:
+        submit(workers * lookahead)
+        # Results are collected in submission order, which keeps every file's pages in order. Each timeout starts
+        # when the caller begins waiting on that task, so tasks queued behind others are not penalised.
+        while pending:
+            index, start, stop, future = pending.popleft()
+            try:
+                pages = future.result(timeout=page_timeout * (stop - start))
+            except FutureTimeoutError:
+                timed_out = True
+                logger.warning(
+                    "Timed out extracting pages %d-%d of file %d, skipping them",
+                    start + 1,
+                    stop,
+                    index,
+                )
+                pages = [""] * (stop - start)
+                if on_skip:
+                    on_skip(index)
+            # Keep the workers busy while the consumer works through these pages.
+            submit(1)
+            for page in pages:
+                yield index, page
+    finally:
+        if timed_out:
+            _terminate_workers(executor)
+        executor.shutdown(wait=not timed_out, cancel_futures=True)
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def _terminate_workers(executor: ProcessPoolExecutor):
+    """Kill the worker processes of the executor. A worker stuck in a pathological page can't be cancelled, and would
+    otherwise keep the interpreter from exiting."""
+    # ProcessPoolExecutor has no public API for this.
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
@@ -0,0 +1,505 @@
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid as uuid_lib
+from collections import namedtuple
+
+import numpy as np
+
+from src.tools import embedding, metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are then only serialized within one process
+    fcntl = None
+
+BACKENDS = ("weaviate", "numpy")
+# The vector database behind RAG_builder. "numpy" keeps everything in local files and needs no other service.
+VECTOR_STORE = os.environ.get("VECTOR_STORE", "weaviate")
+NUMPY_STORE_DIR = os.environ.get("NUMPY_STORE_DIR", "vector_store")
+DTYPES = ("float32", "float16", "int8")
+# How the numpy store keeps the vectors it searches. float16 halves and int8 quarters the memory they take. int8 is also
+# scored faster than float32, while numpy converts float16 slowly, so float16 only pays off when memory is the limit.
+NUMPY_STORE_DTYPE = os.environ.get("NUMPY_STORE_DTYPE", "float32")
+# Compact vectors are re-scored in float32 for the best NUMPY_STORE_RERANK * chunk_num rows. 0 turns it off.
+NUMPY_STORE_RERANK = int(os.environ.get("NUMPY_STORE_RERANK", 4))
+# Rows widened to float32 at a time when scoring compact vectors.
+SCORE_BLOCK_ROWS = 1024
+
+# Files of one generation of a session.
+_Paths = namedtuple("_Paths", ["vectors", "chunks", "scales", "full"])
+# A loaded session: the searched vectors, the int8 scales, the float32 vectors, the sidecar rows, the position of each
+# uuid among them and the byte offset in the sidecar after the last one.
+_Index = namedtuple("_Index", ["vectors", "scales", "full", "rows", "positions", "end"])
+
+
+class VectorStore:
+    """The operations RAG_builder needs from a vector database. Every session has its own index, and every chunk is
+    stored with the id of the file it comes from, so that a file can be removed from a session again.
+    """
+
+    # Whether the backend computes the vectors of chunks that are added without one.
+    vectorizes = False
+    # Names the vectors the backend computes, which are cached apart from the ones encoded in this process.
+    vectorizer = None
+
+    def create(self, session_id: str):
+        """Create the session's index. Calling it again for an existing index keeps the index as it is."""
+        raise NotImplementedError
+
+    def add(
+        self,
+        session_id: str,
+        chunks: list,
+        file_id: int,
+        vectors=None,
+        uuids: list = None,
+    ) -> dict:
+        """Store chunks in the session's index. A chunk with the uuid of a stored one replaces it.
+        Returns:
+            a dict with the number of objects sent, failed objects, seconds spent and objects per second.
+        """
+        raise NotImplementedError
+
+    def get_vectors(self, session_id: str, uuids: list):
+        """Return the stored vectors of the given chunks in the same order, or None if some of them are missing."""
+        raise NotImplementedError
+
+    def remove_file(self, session_id: str, file_id: int) -> int:
+        """Remove all chunks of one file from the session's index and return how many there were."""
+        raise NotImplementedError
+
+    def drop(self, session_id: str):
+        """Delete the session's index with all of its chunks."""
+        raise NotImplementedError
+
+    def search(self, session_id: str, query: str, chunk_num: int, mode: str) -> list:
+        """Return the chunk_num chunks closest to the query as dicts with their uuid and content, most similar first.
+        The mode is the retrieval mode from RAG_builder; backends that only have one way of searching ignore it.
+        """
+        raise NotImplementedError
+
+
+class NumpyStore(VectorStore):
+    """An embedded vector store for single-node deployments. Each session is a directory with a vectors .npy file,
+    holding the unit-normalized vector of every chunk and memory-mapped for search, and a .jsonl sidecar with the uuid,
+    file id and text of each row. Searching is one matrix-vector product over the mapped rows and an argpartition for
+    the top k.
+
+    The vectors can be stored as float16 or as int8 with a scale per row, which shrinks the mapped rows to a half or a
+    quarter. They are then scored in their compact form and the best rerank * chunk_num rows are scored again against
+    a float32 copy, which stays on disk and is only read for those rows. A session keeps the dtype it was created with.
+
+    Appending writes the new rows and sidecar lines after the existing ones, then updates the row count in the .npy
+    header, which commits them. Whatever an interrupted append leaves past the committed rows is cut off by the next
+    one. Writers of a session hold a file lock, so the worker processes of the app can share the store. Deleting
+    writes a new generation of the files without the removed rows and switches the CURRENT file over to it, so readers
+    never see the files disagree.
+    """
+
+    def __init__(
+        self,
+        root: str = NUMPY_STORE_DIR,
+        dtype: str = NUMPY_STORE_DTYPE,
+        rerank: int = NUMPY_STORE_RERANK,
+    ):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown vector dtype: {dtype}")
+        self._root = os.path.abspath(root)
+        self._dtype = dtype
+        self._rerank = rerank
+        self._lock = threading.Lock()
+        # session id -> lock serializing the writers of that session
+        self._session_locks = {}
+        # session id -> (version of the files, _Index) of the last load
+        self._loaded = {}
+
+    def create(self, session_id: str):
+        os.makedirs(self._session_dir(session_id), exist_ok=True)
+
+    def add(
+        self,
+        session_id: str,
+        chunks: list,
+        file_id: int,
+        vectors=None,
+        uuids: list = None,
+    ) -> dict:
+        if vectors is None and chunks:
+            raise ValueError("The numpy vector store needs the vectors of the chunks")
+        start = time.perf_counter()
+        vectors = _normalize(
+            np.asarray(vectors, dtype=np.float32).reshape(len(chunks), -1)
+        )
+        rows = [
+            {
+                "uuid": str(uuids[index]) if uuids else str(uuid_lib.uuid4()),
+                "file_id": file_id,
+                "content": chunk,
+            }
+            for index, chunk in enumerate(chunks)
+        ]
+        with self._writing(session_id):
+            self.create(session_id)
+            new_uuids = {row["uuid"] for row in rows}
+            # Only rewrite the session when chunks are replaced, not for every batch of new ones.
+            if not new_uuids.isdisjoint(self._load(session_id).positions):
+                self._delete_where(session_id, lambda row: row["uuid"] in new_uuids)
+            self._append(session_id, vectors, rows)
+        elapsed = time.perf_counter() - start
+        return {
+            "objects": len(chunks),
+            "failed": 0,
+            "seconds": elapsed,
+            "objects_per_sec": len(chunks) / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def get_vectors(self, session_id: str, uuids: list):
+        index = self._load(session_id)
+        if any(str(uuid) not in index.positions for uuid in uuids):
+            return None
+        return [index.full[index.positions[str(uuid)]].tolist() for uuid in uuids]
+
+    def remove_file(self, session_id: str, file_id: int) -> int:
+        with self._writing(session_id):
+            return self._delete_where(session_id, lambda row: row["file_id"] == file_id)
+
+    def drop(self, session_id: str):
+        with self._writing(session_id):
+            shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+            self._loaded.pop(session_id, None)
+
+    def search(self, session_id: str, query: str, chunk_num: int, mode: str) -> list:
+        with metrics.timed("query_embedding"):
+            query_vector = embedding.encode_query(query)
+        return self.search_vector(session_id, query_vector, chunk_num)
+
+    def search_vector(self, session_id: str, query_vector, chunk_num: int) -> list:
+        """Return the chunk_num chunks closest to an already encoded query, like search."""
+        query_vector = _normalize(np.asarray(query_vector, dtype=np.float32))
+        index = self._load(session_id)
+        if not index.rows or chunk_num <= 0:
+            return []
+        scores = _scores(index.vectors, index.scales, query_vector)
+        if index.vectors is not index.full and self._rerank > 0:
+            # Sorted, so that the float32 rows are read from disk in order.
+            shortlist = np.sort(_top_k(scores, chunk_num * self._rerank))
+            exact = index.full[shortlist] @ query_vector
+            top = shortlist[_top_k(exact, chunk_num)]
+        else:
+            top = _top_k(scores, chunk_num)
+        return [
+            {"uuid": index.rows[i]["uuid"], "content": index.rows[i]["content"]}
+            for i in top
+        ]
+
+    def _session_dir(self, session_id: str) -> str:
+        return os.path.join(self._root, re.sub(r"[^\w-]", "_", session_id))
+
+    def _session_lock(self, session_id: str):
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.RLock())
+
+    @contextlib.contextmanager
+    def _writing(self, session_id: str):
+        """Serialize the writers of a session: within this process with its lock, and across the worker processes of
+        the app with an advisory lock on a file next to the session directory, which outlives dropping the session.
+        """
+        with self._session_lock(session_id):
+            os.makedirs(self._root, exist_ok=True)
+            with open(self._session_dir(session_id) + ".lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _generation(self, session_id: str):
+        try:
+            with open(os.path.join(self._session_dir(session_id), "CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _paths(self, session_id: str, generation: str) -> _Paths:
+        session_dir = self._session_dir(session_id)
+        return _Paths(
+            *(
+                os.path.join(session_dir, f"{name}-{generation}.{extension}")
+                for name, extension in (
+                    ("vectors", "npy"),
+                    ("chunks", "jsonl"),
+                    ("scales", "f32"),
+                    ("full", "f32"),
+                )
+            )
+        )
+
+    def _load(self, session_id: str) -> _Index:
+        """Return the mapped vectors and the sidecar rows of the session. They are only read again after the files
+        changed, which includes changes made by other processes. After an append only the new rows are read.
+        """
+        with self._session_lock(session_id):
+            generation = self._generation(session_id)
+            if generation is None:
+                empty = np.empty((0, 0), dtype=np.float32)
+                return _Index(empty, None, empty, [], {}, 0)
+            paths = self._paths(session_id, generation)
+            stat = os.stat(paths.vectors)
+            version = (generation, stat.st_mtime_ns, stat.st_size)
+            loaded = self._loaded.get(session_id)
+            if loaded is None or loaded[0] != version:
+                vectors = np.load(paths.vectors, mmap_mode="r")
+                count, dimensions = vectors.shape
+                scales = full = None
+                if vectors.dtype == np.int8:
+                    scales = _map_raw(paths.scales, (count,))
+                if vectors.dtype != np.float32:
+                    full = _map_raw(paths.full, (count, dimensions))
+                rows, positions, offset = [], {}, 0
+                # Appends leave the committed rows of a generation as they are, so only the rows after them are new.
+                if loaded is not None and loaded[0][0] == generation:
+                    previous = loaded[1]
+                    if len(previous.rows) <= count:
+                        rows, positions = list(previous.rows), dict(previous.positions)
+                        offset = previous.end
+                new_rows, end = _read_rows(paths.chunks, count - len(rows), offset)
+                for row in new_rows:
+                    positions[row["uuid"]] = len(rows)
+                    rows.append(row)
+                index = _Index(
+                    vectors,
+                    scales,
+                    vectors if full is None else full,
+                    rows,
+                    positions,
+                    end,
+                )
+                loaded = self._loaded[session_id] = (version, index)
+            return loaded[1]
+
+    def _append(self, session_id: str, vectors, rows: list):
+        """Write rows after the committed ones and commit them by updating the row count in the header."""
+        if not rows:
+            return
+        generation = self._generation(session_id)
+        if generation is None:
+            self._rewrite(session_id, vectors, rows, self._dtype)
+            return
+        paths = self._paths(session_id, generation)
+        with open(paths.vectors, "r+b") as f:
+            header_length, count, dimensions, dtype = _read_header(f)
+            if vectors.shape[1] != dimensions:
+                raise ValueError(
+                    f"Vectors have {vectors.shape[1]} dimensions, the index has {dimensions}"
+                )
+            header = _header((count + len(rows), dimensions), dtype)
+            if len(header) != header_length:
+                # The new row count does not fit in the padding of the header.
+                existing = self._load(session_id)
+                self._rewrite(
+                    session_id,
+                    np.concatenate([np.array(existing.full), vectors]),
+                    existing.rows + rows,
+                    dtype,
+                )
+                return
+
+            with open(paths.chunks, "r+b") as sidecar:
+                sidecar.seek(self._load(session_id).end)
+                sidecar.truncate()
+                sidecar.write(_encode_rows(rows))
+                sidecar.flush()
+                os.fsync(sidecar.fileno())
+
+            compact, scales = _quantize(vectors, dtype)
+            if scales is not None:
+                _append_raw(paths.scales, count * 4, scales)
+            if dtype != "float32":
+                _append_raw(paths.full, count * dimensions * 4, vectors)
+            _append_raw(
+                paths.vectors,
+                header_length + count * dimensions * compact.itemsize,
+                compact,
+            )
+            f.seek(0)
+            f.write(header)
+
+    def _delete_where(self, session_id: str, predicate) -> int:
+        """Rewrite the session without the rows matching the predicate and return how many were removed."""
+        index = self._load(session_id)
+        keep = [i for i, row in enumerate(index.rows) if not predicate(row)]
+        removed = len(index.rows) - len(keep)
+        if removed:
+            self._rewrite(
+                session_id,
+                index.full[keep],
+                [index.rows[i] for i in keep],
+                _dtype_name(index.vectors.dtype),
+            )
+        return removed
+
+    def _rewrite(self, session_id: str, vectors, rows: list, dtype: str):
+        """Write the rows as a new generation of the files and make it the current one."""
+        old_generation = self._generation(session_id)
+        generation = str(time.time_ns())
+        paths = self._paths(session_id, generation)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        compact, scales = _quantize(vectors, dtype)
+        files = [(paths.chunks, _encode_rows(rows))]
+        if scales is not None:
+            files.append((paths.scales, scales.tobytes()))
+        if dtype != "float32":
+            files.append((paths.full, vectors.tobytes()))
+        buffer = io.BytesIO()
+        np.save(buffer, compact)
+        files.append((paths.vectors, buffer.getvalue()))
+        for path, data in files:
+            with open(path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        _write_atomic(
+            os.path.join(self._session_dir(session_id), "CURRENT"), generation.encode()
+        )
+        if old_generation is not None:
+            # Processes that still have the old vectors mapped keep reading them until they notice the switch.
+            for path in self._paths(session_id, old_generation):
+                if os.path.exists(path):
+                    os.unlink(path)
+        self._loaded.pop(session_id, None)
+
+
+def _normalize(vectors):
+    """Scale vectors to unit length, so that the dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _quantize(vectors, dtype: str) -> tuple:
+    """Return the rows of unit-normalized float32 vectors in the dtype and, for int8, the scale of each row, which maps
+    its largest component to 127."""
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+
+def _scores(vectors, scales, query_vector):
+    """Return the dot product of every row with the query. Compact rows are widened to float32 one block at a time,
+    so that only the compact rows are read from memory and the widened block stays in the CPU cache.
+    """
+    if vectors.dtype == np.float32:
+        return vectors @ query_vector
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+        stop = start + SCORE_BLOCK_ROWS
+        scores[start:stop] = vectors[start:stop].astype(np.float32) @ query_vector
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def _top_k(scores, k: int):
+    """Return the positions of the k highest scores, highest first."""
+    k = min(k, len(scores))
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def _dtype_name(dtype) -> str:
+    return np.dtype(dtype).name
+
+
+def _encode_rows(rows: list) -> bytes:
+    return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+def _read_rows(path: str, count: int, offset: int = 0) -> tuple:
+    """Read count rows of a sidecar, starting at the byte offset. Lines after them were never committed. Returns the
+    rows and the offset after them."""
+    rows = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while len(rows) < count:
+            rows.append(json.loads(f.readline()))
+        return rows, f.tell()
+
+
+def _map_raw(path: str, shape: tuple):
+    """Map the first rows of a headerless float32 file. Bytes after them were never committed."""
+    if shape[0] == 0:
+        return np.empty(shape, dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r", shape=shape)
+
+
+def _append_raw(path: str, committed: int, array):
+    """Cut a file back to its committed bytes and write the array after them."""
+    with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+        f.truncate(committed)
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(array).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _header(shape: tuple, dtype: str = "float32") -> bytes:
+    """Return the .npy header of an array of the given shape and dtype."""
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        buffer,
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": shape,
+        },
+    )
+    return buffer.getvalue()
+
+
+def _read_header(f) -> tuple:
+    """Return the header length, row count, dimensions and dtype name of an open .npy file."""
+    f.seek(0)
+    np.lib.format.read_magic(f)
+    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    return f.tell(), shape[0], shape[1], _dtype_name(dtype)
+
+
+def _write_atomic(path: str, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> VectorStore:
+    """Return the process-wide vector store of the configured backend, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if VECTOR_STORE not in BACKENDS:
+                    raise ValueError(f"Unknown vector store: {VECTOR_STORE}")
+                if VECTOR_STORE == "numpy":
+                    _store = NumpyStore()
+                else:
+                    # Imported here so that the numpy backend runs without the weaviate client installed.
+                    from src.tools.weaviate_store import WeaviateStore
+
+                    _store = WeaviateStore()
+    return _store
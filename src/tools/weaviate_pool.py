@@ -0,0 +1,189 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+WEAVIATE_HOST = os.environ.get("WEAVIATE_HOST", "weaviate")
+WEAVIATE_PORT = int(os.environ.get("WEAVIATE_PORT", "8080"))
+WEAVIATE_GRPC_PORT = int(os.environ.get("WEAVIATE_GRPC_PORT", "50051"))
+# Upper bound on open connections per process. Requests beyond that wait for a connection to be released.
+POOL_SIZE = int(os.environ.get("WEAVIATE_POOL_SIZE", "8"))
+# Connections unused for this long are closed.
+IDLE_TIMEOUT = float(os.environ.get("WEAVIATE_POOL_IDLE_TIMEOUT", "300"))
+# Connections idle for longer than this are pinged before being handed out again.
+HEALTH_CHECK_INTERVAL = float(
+    os.environ.get("WEAVIATE_POOL_HEALTH_CHECK_INTERVAL", "30")
+)
+ACQUIRE_TIMEOUT = float(os.environ.get("WEAVIATE_POOL_ACQUIRE_TIMEOUT", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(TimeoutError):
+    """Raised when no connection became available within the acquire timeout."""
+
+
+def connect():
+    """Open a new connection to the local weaviate instance."""
+    # Imported on first use, so that processes that never talk to weaviate don't pay for importing the client.
+    import weaviate
+
+    return weaviate.connect_to_local(
+        host=WEAVIATE_HOST, port=WEAVIATE_PORT, grpc_port=WEAVIATE_GRPC_PORT
+    )
+
+
+class ClientPool:
+    """A bounded pool of weaviate clients. Idle clients are reused most-recently-used first, pinged before reuse when
+    they have been idle for a while, and closed once they exceed the idle timeout."""
+
+    def __init__(
+        self,
+        factory=connect,
+        max_size: int = POOL_SIZE,
+        idle_timeout: float = IDLE_TIMEOUT,
+        health_check_interval: float = HEALTH_CHECK_INTERVAL,
+        acquire_timeout: float = ACQUIRE_TIMEOUT,
+    ):
+        self._factory = factory
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._health_check_interval = health_check_interval
+        self._acquire_timeout = acquire_timeout
+        # (client, time it was released) pairs, most recently released last.
+        self._idle = deque()
+        self._open = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Check a client out of the pool, opening a new one if the pool is not full yet."""
+        deadline = time.monotonic() + self._acquire_timeout
+        while True:
+            with self._condition:
+                expired = self._take_expired()
+                candidate = None
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._open < self._max_size:
+                    self._open += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            f"No weaviate connection available after {self._acquire_timeout}s"
+                        )
+                    self._condition.wait(remaining)
+                    continue
+            self._close_clients(expired)
+
+            if candidate is None:
+                try:
+                    return self._factory()
+                except Exception:
+                    self._forget()
+                    raise
+
+            client, released_at = candidate
+            if time.monotonic() - released_at < self._health_check_interval:
+                return client
+            if self._is_healthy(client):
+                return client
+            logger.info("Dropping unhealthy weaviate connection")
+            self._close_clients([client])
+            self._forget()
+
+    def release(self, client, discard: bool = False):
+        """Return a client to the pool. Clients that failed mid-request should be discarded instead of reused."""
+        if discard:
+            self._close_clients([client])
+            self._forget()
+            return
+        with self._condition:
+            self._idle.append((client, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a client for the duration of the with-block."""
+        client = self.acquire()
+        try:
+            yield client
+        except Exception:
+            self.release(client, discard=not self._is_healthy(client))
+            raise
+        else:
+            self.release(client)
+
+    def close_all(self):
+        """Close every idle client. Clients that are checked out are closed when they are released with discard."""
+        with self._condition:
+            idle = [client for client, _ in self._idle]
+            self._idle.clear()
+            self._open -= len(idle)
+            self._condition.notify_all()
+        self._close_clients(idle)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "max_size": self._max_size,
+            }
+
+    def _take_expired(self) -> list:
+        """Remove idle clients that exceeded the idle timeout. Must be called with the condition held."""
+        now = time.monotonic()
+        expired = []
+        # The oldest releases are at the left end of the deque.
+        while self._idle and now - self._idle[0][1] > self._idle_timeout:
+            expired.append(self._idle.popleft()[0])
+        self._open -= len(expired)
+        return expired
+
+    def _forget(self):
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _is_healthy(client) -> bool:
+        try:
+            return client.is_ready()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_clients(clients):
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                logger.exception("Failed to close weaviate connection")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ClientPool:
+    """Return the process-wide weaviate client pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ClientPool()
+                atexit.register(_pool.close_all)
+    return _pool
+
+
+def connection():
+    """Borrow a client from the process-wide pool. This is the only way the app should talk to weaviate:
+    with weaviate_pool.connection() as client:
+        ...
+    """
+    return get_pool().connection()
@@ -0,0 +1,270 @@
+import logging
+import os
+import time
+
+import numpy as np
+import weaviate.classes as wvc
+
+from src.tools import embedding, metrics, weaviate_pool
+from src.tools.vector_store import VectorStore
+
+class_name = "TextChunk"
+# Page size used when the local retrieval mode walks the whole collection, and when vectors are read back.
+FETCH_PAGE_SIZE = int(os.environ.get("RETRIEVAL_FETCH_PAGE_SIZE", "500"))
+# Batched ingestion settings of weaviate's client, applied to each batch of the ingestion pipeline (see
+# RAG_builder.PIPELINE_BATCH_SIZE). "fixed" sends INGEST_BATCH_SIZE objects per request with INGEST_CONCURRENCY requests
+# in flight, "dynamic" lets weaviate adapt the batch size to the server load.
+INGEST_BATCH_MODE = os.environ.get("INGEST_BATCH_MODE", "fixed")
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "100"))
+INGEST_CONCURRENCY = int(os.environ.get("INGEST_CONCURRENCY", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+class WeaviateStore(VectorStore):
+    """Keeps every session in its own weaviate collection. Chunks added without vectors are vectorized by the
+    text2vec-transformers module."""
+
+    vectorizes = True
+    vectorizer = "weaviate-text2vec-transformers"
+
+    def create(self, session_id: str):
+        with weaviate_pool.connection() as weaviate_client:
+            initiate_storage(weaviate_client, session_id)
+
+    def add(
+        self,
+        session_id: str,
+        chunks: list,
+        file_id: int,
+        vectors=None,
+        uuids: list = None,
+    ) -> dict:
+        with weaviate_pool.connection() as weaviate_client:
+            collection = weaviate_client.collections.get(collection_name(session_id))
+            return insert_chunks(
+                collection, chunks, file_id, vectors=vectors, uuids=uuids
+            )
+
+    def get_vectors(self, session_id: str, uuids: list):
+        with weaviate_pool.connection() as weaviate_client:
+            collection = weaviate_client.collections.get(collection_name(session_id))
+            return fetch_vectors(collection, uuids)
+
+    def remove_file(self, session_id: str, file_id: int) -> int:
+        """Weaviate deletes at most QUERY_MAXIMUM_RESULTS objects per request (10,000 by default), so the chunks of a
+        big file are deleted over several rounds, until none match. A chunk that fails to be deleted raises, so the
+        file is never taken for removed while some of its chunks are still found."""
+        removed = 0
+        with weaviate_pool.connection() as weaviate_client:
+            name = collection_name(session_id)
+            if not weaviate_client.collections.exists(name):
+                return 0
+            collection = weaviate_client.collections.get(name)
+            while True:
+                result = collection.data.delete_many(
+                    where=wvc.query.Filter.by_property("file_id").equal(file_id)
+                )
+                if result.failed:
+                    raise RuntimeError(
+                        f"Failed to remove {result.failed} chunks of file {file_id}"
+                    )
+                if not result.matches:
+                    return removed
+                removed += result.successful
+
+    def drop(self, session_id: str):
+        with weaviate_pool.connection() as weaviate_client:
+            name = collection_name(session_id)
+            if weaviate_client.collections.exists(name):
+                weaviate_client.collections.delete(name)
+
+    def search(self, session_id: str, query: str, chunk_num: int, mode: str) -> list:
+        """Search in one of the retrieval modes: "near_vector" and "near_text" let weaviate run the nearest
+        neighbour search and only return the winning chunks, "local" scores every stored vector in Python.
+        """
+        with weaviate_pool.connection() as client:
+            collection = client.collections.get(collection_name(session_id))
+            if mode == "near_text":
+                response = collection.query.near_text(
+                    query=query, limit=chunk_num, return_properties=["content"]
+                )
+                return [_chunk(o) for o in response.objects]
+            if mode == "near_vector":
+                with metrics.timed("query_embedding"):
+                    query_vector = embedding.encode_query(query)
+                response = collection.query.near_vector(
+                    near_vector=query_vector.tolist(),
+                    limit=chunk_num,
+                    return_properties=["content"],
+                )
+                return [_chunk(o) for o in response.objects]
+            return _local_top_k(collection, query, chunk_num)
+
+
+def insert_chunks(
+    collection,
+    chunks: list,
+    file_id: int,
+    vectors=None,
+    uuids: list = None,
+    batch_size: int = None,
+    concurrency: int = None,
+) -> dict:
+    """This function stores the chunks of text in the database with weaviate's batching, so that they can be used for
+    semantic search later on.
+    Args:
+        collection: the weaviate collection of the session
+        chunks: the string values of the text chunks
+        file_id: the id of the file the chunks come from, so that they can be removed again with remove_file
+        vectors: optional vector of each chunk. When given, weaviate stores it instead of vectorizing the chunk.
+        uuids: optional uuid of each chunk. Inserting a chunk with an existing uuid replaces it.
+        batch_size: objects per batch request, defaults to INGEST_BATCH_SIZE. Ignored in "dynamic" batch mode, where
+            weaviate sizes the batches itself.
+        concurrency: number of batch requests in flight, defaults to INGEST_CONCURRENCY
+    Returns:
+        a dict with the number of objects sent, failed objects, seconds spent and objects per second.
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    concurrency = concurrency or INGEST_CONCURRENCY
+    if INGEST_BATCH_MODE == "dynamic":
+        batcher = collection.batch.dynamic()
+    else:
+        batcher = collection.batch.fixed_size(
+            batch_size=batch_size, concurrent_requests=concurrency
+        )
+
+    start = time.perf_counter()
+    with batcher as batch:
+        for index, chunk in enumerate(chunks):
+            batch.add_object(
+                properties={"content": chunk, "file_id": file_id},
+                uuid=uuids[index] if uuids is not None else None,
+                vector=(
+                    [float(x) for x in vectors[index]] if vectors is not None else None
+                ),
+            )
+    elapsed = time.perf_counter() - start
+
+    failed = len(collection.batch.failed_objects)
+    for failed_object in collection.batch.failed_objects[:5]:
+        logger.warning("Failed to insert chunk: %s", failed_object.message)
+    return {
+        "objects": len(chunks),
+        "failed": failed,
+        "seconds": elapsed,
+        "objects_per_sec": len(chunks) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def fetch_vectors(collection, uuids: list):
+    """Read back the vectors weaviate computed for the given objects, in the same order.
+    Returns:
+        the list of vectors, or None if some of the objects are missing.
+    """
+    vectors = {}
+    for start in range(0, len(uuids), FETCH_PAGE_SIZE):
+        end = start + FETCH_PAGE_SIZE
+        page = uuids[start:end]
+        response = collection.query.fetch_objects(
+            filters=wvc.query.Filter.by_id().contains_any(page),
+            limit=len(page),
+            include_vector=True,
+            return_properties=[],
+        )
+        for o in response.objects:
+            vectors[str(o.uuid)] = o.vector["default"]
+    if any(str(uuid) not in vectors for uuid in uuids):
+        return None
+    return [vectors[str(uuid)] for uuid in uuids]
+
+
+def collection_name(session_id: str) -> str:
+    """Every user session has its own collection, so sessions never see or wipe each other's chunks."""
+    return f"{class_name}_{session_id.replace('-', '_')}"
+
+
+def initiate_storage(weaviate_client, session_id: str):
+    """This function initiate the storage of the session in the weaviate database. It is safe to call it again for
+    the same session: an existing collection is kept as it is. The client stays open so that the caller can keep using
+    it for ingestion.
+    Args:
+        weaviate_client: the database client that is used to create the collection.
+        session_id: the user session that owns the collection
+    Returns:
+        the collection of the session.
+    """
+    name = collection_name(session_id)
+    if not weaviate_client.collections.exists(name):
+        # Only the text is vectorized, not the collection or property name: the collection name holds the random
+        # session id, so the same chunk would get a different vector in every session.
+        weaviate_client.collections.create(
+            name=name,
+            vectorizer_config=wvc.config.Configure.Vectorizer.text2vec_transformers(
+                vectorize_collection_name=False
+            ),
+            properties=[
+                wvc.config.Property(
+                    name="content",
+                    data_type=wvc.config.DataType.TEXT,
+                    vectorize_property_name=False,
+                    tokenization=wvc.config.Tokenization.LOWERCASE,
+                ),
+                wvc.config.Property(
+                    name="file_id",
+                    data_type=wvc.config.DataType.INT,
+                    skip_vectorization=True,
+                ),
+            ],
+        )
+    return weaviate_client.collections.get(name)
+
+
+def _chunk(weaviate_object) -> dict:
+    return {
+        "uuid": str(weaviate_object.uuid),
+        "content": weaviate_object.properties["content"],
+    }
+
+
+def _local_top_k(collection, query: str, chunk_num: int) -> list:
+    """Score every chunk in the collection against the query, page by page, and keep only the running top chunk_num.
+    Memory stays bounded by the page size instead of the corpus size. The result is ordered from most to least similar.
+    """
+    with metrics.timed("query_embedding"):
+        query_vector = embedding.encode_query(query)
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    query_vector = query_vector / np.linalg.norm(query_vector)
+
+    best_scores = np.empty(0, dtype=np.float32)
+    best_chunks = []
+    after = None
+    while True:
+        response = collection.query.fetch_objects(
+            limit=FETCH_PAGE_SIZE,
+            after=after,
+            include_vector=True,
+            return_properties=["content"],
+        )
+        if not response.objects:
+            break
+        # float32 halves the bytes scored compared to the float64 numpy makes of the lists by default.
+        vectors = np.array(
+            [o.vector["default"] for o in response.objects], dtype=np.float32
+        )
+        cosine_sim = (vectors @ query_vector) / np.linalg.norm(vectors, axis=1)
+
+        scores = np.concatenate([best_scores, cosine_sim])
+        chunks = best_chunks + [_chunk(o) for o in response.objects]
+        if len(scores) > chunk_num:
+            keep = np.argpartition(scores, -chunk_num)[-chunk_num:]
+            scores = scores[keep]
+            chunks = [chunks[i] for i in keep]
+        best_scores, best_chunks = scores, chunks
+
+        if len(response.objects) < FETCH_PAGE_SIZE:
+            break
+        after = response.objects[-1].uuid
+
+    order = np.argsort(best_scores)[::-1]
+    return [best_chunks[i] for i in order]
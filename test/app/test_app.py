@@ -1,16 +1,55 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from src.app.app import app, db, File, UserSession, Conversation
+from src.app.app import create_app, init_database
+from src.app.views import _run_ingest_job
+from src.app.models import (
+    db,
+    File,
+    UserSession,
+    Conversation,
+    IngestJob,
+    SessionFile,
+)
 from io import BytesIO
+import tempfile
+import time
 import uuid
+from src.tools.answer_cache import AnswerCache
+from src.tools.blob_store import BlobStore
+from src.tools.llm_client import Limiter, Router
+
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
 
 
 class TestApp(unittest.TestCase):
 
     def setUp(self):
-        app.config["TESTING"] = True
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
         self.app = app.test_client()
+        self.blob_dir = tempfile.TemporaryDirectory()
+        self.blob_store = BlobStore(root=self.blob_dir.name)
+        self.blob_store_patch = patch(
+            "src.tools.blob_store.get_store", return_value=self.blob_store
+        )
+        self.blob_store_patch.start()
+        self.answer_cache_patch = patch(
+            "src.app.views.answer_cache.get_cache", return_value=AnswerCache()
+        )
+        self.answer_cache_patch.start()
+        self.encode_query_patch = patch(
+            "src.app.views.embedding.encode_query", return_value=[1.0, 0.0]
+        )
+        self.encode_query_patch.start()
+        self.limiter = Limiter(max_in_flight=1, max_queue=0, queue_timeout=1)
+        self.limiter_patch = patch(
+            "src.app.views.llm_client.get_limiter", return_value=self.limiter
+        )
+        self.limiter_patch.start()
+        self.llm = MagicMock()
+        self.router_patch = patch(
+            "src.app.views.llm_client.get_router",
+            return_value=Router(["http://llm"], client_factory=lambda url: self.llm),
+        )
+        self.router_patch.start()
         with app.app_context():
             db.create_all()
 
@@ -18,6 +57,12 @@ class TestApp(unittest.TestCase):
         with app.app_context():
             db.session.remove()
             db.drop_all()
+        self.blob_store_patch.stop()
+        self.answer_cache_patch.stop()
+        self.encode_query_patch.stop()
+        self.limiter_patch.stop()
+        self.router_patch.stop()
+        self.blob_dir.cleanup()
 
     def test_index_route(self):
         response = self.app.get("/")
@@ -32,11 +77,92 @@ class TestApp(unittest.TestCase):
         with app.app_context():
             file = File.query.filter_by(filename="test.txt").first()
             self.assertIsNotNone(file)
-            self.assertEqual(file.data, b"test file content")
+            self.assertIsNone(file.data)
+            self.assertEqual(file.size, len(b"test file content"))
+            self.assertIsNone(file.page_count)  # not a pdf
+            with self.blob_store.open(file.sha256) as f:
+                self.assertEqual(f.read(), b"test file content")
+            self.assertEqual(file.source, self.blob_store.path(file.sha256))
+
+    def test_upload_duplicate_file(self):
+        for filename in ["first.txt", "second.txt"]:
+            data = {"file": (BytesIO(b"same content"), filename)}
+            self.app.post("/upload", data=data, content_type="multipart/form-data")
+
+        with app.app_context():
+            files = File.query.all()
+            self.assertEqual(len(files), 1)
+            self.assertEqual(files[0].filename, "first.txt")
+            self.assertEqual(len(files[0].sha256), 64)
+
+    def test_upload_several_files(self):
+        data = {
+            "file": [
+                (BytesIO(b"first content"), "first.txt"),
+                (BytesIO(b"second content"), "second.txt"),
+            ]
+        }
+        response = self.app.post(
+            "/upload", data=data, content_type="multipart/form-data"
+        )
+
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            self.assertEqual(
+                [file.filename for file in File.query.order_by(File.id)],
+                ["first.txt", "second.txt"],
+            )
+
+    def test_upload_files_in_bulk(self):
+        with app.app_context():
+            db.session.add(File.from_bytes("old.txt", b"old content"))
+            db.session.commit()
+        data = {
+            "files": [
+                (BytesIO(b"new content"), "new.txt"),
+                (BytesIO(b"old content"), "again.txt"),
+                (BytesIO(b"new content"), "new-copy.txt"),
+            ]
+        }
+
+        with patch("src.app.views.db.session.commit") as mock_commit:
+            response = self.app.post(
+                "/upload/bulk", data=data, content_type="multipart/form-data"
+            )
+            # The metadata of all files is committed at once.
+            mock_commit.assert_called_once()
+
+        self.assertEqual(response.status_code, 201)
+        files = response.get_json()["files"]
+        self.assertEqual(
+            [(file["filename"], file["duplicate"]) for file in files],
+            [("new.txt", False), ("old.txt", True), ("new.txt", True)],
+        )
+        self.assertEqual(files[0]["size"], len(b"new content"))
+        self.assertEqual(files[0]["sha256"], files[2]["sha256"])
+        self.assertIsNone(files[0]["page_count"])
+
+    @patch("src.app.views.uploads.MAX_FILE_BYTES", 5)
+    def test_upload_files_in_bulk_too_large(self):
+        data = {"files": [(BytesIO(b"more than five bytes"), "big.txt")]}
+
+        response = self.app.post(
+            "/upload/bulk", data=data, content_type="multipart/form-data"
+        )
+
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("error", response.get_json())
+        with app.app_context():
+            self.assertEqual(File.query.count(), 0)
+
+    def test_upload_files_in_bulk_without_files(self):
+        response = self.app.post("/upload/bulk", data={"name": "value"})
+
+        self.assertEqual(response.status_code, 400)
 
     def test_list_files(self):
         with app.app_context():
-            file = File(filename="test.txt", data=b"test content")
+            file = File.from_bytes("test.txt", b"test content")
             db.session.add(file)
             db.session.commit()
 
@@ -44,23 +170,32 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b"test.txt", response.data)
 
-    @patch("src.app.app.weaviate.connect_to_local")
-    @patch("src.app.app.RAG_builder.build_rag")
-    @patch("src.app.app.tempfile.mkdtemp")
-    @patch("src.app.app.uuid.uuid4")
+    @patch("src.app.views.jobs.submit")
+    @patch("src.app.views.RAG_builder.build_rag")
+    @patch("src.app.views.tempfile.mkdtemp")
+    @patch("src.app.views.uuid.uuid4")
     def test_perform_operation(
-        self, mock_uuid4, mock_mkdtemp, mock_build_rag, mock_connect_to_local
+        self, mock_uuid4, mock_mkdtemp, mock_build_rag, mock_submit
     ):
         # Set up mocks
         test_uuid = str(uuid.uuid4())
         mock_uuid4.return_value = test_uuid
         mock_mkdtemp.return_value = "/tmp/test_dir"
-        mock_client = MagicMock()
-        mock_connect_to_local.return_value = mock_client
+        # Run the background job right away.
+        mock_submit.side_effect = lambda fn, *args: fn(*args)
+
+        def build_rag(files, session_id, progress):
+            self.assertEqual(session_id, test_uuid)
+            self.assertEqual([file.filename for file in files], ["test.txt"])
+            report = {"filename": "test.txt", "pages": 2, "objects": 4, "failed": 0}
+            progress(report)
+            return [report]
+
+        mock_build_rag.side_effect = build_rag
 
         # Create a test file in the database
         with app.app_context():
-            file = File(filename="test.txt", data=b"test content")
+            file = File.from_bytes("test.txt", b"test content")
             db.session.add(file)
             db.session.commit()
             file_id = file.id
@@ -73,9 +208,6 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.headers["Location"], "/inference")
 
         # Check if mocks were called correctly
-        mock_connect_to_local.assert_called_once_with(
-            host="weaviate", port=8080, grpc_port=50051
-        )
         mock_build_rag.assert_called_once()
 
         # Check if a UserSession was created
@@ -84,14 +216,23 @@ class TestApp(unittest.TestCase):
             self.assertIsNotNone(user_session)
             self.assertEqual(user_session.temp_dir, "/tmp/test_dir")
 
+        # Check that the ingestion job ran and recorded its progress
+        with app.app_context():
+            job = IngestJob.query.filter_by(session_id=test_uuid).first()
+            self.assertEqual(job.status, "done")
+            self.assertEqual(job.files_done, 1)
+            self.assertEqual(job.pages, 2)
+            self.assertEqual(job.chunks, 4)
+            self.assertEqual(
+                [f.file_id for f in SessionFile.query.filter_by(session_id=test_uuid)],
+                [file_id],
+            )
+
         # Check if flash message was set
         with self.app.session_transaction() as session:
             flash_messages = session.get("_flashes", [])
             self.assertTrue(
-                any(
-                    "Operation performed successfully" in message
-                    for _, message in flash_messages
-                )
+                any("Indexing started" in message for _, message in flash_messages)
             )
 
         # Check if session variables were set correctly
@@ -99,13 +240,154 @@ class TestApp(unittest.TestCase):
             self.assertEqual(session["temp_dir"], "/tmp/test_dir")
             self.assertEqual(session["id"], test_uuid)
 
-    @patch("src.app.app.RAG_builder.semantic_search")
-    @patch("src.app.app.OpenAI")
-    def test_inference_page(self, mock_openai, mock_semantic_search):
-        mock_semantic_search.return_value = "Mock search results"
+    def test_job_status(self):
+        with app.app_context():
+            job = IngestJob(job_id="test_job", session_id="test_session", files_total=2)
+            job.status = "running"
+            job.started_at = time.time() - 20
+            job.finished_at = job.started_at + 10
+            job.chunks = 50
+            db.session.add(job)
+            db.session.commit()
+
+        response = self.app.get("/jobs/test_job")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["status"], "running")
+        self.assertFalse(response.json["ready"])
+        self.assertEqual(response.json["chunks_per_sec"], 5.0)
+
+        response = self.app.get("/jobs/missing_job")
+        self.assertEqual(response.status_code, 404)
+
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_page_waits_for_index(self, mock_search_chunks):
+        with app.app_context():
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp/test"))
+            db.session.add(
+                IngestJob(job_id="test_job", session_id="test_session", files_total=1)
+            )
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        response = self.app.get("/inference")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Indexing files", response.data)
+
+        response = self.app.post("/inference", data={"query_text": "test query"})
+        self.assertEqual(response.status_code, 302)
+        mock_search_chunks.assert_not_called()
+
+    @patch("src.app.models.INGEST_JOB_TIMEOUT", 60)
+    @patch("src.app.views.jobs.submit")
+    def test_stale_job_fails(self, mock_submit):
+        with app.app_context():
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp/test"))
+            job = IngestJob(job_id="test_job", session_id="test_session", files_total=1)
+            job.status = "running"
+            job.started_at = time.time() - 120
+            db.session.add(job)
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        # The worker that ran the job is gone: the job is failed and can be retried.
+        response = self.app.get("/inference")
+        self.assertIn(b"Indexing did not finish within 60s", response.data)
+        response = self.app.post("/jobs/test_job/retry")
+        self.assertEqual(response.status_code, 302)
+        mock_submit.assert_called_once()
+
+    def test_jobs_interrupted_by_a_restart_fail(self):
+        with app.app_context():
+            for job_id, status in [("queued_job", "queued"), ("done_job", "done")]:
+                job = IngestJob(job_id=job_id, session_id="test_session", files_total=1)
+                job.status = status
+                db.session.add(job)
+            db.session.commit()
+
+            IngestJob.fail_interrupted()
+
+            self.assertEqual(
+                {job.job_id: job.status for job in IngestJob.query},
+                {"queued_job": "failed", "done_job": "done"},
+            )
+
+    @patch("src.app.views.RAG_builder.build_rag")
+    def test_ingest_job_failure_is_recorded_after_a_failed_commit(self, mock_build_rag):
+        with app.app_context():
+            job = IngestJob(job_id="test_job", session_id="test_session", files_total=1)
+            db.session.add(job)
+            db.session.commit()
+
+        def build_rag(files, session_id, progress):
+            # A commit that fails leaves the session in need of a rollback.
+            db.session.add(IngestJob(job_id="test_job", session_id="x", files_total=1))
+            db.session.commit()
+
+        mock_build_rag.side_effect = build_rag
+        _run_ingest_job(app, "test_job", [])
+
+        with app.app_context():
+            job = IngestJob.query.filter_by(job_id="test_job").first()
+            self.assertEqual(job.status, "failed")
+            self.assertIn("UNIQUE", job.error)
+
+    @patch("src.app.views.jobs.submit")
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_after_failed_index(self, mock_search_chunks, mock_submit):
+        mock_search_chunks.return_value = []
+        mock_completion = MagicMock()
+        mock_completion.choices[0].message.content = "answer"
+        self.llm.chat.completions.create.return_value = mock_completion
+        with app.app_context():
+            file = File.from_bytes("test.txt", b"content")
+            db.session.add(file)
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp/test"))
+            job = IngestJob(job_id="test_job", session_id="test_session", files_total=1)
+            job.status = "failed"
+            job.error = "broken pdf"
+            db.session.add(job)
+            db.session.commit()
+            db.session.add(SessionFile(session_id="test_session", file_id=file.id))
+            db.session.commit()
+            file_id = file.id
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        # The error is shown, and the chat is open with the files indexed so far.
+        response = self.app.get("/inference")
+        self.assertIn(b"Indexing failed: broken pdf", response.data)
+        self.assertIn(b"Retry indexing", response.data)
+        self.app.post("/inference", data={"query_text": "test query"})
+        mock_search_chunks.assert_called_once()
+
+        response = self.app.post("/jobs/test_job/retry")
+        self.assertEqual(response.status_code, 302)
+        mock_submit.assert_called_once()
+        self.assertEqual(mock_submit.call_args[0][3], [file_id])
+        with app.app_context():
+            self.assertEqual(
+                SessionFile.query.filter_by(session_id="test_session").count(), 1
+            )
+            job = (
+                IngestJob.query.filter_by(session_id="test_session")
+                .order_by(IngestJob.id.desc())
+                .first()
+            )
+            self.assertEqual(job.status, "queued")
+
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_page(self, mock_search_chunks):
+        mock_search_chunks.return_value = [
+            {"uuid": "1", "content": "Mock search results"}
+        ]
         mock_completion = MagicMock()
         mock_completion.choices[0].message.content = "Mock LLM response"
-        mock_openai.return_value.chat.completions.create.return_value = mock_completion
+        self.llm.chat.completions.create.return_value = mock_completion
 
         with app.app_context():
             user_session = UserSession(session_id="test_session", temp_dir="/tmp/test")
@@ -129,9 +411,304 @@ class TestApp(unittest.TestCase):
             self.assertEqual(conversations[1].role, "assistant")
             self.assertEqual(conversations[1].content, "Mock LLM response")
 
-    @patch("src.app.app.shutil.rmtree")
-    @patch("src.app.app.os.path.exists")
-    def test_cleanup(self, mock_exists, mock_rmtree):
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_stream(self, mock_search_chunks):
+        mock_search_chunks.return_value = [
+            {"uuid": "1", "content": "Mock search results"}
+        ]
+        chunks = []
+        for token in ["Mock", " LLM", None, " response"]:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = token
+            chunks.append(chunk)
+        self.llm.chat.completions.create.return_value = iter(chunks)
+
+        with app.app_context():
+            user_session = UserSession(session_id="test_session", temp_dir="/tmp/test")
+            db.session.add(user_session)
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        response = self.app.post("/inference/stream", data={"query_text": "test query"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+
+        body = response.get_data(as_text=True)
+        self.assertEqual(body.count("event: token"), 3)
+        self.assertIn("event: done", body)
+        self.assertIn('"tokens": 3', body)
+        self.assertTrue(self.llm.chat.completions.create.call_args.kwargs["stream"])
+
+        with app.app_context():
+            conversations = Conversation.query.filter_by(
+                session_id="test_session"
+            ).all()
+            self.assertEqual(len(conversations), 2)
+            self.assertEqual(conversations[1].role, "assistant")
+            self.assertEqual(conversations[1].content, "Mock LLM response")
+
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_answer_cache(self, mock_search_chunks):
+        mock_search_chunks.return_value = [
+            {"uuid": "1", "content": "Mock search results"}
+        ]
+        mock_completion = MagicMock()
+        mock_completion.choices[0].message.content = "Mock LLM response"
+        mock_create = self.llm.chat.completions.create
+        mock_create.return_value = mock_completion
+
+        with app.app_context():
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp"))
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        self.app.post("/inference", data={"query_text": "test query"})
+        self.app.post("/inference", data={"query_text": "test query"})
+        self.assertEqual(mock_create.call_count, 1)
+
+        response = self.app.post("/inference/stream", data={"query_text": "test query"})
+        body = response.get_data(as_text=True)
+        self.assertIn("Mock LLM response", body)
+        self.assertIn('"cached": true', body)
+        self.assertEqual(mock_create.call_count, 1)
+
+        # Opting out always asks the model.
+        self.app.post("/inference", data={"query_text": "test query", "no_cache": "1"})
+        self.assertEqual(mock_create.call_count, 2)
+
+        with app.app_context():
+            answers = Conversation.query.filter_by(
+                session_id="test_session", role="assistant"
+            ).all()
+            self.assertEqual(len(answers), 4)
+
+    def test_conversation_history(self):
+        with app.app_context():
+            for index in range(7):
+                Conversation.append("test_session", "user", f"message {index}")
+            Conversation.append("other_session", "user", "other")
+
+            recent = Conversation.recent("test_session", 5)
+            self.assertEqual(
+                [message.content for message in recent],
+                [f"message {index}" for index in range(2, 7)],
+            )
+            self.assertEqual([message.seq for message in recent], [3, 4, 5, 6, 7])
+            self.assertEqual(Conversation.recent("other_session", 5)[0].seq, 1)
+
+            page = Conversation.history_page("test_session", 1, per_page=3)
+            self.assertEqual(
+                [message.content for message in page.items],
+                ["message 4", "message 5", "message 6"],
+            )
+            self.assertTrue(page.has_next)
+            last_page = Conversation.history_page("test_session", 3, per_page=3)
+            self.assertEqual(
+                [message.content for message in last_page.items], ["message 0"]
+            )
+            self.assertFalse(last_page.has_next)
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp"))
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        with patch("src.app.models.PAGE_SIZE", 3):
+            response = self.app.get("/inference")
+            self.assertIn(b"message 6", response.data)
+            self.assertNotIn(b"message 3", response.data)
+            self.assertIn(b"Older messages", response.data)
+
+            response = self.app.get("/inference?page=2")
+            self.assertIn(b"message 3", response.data)
+            self.assertIn(b"Newer messages", response.data)
+
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_reads_only_recent_history(self, mock_search_chunks):
+        mock_search_chunks.return_value = []
+        mock_create = self.llm.chat.completions.create
+        mock_create.return_value.choices[0].message.content = "answer"
+
+        with app.app_context():
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp"))
+            db.session.commit()
+            for index in range(20):
+                Conversation.append("test_session", "user", f"old {index}")
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        with patch(
+            "src.app.views.Conversation.recent", wraps=Conversation.recent
+        ) as recent:
+            self.app.post("/inference", data={"query_text": "new"})
+            recent.assert_called_once_with("test_session", 5)
+
+        messages = mock_create.call_args.kwargs["messages"]
+        self.assertNotIn("old 14", str(messages))
+        self.assertEqual(messages[-1]["role"], "user")
+
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_busy(self, mock_search_chunks):
+        mock_search_chunks.return_value = []
+        chunks = [MagicMock()]
+        chunks[0].choices[0].delta.content = "answer"
+        self.llm.chat.completions.create.return_value = iter(chunks)
+
+        with app.app_context():
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp"))
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        # The stream holds the only slot until it is closed.
+        response = self.app.post("/inference/stream", data={"query_text": "first"})
+        self.assertEqual(self.limiter.stats()["in_flight"], 1)
+
+        busy = self.app.post("/inference", data={"query_text": "second"})
+        self.assertEqual(busy.status_code, 503)
+        self.assertIn("Retry-After", busy.headers)
+        busy = self.app.post("/inference/stream", data={"query_text": "third"})
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual(self.limiter.stats()["rejected"], 2)
+        # The rejected questions are not left in the history without an answer.
+        with app.app_context():
+            self.assertEqual(
+                [m.content for m in Conversation.recent("test_session", 10)],
+                ["first"],
+            )
+
+        self.assertIn("event: done", response.get_data(as_text=True))
+        response.close()
+        self.assertEqual(self.limiter.stats()["in_flight"], 0)
+
+    @patch("src.app.views.RAG_builder.search_chunks")
+    def test_inference_prompt_prefix(self, mock_search_chunks):
+        mock_search_chunks.side_effect = [
+            [{"uuid": "1", "content": "first chunk"}],
+            [{"uuid": "2", "content": "second chunk"}],
+        ]
+        mock_create = self.llm.chat.completions.create
+        mock_create.return_value.choices[0].message.content = "answer"
+
+        with app.app_context():
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp"))
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        self.app.post("/inference", data={"query_text": "first", "no_cache": "1"})
+        self.app.post("/inference", data={"query_text": "second", "no_cache": "1"})
+
+        first, second = [call.kwargs for call in mock_create.call_args_list]
+        self.assertTrue(first["extra_body"]["cache_prompt"])
+        # The system prompt and the pinned context of the first turn lead the second prompt.
+        self.assertEqual(first["messages"][0], second["messages"][0])
+        self.assertIn("first chunk", first["messages"][0]["content"])
+        self.assertEqual(second["messages"][1], {"role": "user", "content": "first"})
+        self.assertIn("second chunk", second["messages"][-1]["content"])
+
+        with app.app_context():
+            user_session = UserSession.query.filter_by(
+                session_id="test_session"
+            ).first()
+            self.assertEqual(user_session.pinned_context, '["first chunk"]')
+
+    @patch("src.app.views.jobs.submit")
+    def test_adding_files_unpins_context(self, mock_submit):
+        with app.app_context():
+            file = File.from_bytes("test.pdf", b"data")
+            db.session.add(file)
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp"))
+            db.session.commit()
+            UserSession.query.first().pinned_context = '["old chunk"]'
+            db.session.commit()
+            file_id = file.id
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        self.app.post("/session/files", data={"file_ids": [str(file_id)]})
+
+        with app.app_context():
+            self.assertIsNone(UserSession.query.first().pinned_context)
+
+    def test_metrics(self):
+        data = {"file": (BytesIO(b"test file content"), "test.txt")}
+        self.app.post("/upload", data=data, content_type="multipart/form-data")
+
+        response = self.app.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        self.assertIn('rag_stage_duration_seconds_count{stage="upload"}', body)
+        self.assertIn('rag_requests_in_flight{endpoint="upload_file"} 0', body)
+        self.assertIn('rag_requests_in_flight{endpoint="metrics_endpoint"} 1', body)
+        self.assertIn("rag_answer_cache_hit_rate", body)
+
+    def test_inference_stream_without_session(self):
+        response = self.app.post("/inference/stream", data={"query_text": "test query"})
+        self.assertEqual(response.status_code, 400)
+
+    @patch("src.app.views.jobs.submit")
+    def test_add_session_files(self, mock_submit):
+        with app.app_context():
+            old_file = File.from_bytes("old.txt", b"old content")
+            new_file = File.from_bytes("new.txt", b"new content")
+            db.session.add_all([old_file, new_file])
+            db.session.commit()
+            old_id, new_id = old_file.id, new_file.id
+            db.session.add(SessionFile(session_id="test_session", file_id=old_id))
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        response = self.app.post(
+            "/session/files", data={"file_ids": [str(old_id), str(new_id)]}
+        )
+        self.assertEqual(response.status_code, 302)
+
+        # Only the file that is not indexed yet is ingested.
+        mock_submit.assert_called_once()
+        self.assertEqual(mock_submit.call_args[0][3], [new_id])
+        with app.app_context():
+            file_ids = [
+                f.file_id
+                for f in SessionFile.query.filter_by(session_id="test_session")
+            ]
+            self.assertEqual(sorted(file_ids), sorted([old_id, new_id]))
+
+    @patch("src.app.views.RAG_builder.remove_file")
+    def test_remove_session_file(self, mock_remove_file):
+        mock_remove_file.return_value = 5
+        with app.app_context():
+            file = File.from_bytes("test.txt", b"test content")
+            db.session.add(file)
+            db.session.commit()
+            file_id = file.id
+            db.session.add(SessionFile(session_id="test_session", file_id=file_id))
+            db.session.commit()
+
+        with self.app.session_transaction() as session:
+            session["id"] = "test_session"
+
+        response = self.app.post(f"/session/files/{file_id}/remove")
+        self.assertEqual(response.status_code, 302)
+
+        mock_remove_file.assert_called_once_with("test_session", file_id)
+        with app.app_context():
+            self.assertIsNone(SessionFile.query.filter_by(file_id=file_id).first())
+
+    @patch("src.app.views.RAG_builder.drop_storage")
+    @patch("src.app.views.shutil.rmtree")
+    @patch("src.app.views.os.path.exists")
+    def test_cleanup(self, mock_exists, mock_rmtree, mock_drop_storage):
         mock_exists.return_value = True  # Simulate that the temp directory exists
 
         with app.app_context():
@@ -146,6 +723,7 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 302)  # Redirect status code
 
         mock_rmtree.assert_called_once_with("/tmp/test")
+        mock_drop_storage.assert_called_once_with("test_session")
 
         with app.app_context():
             user_session = UserSession.query.filter_by(
@@ -164,5 +742,61 @@ class TestApp(unittest.TestCase):
             )
 
 
+class TestWorkers(unittest.TestCase):
+    """Two apps on one database stand in for two worker processes of the WSGI server."""
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        config = {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{self.db_dir.name}/files.db",
+            "SECRET_KEY": "shared",
+        }
+        # The master process sets up the tables before the workers start.
+        init_database(create_app(config))
+        self.worker_a = create_app(config)
+        self.worker_b = create_app(config)
+
+    def tearDown(self):
+        for worker in (self.worker_a, self.worker_b):
+            with worker.app_context():
+                db.session.remove()
+                db.engine.dispose()
+        self.db_dir.cleanup()
+
+    def test_any_worker_serves_a_session(self):
+        client_a = self.worker_a.test_client()
+        client_b = self.worker_b.test_client()
+        with self.worker_a.app_context():
+            db.session.add(UserSession(session_id="test_session", temp_dir="/tmp"))
+            db.session.commit()
+            Conversation.append("test_session", "user", "asked on a")
+        with client_a.session_transaction() as session:
+            session["id"] = "test_session"
+
+        client_b.set_cookie("session", client_a.get_cookie("session").value)
+        response = client_b.get("/inference")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"asked on a", response.data)
+
+    def test_workers_leave_the_tables_alone(self):
+        config = {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{self.db_dir.name}/fresh.db",
+        }
+        worker = create_app(config)
+
+        with worker.app_context():
+            self.assertEqual(db.inspect(db.engine).get_table_names(), [])
+            db.engine.dispose()
+
+    def test_sqlite_runs_in_wal_mode(self):
+        with self.worker_a.app_context():
+            mode = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+
+        self.assertEqual(mode, "wal")
+
+
 if __name__ == "__main__":
     unittest.main()
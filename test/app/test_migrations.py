@@ -0,0 +1,181 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from io import BytesIO
+from unittest.mock import patch
+from src.app.app import create_app, init_database
+from src.app.models import db, File, Conversation
+from src.tools.blob_store import BlobStore
+
+# The schema the app created before the blob store, per-session files and ordered chat history.
+PRE_SERIES_SCHEMA = """
+CREATE TABLE file (
+    id INTEGER NOT NULL,
+    filename VARCHAR(100) NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE user_session (
+    id INTEGER NOT NULL,
+    session_id VARCHAR(255) NOT NULL,
+    temp_dir VARCHAR(255),
+    PRIMARY KEY (id),
+    UNIQUE (session_id)
+);
+CREATE TABLE conversation (
+    id INTEGER NOT NULL,
+    session_id VARCHAR(255) NOT NULL,
+    role VARCHAR(50) NOT NULL,
+    content TEXT NOT NULL,
+    timestamp INTEGER,
+    PRIMARY KEY (id)
+);
+INSERT INTO file (id, filename, data) VALUES (1, 'old.txt', X'6F6C6420636F6E74656E74');
+INSERT INTO user_session (id, session_id, temp_dir) VALUES (1, 'old_session', '/tmp');
+INSERT INTO conversation (id, session_id, role, content, timestamp) VALUES
+    (1, 'old_session', 'user', 'question', 100),
+    (2, 'other_session', 'user', 'hello', 101),
+    (3, 'old_session', 'assistant', 'answer', 102);
+"""
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = self.pre_series_database("files.db")
+        self.blob_store = BlobStore(root=os.path.join(self.tmp_dir.name, "blobs"))
+        self.blob_store_patch = patch(
+            "src.tools.blob_store.get_store", return_value=self.blob_store
+        )
+        self.blob_store_patch.start()
+        self.app = self.create_app()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.blob_store_patch.stop()
+        self.tmp_dir.cleanup()
+
+    def pre_series_database(self, name):
+        path = os.path.join(self.tmp_dir.name, name)
+        connection = sqlite3.connect(path)
+        connection.executescript(PRE_SERIES_SCHEMA)
+        connection.close()
+        return path
+
+    def create_app(self, db_path=None):
+        app = create_app(
+            {
+                "TESTING": True,
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path or self.db_path}",
+            }
+        )
+        init_database(app)
+        return app
+
+    def test_app_serves_a_pre_series_database(self):
+        client = self.app.test_client()
+
+        response = client.get("/files")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"old.txt", response.data)
+
+        data = {"file": (BytesIO(b"new content"), "new.txt")}
+        response = client.post("/upload", data=data, content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 302)
+        with self.app.app_context():
+            self.assertIsNotNone(File.query.filter_by(filename="new.txt").first())
+
+    def test_files_are_moved_to_the_blob_store(self):
+        with self.app.app_context():
+            file = db.session.get(File, 1)
+            self.assertEqual(file.size, len(b"old content"))
+            self.assertIsNone(file.page_count)  # not a pdf
+            self.assertIsNone(file.data)
+            with self.blob_store.open(file.sha256) as f:
+                self.assertEqual(f.read(), b"old content")
+            self.assertEqual(file.source, self.blob_store.path(file.sha256))
+
+    def test_messages_keep_their_order(self):
+        with self.app.app_context():
+            messages = Conversation.recent("old_session", 10)
+            self.assertEqual([m.content for m in messages], ["question", "answer"])
+            self.assertEqual([m.seq for m in messages], [1, 2])
+            self.assertEqual(messages[0].created_at, 100)
+
+            Conversation.append("old_session", "user", "follow-up")
+            self.assertEqual(Conversation.recent("old_session", 1)[0].seq, 3)
+
+    def test_upgrade_is_idempotent(self):
+        with self.app.app_context():
+            sha256 = db.session.get(File, 1).sha256
+
+        app = self.create_app()
+
+        with app.app_context():
+            self.assertEqual(db.session.get(File, 1).sha256, sha256)
+            self.assertEqual(Conversation.query.count(), 3)
+
+    def test_obsolete_indexes_are_dropped(self):
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(
+            "CREATE INDEX ix_conversation_session_created ON conversation (session_id, created_at)"
+        )
+        connection.close()
+
+        self.create_app()
+
+        connection = sqlite3.connect(self.db_path)
+        names = [
+            row[1] for row in connection.execute("PRAGMA index_list(conversation)")
+        ]
+        connection.close()
+        self.assertNotIn("ix_conversation_session_created", names)
+
+    def test_failed_upgrade_leaves_the_database_as_it_was(self):
+        db_path = self.pre_series_database("failed.db")
+        app = create_app(
+            {"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"}
+        )
+        # Without a value for the new seq column, the rebuild of conversation fails after renaming the table.
+        with patch("src.app.migrations.BACKFILL", {}):
+            with self.assertRaises(RuntimeError):
+                init_database(app)
+        with app.app_context():
+            db.engine.dispose()
+
+        connection = sqlite3.connect(db_path)
+        tables = [
+            row[0] for row in connection.execute("SELECT name FROM sqlite_master")
+        ]
+        contents = [
+            row[0] for row in connection.execute("SELECT content FROM conversation")
+        ]
+        connection.close()
+        self.assertNotIn("_old_conversation", tables)
+        self.assertEqual(contents, ["question", "hello", "answer"])
+
+    def test_table_left_renamed_is_restored(self):
+        db_path = self.pre_series_database("renamed.db")
+        # What an interrupted rebuild of an earlier version left behind.
+        connection = sqlite3.connect(db_path)
+        connection.execute("ALTER TABLE conversation RENAME TO _old_conversation")
+        connection.close()
+
+        app = self.create_app(db_path)
+
+        with app.app_context():
+            messages = Conversation.recent("old_session", 10)
+            self.assertEqual([m.content for m in messages], ["question", "answer"])
+            self.assertEqual(
+                db.inspect(db.engine).get_table_names().count("_old_conversation"), 0
+            )
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
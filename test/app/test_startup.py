@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+# Seconds importing the app may take in a fresh interpreter. It is generous so that a slow machine passes, while pulling
+# torch or nltk back into the import takes several times as long.
+IMPORT_BUDGET = float(os.environ.get("STARTUP_IMPORT_BUDGET", "3"))
+# Dependencies that are loaded on first use only, see RAG_builder.warmup.
+LAZY_MODULES = (
+    "nltk",
+    "openai",
+    "sentence_transformers",
+    "torch",
+    "transformers",
+    "weaviate",
+)
+
+IMPORT_APP = """
+import json, sys, time
+start = time.perf_counter()
+import src.app.app
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_importing_the_app_is_fast(self):
+        # A fresh interpreter, as the test run has imported most things already.
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_APP],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        imported = json.loads(result.stdout.splitlines()[-1])
+
+        self.assertEqual(
+            [module for module in LAZY_MODULES if module in imported["modules"]], []
+        )
+        self.assertLess(imported["seconds"], IMPORT_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+from benchmarks import compare, run
+
+
+def split_sentences(text):
+    return re.findall(r"[^.]+\.", text)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    @patch("src.tools.RAG_builder.sent_tokenize", side_effect=split_sentences)
+    def test_run_all_stages(self, mock_sent_tokenize):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, "results.json")
+            status = run.main(
+                [
+                    "--output",
+                    output,
+                    "--fake-embedding",
+                    "--workers",
+                    "1",
+                    "--pages",
+                    "2",
+                    "--files",
+                    "2",
+                    "--sentences",
+                    "100",
+                    "--chunks",
+                    "10",
+                    "--corpus-sizes",
+                    "10,50",
+                    "--queries",
+                    "2",
+                    "--answer-tokens",
+                    "4",
+                ]
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(status, 0)
+        stages = results["stages"]
+        self.assertEqual(list(stages), list(run.STAGES))
+        self.assertEqual(stages["extract"]["pages"], 4)
+        self.assertEqual(stages["chunk"]["chunks"], 34)
+        for backend in ("weaviate", "numpy"):
+            self.assertEqual(stages["ingest"][backend]["cold"]["chunks"], 28)
+            self.assertEqual(stages["ingest"][backend]["warm"]["chunks"], 28)
+        self.assertEqual(set(stages["search"]), {"10", "50"})
+        self.assertIn("p95_ms", stages["search"]["50"]["local"])
+        self.assertIn("p95_ms", stages["search"]["50"]["numpy"])
+        self.assertIn("p50_ms", stages["chat"]["time_to_first_token"])
+
+    def test_compare(self):
+        baseline = {
+            "stages": {
+                "chunk": {"sentences_per_sec": 1000.0},
+                "search": {"10": {"local": {"p50_ms": 10.0}}},
+            }
+        }
+        current = {
+            "stages": {
+                "chunk": {"sentences_per_sec": 950.0},
+                "search": {"10": {"local": {"p50_ms": 20.0}}},
+            }
+        }
+
+        rows = compare.compare(baseline, current, threshold=0.1)
+
+        self.assertEqual(
+            rows,
+            [
+                ("chunk.sentences_per_sec", 1000.0, 950.0, -0.05, False),
+                ("search.10.local.p50_ms", 10.0, 20.0, -1.0, True),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
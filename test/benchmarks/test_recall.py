@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+from benchmarks import recall
+
+
+class TestRecall(unittest.TestCase):
+
+    def test_evaluate(self):
+        vectors = recall.clustered_vectors(1020, 32)
+
+        results = recall.evaluate(
+            vectors[20:], vectors[:20], [3], ["float32", "int8"], [0, 4]
+        )
+
+        self.assertEqual(set(results), {"float32", "int8", "int8_rerank4"})
+        self.assertEqual(results["float32"]["recall_at_3"], 1.0)
+        self.assertEqual(results["float32"]["bytes_per_vector"], 128)
+        self.assertEqual(results["int8"]["bytes_per_vector"], 36)
+        self.assertGreaterEqual(results["int8_rerank4"]["recall_at_3"], 0.95)
+        self.assertIn("p50_ms", results["int8"]["search"])
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, "recall.json")
+            status = recall.main(
+                [
+                    "--fake-embedding",
+                    "--corpus-size",
+                    "200",
+                    "--queries",
+                    "5",
+                    "--dimensions",
+                    "16",
+                    "--dtypes",
+                    "float16",
+                    "--output",
+                    output,
+                ]
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(results["meta"]["corpus_size"], 200)
+        self.assertEqual(set(results["results"]), {"float16", "float16_rerank4"})
+
+
+if __name__ == "__main__":
+    unittest.main()
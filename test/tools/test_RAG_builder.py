@@ -1,126 +1,378 @@
+import re
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 import numpy as np
+from weaviate.util import generate_uuid5
+from src.tools import RAG_builder
+from src.tools.chunk_cache import ChunkCache, file_hash
 from src.tools.RAG_builder import (
+    CHUNK_SIZE,
     build_rag,
-    add_text_chunk_to_db,
+    chunk_uuid,
+    drop_storage,
+    remove_file,
     initiate_storage,
     chunk_text,
-    process_chunk,
+    search_chunks,
     semantic_search,
+    split_sentences,
+    warmup,
 )
 
 
+def ingest_report(objects):
+    return {"objects": objects, "failed": 0, "seconds": 0.5, "objects_per_sec": 4.0}
+
+
+def add_report(session_id, chunks, file_id, vectors=None, uuids=None):
+    return ingest_report(len(chunks))
+
+
+def split_sentences_on_periods(text):
+    return re.findall(r"[^.\s][^.]*(?:\.|$)", text)
+
+
 class TestRAGBuilder(unittest.TestCase):
 
-    @patch("src.tools.RAG_builder.initiate_storage")
-    @patch("src.tools.RAG_builder.utils.extract_content")
-    @patch("src.tools.RAG_builder.chunk_text")
-    def test_build_rag(
-        self, mock_chunk_text, mock_extract_content, mock_initiate_storage
-    ):
-        mock_client = MagicMock()
+    @patch(
+        "src.tools.RAG_builder.sent_tokenize", side_effect=split_sentences_on_periods
+    )
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    @patch("src.tools.RAG_builder.utils.iter_pages")
+    def test_build_rag(self, mock_iter_pages, mock_get_store, mock_sent_tokenize):
+        mock_store = mock_get_store.return_value
+        mock_store.vectorizes = True
+        mock_store.vectorizer = "weaviate-text2vec-transformers"
         mock_file = MagicMock()
-        mock_file.data = b"test data"
-        mock_extract_content.return_value = "extracted content"
+        mock_file.id = 7
+        mock_file.source = b"test data"
+        mock_file.sha256 = None
+        mock_file.filename = "test.pdf"
+        mock_iter_pages.return_value = iter(
+            [(0, "One. Two. Three"), (0, "still. Four.")]
+        )
+        mock_store.add.side_effect = add_report
+        mock_store.get_vectors.return_value = [[1.0, 0.0], [0.0, 1.0]]
+        progress = MagicMock()
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ChunkCache(root=cache_dir)
+            with patch(
+                "src.tools.RAG_builder.chunk_cache.get_cache", return_value=cache
+            ):
+                reports = build_rag([mock_file], "test_session", progress)
 
-        build_rag([mock_file], mock_client)
+                mock_store.create.assert_called_once_with("test_session")
+                self.assertEqual(mock_iter_pages.call_args.args, ([b"test data"],))
+                args, kwargs = mock_store.add.call_args
+                # The sentence that runs over the page break is kept whole.
+                self.assertEqual(
+                    args,
+                    ("test_session", ["One. Two. Three\nstill.", "Four."], 7),
+                )
+                self.assertIsNone(kwargs["vectors"])
+                self.assertEqual(len(kwargs["uuids"]), 2)
+                mock_store.get_vectors.assert_called_once_with(
+                    "test_session", kwargs["uuids"]
+                )
+                self.assertEqual(len(reports), 1)
+                self.assertEqual(reports[0]["filename"], "test.pdf")
+                self.assertEqual(reports[0]["objects"], 2)
+                self.assertEqual(reports[0]["pages"], 2)
+                self.assertFalse(reports[0]["cached"])
+                progress.assert_called_once_with(reports[0])
 
-        mock_initiate_storage.assert_called_once_with(mock_client)
-        mock_extract_content.assert_called_once_with(b"test data")
-        mock_chunk_text.assert_called_once_with("extracted content", 3)
+                # Indexing the same contents again reuses the pages, chunks and vectors.
+                mock_sent_tokenize.reset_mock()
+                reports = build_rag([mock_file], "test_session")
 
-    @patch("src.tools.RAG_builder.weaviate.connect_to_local")
-    def test_add_text_chunk_to_db(self, mock_connect):
-        mock_client = MagicMock()
-        mock_connect.return_value = mock_client
-        mock_collection = MagicMock()
-        mock_client.collections.get.return_value = mock_collection
+                mock_iter_pages.assert_called_once()
+                mock_sent_tokenize.assert_not_called()
+                mock_store.get_vectors.assert_called_once()
+                second_args, second_kwargs = mock_store.add.call_args
+                self.assertEqual(second_args, args)
+                self.assertEqual(
+                    second_kwargs["vectors"].tolist(), [[1.0, 0.0], [0.0, 1.0]]
+                )
+                self.assertEqual(second_kwargs["uuids"], kwargs["uuids"])
+                self.assertTrue(reports[0]["cached"])
+                self.assertEqual(reports[0]["pages"], 2)
 
-        add_text_chunk_to_db("test chunk")
+                # Vectors computed by weaviate are not reused for local embedding, which needs them in the space of
+                # the query encoder.
+                with patch("src.tools.RAG_builder.INGEST_EMBEDDING", "local"), patch(
+                    "src.tools.RAG_builder.embedding.encode_chunks",
+                    return_value=np.array([[0.5, 0.5], [0.5, 0.5]]),
+                ) as mock_encode_chunks:
+                    build_rag([mock_file], "local_session")
 
-        mock_connect.assert_called_once_with(
-            host="weaviate", port=8080, grpc_port=50051
+                mock_encode_chunks.assert_called_once()
+                self.assertEqual(
+                    mock_store.add.call_args.kwargs["vectors"].tolist(),
+                    [[0.5, 0.5], [0.5, 0.5]],
+                )
+
+    @patch("src.tools.RAG_builder.PIPELINE_BATCH_SIZE", 2)
+    @patch("src.tools.RAG_builder.INGEST_EMBEDDING", "local")
+    @patch(
+        "src.tools.RAG_builder.sent_tokenize", side_effect=split_sentences_on_periods
+    )
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    @patch("src.tools.RAG_builder.utils.iter_pages")
+    @patch("src.tools.RAG_builder.embedding.encode_chunks")
+    def test_build_rag_local_embedding(
+        self,
+        mock_encode_chunks,
+        mock_iter_pages,
+        mock_get_store,
+        mock_sent_tokenize,
+    ):
+        mock_store = mock_get_store.return_value
+        mock_store.vectorizes = True
+        mock_store.vectorizer = "weaviate-text2vec-transformers"
+        files = [
+            MagicMock(id=7, source=b"test data", sha256=None),
+            MagicMock(id=8, source=b"empty", sha256=None),
+            MagicMock(id=9, source=b"more data", sha256=None),
+        ]
+        mock_iter_pages.return_value = iter(
+            [(0, "1. 2. 3."), (0, "4. 5. 6. 7. 8. 9. 10."), (2, "11.")]
+        )
+        mock_store.add.side_effect = add_report
+        mock_encode_chunks.side_effect = lambda chunks: np.array(
+            [[float(len(chunk)), 1.0] for chunk in chunks]
         )
-        mock_client.collections.get.assert_called_once_with("TextChunk")
-        mock_collection.data.insert.assert_called_once_with({"content": "test chunk"})
-        mock_client.close.assert_called_once()
 
-    def test_initiate_storage(self):
-        mock_client = MagicMock()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ChunkCache(root=cache_dir)
+            with patch(
+                "src.tools.RAG_builder.chunk_cache.get_cache", return_value=cache
+            ):
+                reports = build_rag(files, "test_session")
+
+                # The chunks are vectorized and written in batches as they are made.
+                self.assertEqual(
+                    [call.args[0] for call in mock_encode_chunks.call_args_list],
+                    [["1. 2. 3.", "4. 5. 6."], ["7. 8. 9.", "10."], ["11."]],
+                )
+                adds = mock_store.add.call_args_list
+                self.assertEqual(
+                    [(call.args[1], call.args[2]) for call in adds],
+                    [
+                        (["1. 2. 3.", "4. 5. 6."], 7),
+                        (["7. 8. 9.", "10."], 7),
+                        (["11."], 9),
+                    ],
+                )
+                self.assertEqual(
+                    adds[1].kwargs["vectors"].tolist(), [[8.0, 1.0], [3.0, 1.0]]
+                )
+                self.assertEqual([report["objects"] for report in reports], [4, 0, 1])
+                self.assertEqual([report["pages"] for report in reports], [2, 0, 1])
+                mock_store.get_vectors.assert_not_called()
+
+                # The vectors are cached like the ones computed by weaviate, and sliced into the same batches.
+                mock_store.add.reset_mock()
+                build_rag(files, "other_session")
+                self.assertEqual(mock_encode_chunks.call_count, 3)
+                cached_adds = mock_store.add.call_args_list
+                self.assertEqual(
+                    cached_adds[1].kwargs["vectors"].tolist(),
+                    [[8.0, 1.0], [3.0, 1.0]],
+                )
+                self.assertEqual(
+                    [call.kwargs["uuids"] for call in cached_adds],
+                    [call.kwargs["uuids"] for call in adds],
+                )
+
+    @patch(
+        "src.tools.RAG_builder.sent_tokenize", side_effect=split_sentences_on_periods
+    )
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    @patch("src.tools.RAG_builder.utils.iter_pages")
+    @patch("src.tools.RAG_builder.embedding.encode_chunks")
+    def test_build_rag_store_without_vectorizer(
+        self,
+        mock_encode_chunks,
+        mock_iter_pages,
+        mock_get_store,
+        mock_sent_tokenize,
+    ):
+        mock_store = mock_get_store.return_value
+        mock_store.vectorizes = False
+        mock_iter_pages.return_value = iter([(0, "Extracted.")])
+        mock_store.add.side_effect = add_report
+        mock_encode_chunks.return_value = np.array([[1.0, 0.0]])
 
-        initiate_storage(mock_client)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch(
+                "src.tools.RAG_builder.chunk_cache.get_cache",
+                return_value=ChunkCache(root=cache_dir),
+            ):
+                build_rag([MagicMock(id=7, source=b"data", sha256=None)], "session")
 
-        mock_client.collections.delete_all.assert_called_once()
-        mock_client.collections.create.assert_called_once()
-        mock_client.close.assert_called_once()
+        mock_encode_chunks.assert_called_once_with(["Extracted."])
+        self.assertIsNotNone(mock_store.add.call_args.kwargs["vectors"])
+
+    @patch(
+        "src.tools.RAG_builder.sent_tokenize", side_effect=split_sentences_on_periods
+    )
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    @patch("src.tools.RAG_builder.utils.iter_pages")
+    def test_build_rag_failure_caches_nothing(
+        self, mock_iter_pages, mock_get_store, mock_sent_tokenize
+    ):
+        mock_store = mock_get_store.return_value
+        mock_store.vectorizes = True
+        mock_store.vectorizer = "weaviate-text2vec-transformers"
+        mock_iter_pages.return_value = iter([(0, "One."), (0, "Two.")])
+        mock_store.add.side_effect = RuntimeError("store is down")
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ChunkCache(root=cache_dir)
+            with patch(
+                "src.tools.RAG_builder.chunk_cache.get_cache", return_value=cache
+            ):
+                with self.assertRaises(RuntimeError):
+                    build_rag([MagicMock(id=7, source=b"data", sha256=None)], "session")
+
+            content_hash = file_hash(b"data")
+            self.assertIsNone(cache.iter_pages(content_hash))
+            self.assertIsNone(cache.iter_chunks(content_hash, CHUNK_SIZE))
+
+    @patch(
+        "src.tools.RAG_builder.sent_tokenize", side_effect=split_sentences_on_periods
+    )
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    @patch("src.tools.RAG_builder.utils.iter_pages")
+    def test_build_rag_does_not_cache_a_file_with_skipped_pages(
+        self, mock_iter_pages, mock_get_store, mock_sent_tokenize
+    ):
+        mock_store = mock_get_store.return_value
+        mock_store.vectorizes = True
+        mock_store.vectorizer = "weaviate-text2vec-transformers"
+        mock_store.add.side_effect = add_report
+        mock_store.get_vectors.return_value = [[1.0, 0.0]]
+
+        def iter_pages(sources, on_skip):
+            yield 0, "One."
+            # The second page range of the file timed out.
+            on_skip(0)
+            yield 0, ""
+
+        mock_iter_pages.side_effect = iter_pages
+        file = MagicMock(id=7, source=b"data", sha256=None)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ChunkCache(root=cache_dir)
+            with patch(
+                "src.tools.RAG_builder.chunk_cache.get_cache", return_value=cache
+            ):
+                reports = build_rag([file], "session")
+                # The next ingest of the file extracts it again.
+                build_rag([file], "session")
+
+            content_hash = file_hash(b"data")
+            self.assertEqual(reports[0]["objects"], 1)
+            self.assertIsNone(cache.iter_pages(content_hash))
+            self.assertIsNone(cache.iter_chunks(content_hash, CHUNK_SIZE))
+            self.assertEqual(mock_iter_pages.call_count, 2)
+
+    @patch("src.tools.RAG_builder.INGEST_EMBEDDING", "bogus")
+    def test_build_rag_unknown_embedding_mode(self):
+        with self.assertRaises(ValueError):
+            build_rag([], "test_session")
+
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    def test_storage_functions_use_the_store(self, mock_get_store):
+        mock_store = mock_get_store.return_value
+        mock_store.remove_file.return_value = 4
+
+        initiate_storage("test-session")
+        self.assertEqual(remove_file("test-session", 7), 4)
+        drop_storage("test-session")
+
+        mock_store.create.assert_called_once_with("test-session")
+        mock_store.remove_file.assert_called_once_with("test-session", 7)
+        mock_store.drop.assert_called_once_with("test-session")
 
     @patch("src.tools.RAG_builder.sent_tokenize")
-    @patch("src.tools.RAG_builder.process_chunk")
-    def test_chunk_text(self, mock_process_chunk, mock_sent_tokenize):
+    def test_chunk_text(self, mock_sent_tokenize):
         mock_sent_tokenize.return_value = [
             "Sentence 1.",
             "Sentence 2.",
             "Sentence 3.",
             "Sentence 4.",
+            "Sentence 5.",
         ]
 
-        chunk_text("Test text", 2)
+        chunks = chunk_text("Test text", 2)
 
         mock_sent_tokenize.assert_called_once_with("Test text")
-        self.assertEqual(mock_process_chunk.call_count, 2)
-        mock_process_chunk.assert_any_call(["Sentence 1.", "Sentence 2."])
-        mock_process_chunk.assert_any_call(["Sentence 3.", "Sentence 4."])
-
-    @patch("src.tools.RAG_builder.add_text_chunk_to_db")
-    def test_process_chunk(self, mock_add_text_chunk_to_db):
-        process_chunk(["Chunk 1", "Chunk 2"])
-
-        mock_add_text_chunk_to_db.assert_called_once_with("Chunk 1 Chunk 2")
-
-    @patch("src.tools.RAG_builder.weaviate.connect_to_local")
-    @patch("src.tools.RAG_builder.SentenceTransformer")
-    def test_semantic_search(self, mock_sentence_transformer, mock_connect):
-        mock_client = MagicMock()
-        mock_connect.return_value = mock_client
-        mock_collection = MagicMock()
-        mock_client.collections.get.return_value = mock_collection
-
-        mock_response = MagicMock()
-        mock_response.objects = [
-            MagicMock(
-                vector={"default": np.array([1, 0, 0])},
-                properties={"content": "Content 1"},
-            ),
-            MagicMock(
-                vector={"default": np.array([0, 1, 0])},
-                properties={"content": "Content 2"},
-            ),
-            MagicMock(
-                vector={"default": np.array([0, 0, 1])},
-                properties={"content": "Content 3"},
-            ),
-        ]
-        mock_collection.query.fetch_objects.return_value = mock_response
+        self.assertEqual(
+            chunks,
+            ["Sentence 1. Sentence 2.", "Sentence 3. Sentence 4.", "Sentence 5."],
+        )
 
-        mock_model = MagicMock()
-        mock_model.encode.return_value = np.array([1, 1, 0])
-        mock_sentence_transformer.return_value = mock_model
+    @patch(
+        "src.tools.RAG_builder.sent_tokenize", side_effect=split_sentences_on_periods
+    )
+    def test_split_sentences_across_pages(self, mock_sent_tokenize):
+        pages = ["One. Two", "continues. Three.", "", "Four."]
 
-        result = semantic_search("test query", 2)
+        self.assertEqual(
+            list(split_sentences(pages)),
+            ["One.", "Two\ncontinues.", "Three.", "Four."],
+        )
+        self.assertEqual(mock_sent_tokenize.call_count, 4)
+
+    def test_chunk_uuid_matches_weaviate(self):
+        self.assertEqual(chunk_uuid("abc", 3), generate_uuid5(("abc", 3)))
+
+    @patch("src.tools.RAG_builder._sentence_tokenizer", None)
+    @patch("nltk.data.find", side_effect=LookupError)
+    def test_sentence_tokenizer_without_punkt(self, mock_find):
+        with self.assertRaises(LookupError) as context:
+            RAG_builder.sent_tokenize("One. Two.")
+
+        mock_find.assert_called_once_with("tokenizers/punkt")
+        self.assertIn("nltk.downloader", str(context.exception))
+        self.assertIsNone(RAG_builder._sentence_tokenizer)
+
+    @patch("src.tools.RAG_builder.embedding.warmup")
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    @patch("src.tools.RAG_builder._get_sentence_tokenizer")
+    def test_warmup(self, mock_get_tokenizer, mock_get_store, mock_embedding_warmup):
+        warmup()
 
-        mock_connect.assert_called_once_with(
-            host="weaviate", port=8080, grpc_port=50051
+        mock_get_tokenizer.assert_called_once_with()
+        mock_get_store.assert_called_once_with()
+        mock_embedding_warmup.assert_called_once_with()
+
+    @patch("src.tools.RAG_builder.vector_store.get_store")
+    def test_search_chunks(self, mock_get_store):
+        chunks = [
+            {"uuid": "uuid-2", "content": "Content 2"},
+            {"uuid": "uuid-1", "content": "Content 1"},
+        ]
+        mock_get_store.return_value.search.return_value = chunks
+
+        self.assertEqual(search_chunks("test query", 2, "test-session"), chunks)
+        mock_get_store.return_value.search.assert_called_once_with(
+            "test-session", "test query", 2, "near_vector"
         )
-        mock_client.collections.get.assert_called_once_with("TextChunk")
-        mock_collection.query.fetch_objects.assert_called_once_with(include_vector=True)
-        mock_sentence_transformer.assert_called_once_with(
-            "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
+
+        result = semantic_search("test query", 2, "test-session", mode="local")
+
+        self.assertEqual(result, "Content 2 Content 1")
+        mock_get_store.return_value.search.assert_called_with(
+            "test-session", "test query", 2, "local"
         )
-        mock_model.encode.assert_called_once_with("test query")
-        mock_client.close.assert_called_once()
 
-        self.assertEqual(result, "Content 1 Content 2")
+    def test_semantic_search_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            semantic_search("test query", 2, "test-session", mode="bogus")
 
 
 if __name__ == "__main__":
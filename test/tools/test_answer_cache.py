@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch
+from src.tools.answer_cache import AnswerCache, context_fingerprint
+
+
+class TestAnswerCache(unittest.TestCase):
+
+    def test_similar_query_same_context_hits(self):
+        cache = AnswerCache(max_entries=10, ttl=60, threshold=0.95)
+        cache.put([1.0, 0.0], ["a", "b"], "answer")
+
+        self.assertEqual(cache.get([1.0, 0.01], ["b", "a"]), "answer")
+        self.assertIsNone(cache.get([0.0, 1.0], ["a", "b"]))
+        self.assertIsNone(cache.get([1.0, 0.0], ["a", "c"]))
+        self.assertEqual(
+            cache.stats(),
+            {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "size": 1, "capacity": 10},
+        )
+
+    def test_lru_eviction(self):
+        cache = AnswerCache(max_entries=2, ttl=60, threshold=0.95)
+        cache.put([1.0, 0.0], ["a"], "first")
+        cache.put([1.0, 0.0], ["b"], "second")
+        cache.get([1.0, 0.0], ["a"])  # makes "second" the least recently used
+        cache.put([1.0, 0.0], ["c"], "third")
+
+        self.assertEqual(cache.get([1.0, 0.0], ["a"]), "first")
+        self.assertIsNone(cache.get([1.0, 0.0], ["b"]))
+        self.assertEqual(cache.get([1.0, 0.0], ["c"]), "third")
+
+    @patch("src.tools.answer_cache.time.monotonic")
+    def test_ttl_expiry(self, mock_monotonic):
+        cache = AnswerCache(max_entries=10, ttl=60, threshold=0.95)
+        mock_monotonic.return_value = 100.0
+        cache.put([1.0, 0.0], ["a"], "answer")
+
+        mock_monotonic.return_value = 150.0
+        self.assertEqual(cache.get([1.0, 0.0], ["a"]), "answer")
+        mock_monotonic.return_value = 161.0
+        self.assertIsNone(cache.get([1.0, 0.0], ["a"]))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_disabled(self):
+        cache = AnswerCache(max_entries=0)
+        cache.put([1.0, 0.0], ["a"], "answer")
+        self.assertIsNone(cache.get([1.0, 0.0], ["a"]))
+
+    def test_context_fingerprint_ignores_order(self):
+        self.assertEqual(
+            context_fingerprint(["a", "b"]), context_fingerprint(["b", "a"])
+        )
+        self.assertNotEqual(context_fingerprint(["a"]), context_fingerprint(["a", "b"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from src.tools.blob_store import BlobStore, BlobTooLargeError
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = BlobStore(root=self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self, content_hash):
+        with self.store.open(content_hash) as f:
+            return f.read()
+
+    def test_put_stream(self):
+        data = b"x" * 2500
+
+        content_hash, size = self.store.put_stream(io.BytesIO(data), chunk_size=1000)
+
+        self.assertEqual(content_hash, hashlib.sha256(data).hexdigest())
+        self.assertEqual(size, 2500)
+        self.assertTrue(self.store.exists(content_hash))
+        self.assertEqual(self.read(content_hash), data)
+        self.assertEqual(
+            self.store.path(content_hash),
+            os.path.join(self.temp_dir.name, content_hash[:2], content_hash),
+        )
+
+    def test_put_bytes_deduplicates(self):
+        first = self.store.put_bytes(b"same content")
+        second = self.store.put_bytes(b"same content")
+
+        self.assertEqual(first, second)
+        blob_dir = os.path.dirname(self.store.path(first[0]))
+        self.assertEqual(os.listdir(blob_dir), [first[0]])
+        # No temporary files are left behind.
+        self.assertEqual(
+            [name for name in os.listdir(self.temp_dir.name) if name.endswith(".tmp")],
+            [],
+        )
+
+    def test_writer(self):
+        writer = self.store.writer(max_bytes=10)
+        writer.write(b"hello ")
+        writer.write(b"blob")
+        with self.assertRaises(BlobTooLargeError):
+            writer.write(b"!")
+
+        content_hash, size = writer.commit()
+        writer.discard()
+
+        self.assertEqual(size, 10)
+        self.assertEqual(content_hash, hashlib.sha256(b"hello blob").hexdigest())
+        self.assertEqual(self.read(content_hash), b"hello blob")
+
+    def test_discarded_writer_leaves_nothing(self):
+        writer = self.store.writer()
+        writer.write(b"partial")
+        writer.discard()
+
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
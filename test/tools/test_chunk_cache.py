@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.tools.chunk_cache import ChunkCache, file_hash
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = ChunkCache(root=self.temp_dir.name, max_bytes=10**6)
+        self.content_hash = file_hash(b"test content")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_file_hash(self):
+        self.assertEqual(
+            file_hash(b"abc"),
+            "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad",
+        )
+
+    def test_pages_and_chunks(self):
+        self.assertIsNone(self.cache.iter_pages(self.content_hash))
+        self.assertIsNone(self.cache.iter_chunks(self.content_hash, 3))
+
+        with self.cache.page_writer(self.content_hash) as writer:
+            writer.write("Page 1")
+            writer.write("Page 2")
+        with self.cache.chunk_writer(self.content_hash, 3) as writer:
+            writer.write("Chunk 1")
+
+        self.assertEqual(
+            list(self.cache.iter_pages(self.content_hash)), ["Page 1", "Page 2"]
+        )
+        self.assertEqual(self.cache.get_page_count(self.content_hash), 2)
+        self.assertEqual(
+            list(self.cache.iter_chunks(self.content_hash, 3)), ["Chunk 1"]
+        )
+        self.assertIsNone(self.cache.iter_chunks(self.content_hash, 5))
+        self.assertEqual(self.cache.stats(), {"hits": 3, "misses": 3})
+
+    def test_vectors(self):
+        self.assertIsNone(self.cache.get_vectors(self.content_hash, 3, "org/model"))
+
+        with self.cache.vector_writer(self.content_hash, 3, "org/model") as writer:
+            writer.write([[1.0, 2.0]])
+
+        vectors = self.cache.get_vectors(self.content_hash, 3, "org/model")
+        self.assertEqual(vectors.dtype, np.float32)
+        self.assertEqual(vectors.tolist(), [[1.0, 2.0]])
+        self.assertIsNone(self.cache.get_vectors(self.content_hash, 3, "other"))
+
+    def test_chunks_are_written_and_read_one_at_a_time(self):
+        with self.cache.chunk_writer(self.content_hash, 3) as writer:
+            writer.write("Chunk 1")
+            # Nothing is visible until the writer is closed.
+            self.assertIsNone(self.cache.iter_chunks(self.content_hash, 3))
+            writer.write("Chunk 2")
+
+        chunks = self.cache.iter_chunks(self.content_hash, 3)
+        self.assertEqual(next(chunks), "Chunk 1")
+        self.assertEqual(list(chunks), ["Chunk 2"])
+
+    def test_failed_or_discarded_writes_leave_no_entry(self):
+        with self.assertRaises(RuntimeError):
+            with self.cache.page_writer(self.content_hash) as writer:
+                writer.write("Page 1")
+                raise RuntimeError("extraction failed")
+        with self.cache.vector_writer(self.content_hash, 3, "model") as writer:
+            writer.write([[1.0, 2.0]])
+            writer.discard()
+
+        self.assertIsNone(self.cache.iter_pages(self.content_hash))
+        self.assertIsNone(self.cache.get_page_count(self.content_hash))
+        self.assertIsNone(self.cache.get_vectors(self.content_hash, 3, "model"))
+        self.assertEqual(os.listdir(self.cache._path(self.content_hash)), [])
+
+    def test_vectors_written_in_batches(self):
+        with self.cache.vector_writer(self.content_hash, 3, "model") as writer:
+            writer.write(np.array([[1.0, 2.0], [3.0, 4.0]]))
+            writer.write([[5.0, 6.0]])
+            with self.assertRaises(ValueError):
+                writer.write([[1.0, 2.0, 3.0]])
+
+        vectors = self.cache.get_vectors(self.content_hash, 3, "model")
+        self.assertEqual(vectors.tolist(), [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+
+    def test_evict_least_recently_used(self):
+        cache = ChunkCache(root=self.temp_dir.name, max_bytes=150)
+        old_hash = file_hash(b"old")
+        new_hash = file_hash(b"new")
+        for content_hash, chunk in [(old_hash, "x" * 100), (new_hash, "y" * 100)]:
+            with cache.chunk_writer(content_hash, 3) as writer:
+                writer.write(chunk)
+        old_dir = os.path.join(self.temp_dir.name, old_hash[:2], old_hash)
+        os.utime(old_dir, (0, 0))
+
+        cache.evict()
+
+        self.assertIsNone(cache.iter_chunks(old_hash, 3))
+        self.assertEqual(list(cache.iter_chunks(new_hash, 3)), ["y" * 100])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import patch
+from src.tools.context_builder import (
+    SYSTEM_PROMPT,
+    build_messages,
+    count_tokens,
+    select_chunks,
+)
+
+
+class TestContextBuilder(unittest.TestCase):
+
+    def test_count_tokens(self):
+        self.assertEqual(count_tokens(""), 0)
+        self.assertEqual(count_tokens("Hello, world!"), 4)
+        # Long words are counted as several sub-word tokens.
+        self.assertEqual(count_tokens("internationalization"), 3)
+
+    def test_select_chunks_drops_near_duplicates(self):
+        chunks = [
+            "the cat sat on the mat today",
+            "The cat sat on the mat today.",
+            "dogs bark at the mailman",
+        ]
+        self.assertEqual(
+            select_chunks(chunks, budget=100),
+            ["the cat sat on the mat today", "dogs bark at the mailman"],
+        )
+
+    def test_select_chunks_respects_budget(self):
+        chunks = ["one two three four five", "six seven", "eight nine ten"]
+        self.assertEqual(select_chunks(chunks, budget=5), ["one two three four five"])
+        self.assertEqual(select_chunks(chunks, budget=4), ["six seven"])
+
+    def test_build_messages(self):
+        history = [
+            {"role": "user", "content": "first question"},
+            {"role": "assistant", "content": "first answer"},
+        ]
+        messages, stats = build_messages("what now", ["some context"], history)
+
+        system = {
+            "role": "system",
+            "content": f"{SYSTEM_PROMPT}\nContext: some context",
+        }
+        query = {"role": "user", "content": "what now"}
+        self.assertEqual(messages, [system, *history, query])
+        self.assertEqual(stats["pinned"], ["some context"])
+        self.assertEqual(stats["tokens_saved"], 0)
+        self.assertEqual(stats["chunks_dropped"], 0)
+        self.assertEqual(stats["history_dropped"], 0)
+
+    def test_build_messages_keeps_the_pinned_prefix(self):
+        history = [{"role": "user", "content": "first question"}]
+        first, stats = build_messages("first question", ["pinned chunk"], [])
+        second, _ = build_messages(
+            "what now",
+            ["new chunk", "pinned chunk"],
+            history,
+            pinned=stats["pinned"],
+        )
+
+        # The second prompt continues the first one, so its evaluation can be reused.
+        self.assertEqual(second[: len(first)], first)
+        self.assertEqual(
+            second[-1], {"role": "user", "content": "what now\nContext: new chunk"}
+        )
+
+    @patch("src.tools.context_builder.SYSTEM_PROMPT", "system")
+    def test_build_messages_trims_oldest_history(self):
+        history = [
+            {"role": "user", "content": "an old question with many words in it"},
+            {"role": "assistant", "content": "recent answer"},
+        ]
+        messages, stats = build_messages(
+            "query", ["context chunk"], history, budget=16, pinned=[]
+        )
+
+        self.assertEqual(
+            messages,
+            [
+                {"role": "system", "content": "system\nContext: "},
+                {"role": "assistant", "content": "recent answer"},
+                {"role": "user", "content": "query\nContext: context chunk"},
+            ],
+        )
+        self.assertEqual(stats["history_dropped"], 1)
+        self.assertEqual(stats["tokens_saved"], 9)
+        self.assertLessEqual(stats["tokens"], 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
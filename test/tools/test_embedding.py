@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import numpy as np
+from src.tools import embedding
+
+
+class TestEmbedding(unittest.TestCase):
+
+    def setUp(self):
+        embedding._models.clear()
+        embedding.clear_cache()
+
+    def tearDown(self):
+        embedding._models.clear()
+        embedding.clear_cache()
+
+    @patch("src.tools.embedding._load_model")
+    def test_get_model_loads_once(self, mock_load_model):
+        first = embedding.get_model()
+        second = embedding.get_model()
+
+        self.assertIs(first, second)
+        mock_load_model.assert_called_once_with(
+            "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
+        )
+
+    @patch("src.tools.embedding._load_model")
+    def test_warmup(self, mock_load_model):
+        embedding.warmup()
+
+        mock_load_model.return_value.encode.assert_called_once_with("warmup")
+
+    @patch("src.tools.embedding._load_model")
+    def test_encode_chunks(self, mock_load_model):
+        mock_model = mock_load_model.return_value
+        mock_model.encode.return_value = np.zeros((2, 3), dtype=np.float32)
+
+        vectors = embedding.encode_chunks(["chunk 1", "chunk 2"], batch_size=16)
+
+        self.assertEqual(vectors.shape, (2, 3))
+        mock_model.encode.assert_called_once_with(
+            ["chunk 1", "chunk 2"],
+            batch_size=16,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+
+    @patch("src.tools.embedding._load_model")
+    def test_encode_query_cache_hit(self, mock_load_model):
+        mock_model = MagicMock()
+        mock_model.encode.return_value = np.array([1.0, 0.0])
+        mock_load_model.return_value = mock_model
+
+        first = embedding.encode_query("What is RAG?")
+        second = embedding.encode_query("  what is   rag? ")
+
+        self.assertIs(first, second)
+        mock_model.encode.assert_called_once_with("what is rag?")
+        stats = embedding.cache_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    @patch("src.tools.embedding.QUERY_CACHE_SIZE", 2)
+    @patch("src.tools.embedding._load_model")
+    def test_encode_query_evicts_least_recently_used(self, mock_load_model):
+        mock_load_model.return_value.encode.side_effect = lambda text: np.array(
+            [float(len(text))]
+        )
+
+        embedding.encode_query("a")
+        embedding.encode_query("bb")
+        embedding.encode_query("a")
+        embedding.encode_query("ccc")
+        embedding.encode_query("bb")
+
+        self.assertEqual(embedding.cache_stats()["size"], 2)
+        self.assertEqual(embedding.cache_stats()["misses"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
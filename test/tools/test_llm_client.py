@@ -0,0 +1,272 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from openai.types.chat import ChatCompletion
+from src.tools import llm_client
+from src.tools.llm_client import Limiter, QueueFullError, Router
+
+
+class TestLimiter(unittest.TestCase):
+
+    def test_slots(self):
+        limiter = Limiter(max_in_flight=2, max_queue=0, queue_timeout=1)
+
+        with limiter.slot(), limiter.slot():
+            self.assertEqual(limiter.stats()["in_flight"], 2)
+            with self.assertRaises(QueueFullError):
+                limiter.acquire()
+
+        stats = limiter.stats()
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["admitted"], 2)
+        self.assertEqual(stats["rejected"], 1)
+
+    def test_waiters_are_served_in_order(self):
+        limiter = Limiter(max_in_flight=1, max_queue=2, queue_timeout=5)
+        limiter.acquire()
+        order = []
+
+        def wait(name):
+            with limiter.slot():
+                order.append(name)
+
+        threads = []
+        for name in ["first", "second"]:
+            thread = threading.Thread(target=wait, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while limiter.stats()["waiting"] < len(threads):
+                pass
+        with self.assertRaises(QueueFullError):
+            limiter.acquire()
+
+        limiter.release()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ["first", "second"])
+        self.assertEqual(limiter.stats()["in_flight"], 0)
+
+    @patch("src.tools.llm_client.metrics.observe")
+    def test_queue_timeout(self, mock_observe):
+        limiter = Limiter(max_in_flight=1, max_queue=1, queue_timeout=0.01)
+        limiter.acquire()
+        mock_observe.assert_called_once_with("llm_queue_wait", 0.0)
+
+        with self.assertRaises(QueueFullError):
+            limiter.acquire()
+
+        stats = limiter.stats()
+        self.assertEqual(stats["timed_out"], 1)
+        self.assertEqual(stats["waiting"], 0)
+        limiter.release()
+        self.assertEqual(limiter.stats()["in_flight"], 0)
+
+
+class TestRouter(unittest.TestCase):
+
+    def router(self, routing="least_outstanding", **kwargs):
+        return Router(
+            ["http://a", "http://b"],
+            routing=routing,
+            client_factory=lambda url: MagicMock(url=url),
+            health_check_interval=3600,
+            **kwargs,
+        )
+
+    def fail(self, router, session_id=None):
+        with self.assertRaises(ConnectionError):
+            with router.backend(session_id):
+                raise ConnectionError("down")
+
+    def test_least_outstanding(self):
+        router = self.router()
+
+        first = router.pick()
+        second = router.pick()
+        self.assertNotEqual(first.url, second.url)
+
+        router._finish(first, 1.0)
+        with router.backend() as generation:
+            self.assertEqual(generation.client.url, first.url)
+
+        stats = router.stats()
+        self.assertEqual(stats["0_requests"] + stats["1_requests"], 3)
+        self.assertEqual(stats["0_outstanding"] + stats["1_outstanding"], 1)
+
+    def test_session_sticky(self):
+        router = self.router(routing="session")
+        urls = set()
+        for _ in range(5):
+            with router.backend("session-1") as generation:
+                urls.add(generation.client.url)
+        self.assertEqual(len(urls), 1)
+
+        # Once the backend of the session fails it moves to the other one.
+        self.fail(router, "session-1")
+        self.fail(router, "session-1")
+        with router.backend("session-1") as generation:
+            self.assertNotIn(generation.client.url, urls)
+
+    def test_failed_backend_is_ejected(self):
+        router = self.router(max_failures=2)
+        broken = router.backends[0]
+        with patch.object(router, "pick", return_value=broken):
+            # pick is what counts the requests as outstanding.
+            broken.outstanding = 2
+            self.fail(router)
+            self.fail(router)
+
+        self.assertEqual(router.stats()["0_healthy"], 0)
+        self.assertEqual(router.stats()["0_failures"], 2)
+        for _ in range(3):
+            with router.backend() as generation:
+                self.assertEqual(generation.client.url, "http://b")
+
+    def test_slow_backend_is_ejected(self):
+        router = self.router(slow_factor=3, slow_min_samples=2)
+        fast, slow = router.backends
+        requests = [(fast, 1.0), (fast, 1.0), (slow, 2.0), (slow, 20.0)]
+        for backend, seconds in requests:
+            backend.outstanding += 1
+            router._finish(backend, seconds, output_tokens=100)
+
+        self.assertEqual(router.stats()["1_healthy"], 0)
+        self.assertIsNone(slow.latency)
+        self.assertEqual(router.stats()["0_seconds_per_token"], 0.01)
+
+    def test_long_answer_does_not_eject_a_backend(self):
+        router = self.router(slow_factor=3, slow_min_samples=2)
+        short, long = router.backends
+        for _ in range(2):
+            short.outstanding += 1
+            router._finish(short, 1.0, output_tokens=20)
+        # Ten times as long, for ten times as many tokens.
+        long.outstanding += 1
+        router._finish(long, 10.0, output_tokens=200)
+
+        self.assertEqual(router.stats()["1_healthy"], 1)
+
+    def test_one_slow_request_does_not_eject_a_backend(self):
+        router = self.router(slow_factor=3, slow_min_samples=2)
+        fast, slow = router.backends
+        for backend, seconds in [(fast, 1.0), (fast, 1.0), (slow, 20.0)]:
+            backend.outstanding += 1
+            router._finish(backend, seconds, output_tokens=100)
+
+        self.assertEqual(router.stats()["1_healthy"], 1)
+
+    def test_request_reports_its_output_tokens(self):
+        router = self.router()
+        with router.backend() as generation:
+            generation.output_tokens = 4
+
+        backend = next(b for b in router.backends if b.samples)
+        self.assertGreaterEqual(backend.latency, 0.0)
+
+    def test_all_backends_ejected(self):
+        router = self.router(eject_seconds=60)
+        for backend in router.backends:
+            router._eject(backend, "test")
+
+        with router.backend() as generation:
+            self.assertIn(generation.client.url, ["http://a", "http://b"])
+
+    def test_health_check(self):
+        router = self.router()
+        backend = router.backends[0]
+        self.assertTrue(router.check(backend))
+
+        backend.client.with_options.return_value.models.list.side_effect = OSError
+        self.assertFalse(router.check(backend))
+        self.assertEqual(router.stats()["0_healthy"], 0)
+
+    def test_cancelled_request_is_not_a_failure(self):
+        router = self.router()
+
+        def stream():
+            with router.backend():
+                yield "token"
+
+        generator = stream()
+        next(generator)
+        generator.close()
+
+        stats = router.stats()
+        self.assertEqual(stats["0_outstanding"], 0)
+        self.assertEqual(stats["0_failures"], 0)
+
+    def test_unknown_routing(self):
+        with self.assertRaises(ValueError):
+            self.router(routing="random")
+
+    @patch("src.tools.llm_client._router", None)
+    @patch("src.tools.llm_client.BACKENDS", ["http://a", "http://b"])
+    @patch("openai.OpenAI")
+    def test_get_router(self, mock_openai):
+        router = llm_client.get_router()
+
+        self.assertIs(router, llm_client.get_router())
+        self.assertEqual(mock_openai.call_count, 2)
+        self.assertEqual(mock_openai.call_args.kwargs["base_url"], "http://b/v1")
+
+
+class TestPromptCache(unittest.TestCase):
+
+    def completion(self, **extra):
+        return ChatCompletion.model_validate(
+            {
+                "id": "1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "LLaMA_CPP",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "answer"},
+                    }
+                ],
+                **extra,
+            }
+        )
+
+    @patch("src.tools.llm_client.SLOTS", 4)
+    def test_request_options(self):
+        options = llm_client.request_options("session-1")
+
+        self.assertTrue(options["cache_prompt"])
+        self.assertIn(options["id_slot"], range(4))
+        self.assertEqual(options["slot_id"], options["id_slot"])
+        self.assertEqual(llm_client.request_options("session-1"), options)
+
+    @patch("src.tools.llm_client.SLOTS", 0)
+    def test_request_options_without_slots(self):
+        self.assertNotIn("id_slot", llm_client.request_options("session-1"))
+
+    @patch("src.tools.llm_client._prompt_tokens", {"cached": 0, "evaluated": 0})
+    def test_record_prompt_tokens(self):
+        usage = {"prompt_tokens": 100, "completion_tokens": 5, "total_tokens": 105}
+        timings = {"prompt_n": 30, "predicted_n": 5}
+
+        self.assertEqual(
+            llm_client.record_prompt_tokens(
+                self.completion(usage=usage, timings=timings)
+            ),
+            (70, 30),
+        )
+        self.assertEqual(
+            llm_client.record_prompt_tokens(
+                self.completion(timings={"prompt_n": 10, "cache_n": 90})
+            ),
+            (90, 10),
+        )
+        self.assertIsNone(llm_client.record_prompt_tokens(self.completion()))
+        self.assertIsNone(llm_client.record_prompt_tokens(MagicMock()))
+        self.assertEqual(
+            llm_client.prompt_token_stats(), {"cached": 160, "evaluated": 40}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
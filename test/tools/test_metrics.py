@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.tools import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_histogram(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 5.0]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.cumulative_counts(), [2, 3, 4])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 5.65)
+
+    @patch("src.tools.metrics.time.perf_counter", side_effect=[1.0, 1.5, 2.0, 4.0])
+    def test_timed(self, mock_perf_counter):
+        with metrics.timed("chunk"):
+            pass
+
+        @metrics.timed("chunk")
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            fail()
+
+        stage = metrics.snapshot()["stages"]["chunk"]
+        self.assertEqual(stage["count"], 2)
+        self.assertEqual(stage["sum"], 2.5)
+        self.assertEqual(stage["buckets"][1.0], 1)
+        self.assertEqual(stage["buckets"][float("inf")], 2)
+
+    def test_in_flight(self):
+        metrics.request_started("inference_stream")
+        metrics.request_started("inference_stream")
+        metrics.request_finished("inference_stream")
+        self.assertEqual(metrics.snapshot()["in_flight"], {"inference_stream": 1})
+
+    def test_render(self):
+        metrics.observe("retrieval", 0.02)
+        metrics.request_started("upload_file")
+        metrics.register_stats("test_cache", lambda: {"hits": 3, "name": "ignored"})
+
+        text = metrics.render()
+
+        self.assertIn("# TYPE rag_stage_duration_seconds histogram", text)
+        self.assertIn(
+            'rag_stage_duration_seconds_bucket{stage="retrieval",le="0.01"} 0', text
+        )
+        self.assertIn(
+            'rag_stage_duration_seconds_bucket{stage="retrieval",le="0.025"} 1', text
+        )
+        self.assertIn(
+            'rag_stage_duration_seconds_bucket{stage="retrieval",le="+Inf"} 1', text
+        )
+        self.assertIn('rag_stage_duration_seconds_count{stage="retrieval"} 1', text)
+        self.assertIn('rag_requests_in_flight{endpoint="upload_file"} 1', text)
+        self.assertIn("rag_test_cache_hits 3", text)
+        self.assertNotIn("rag_test_cache_name", text)
+
+    def test_render_adds_up_the_processes(self):
+        # A worker that exited, whose pid is free now.
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        other = {
+            "stages": {
+                "retrieval": {"counts": [1] + [0] * 15, "sum": 0.001, "count": 1}
+            },
+            "in_flight": {"upload_file": 1},
+            "stats": {"test_cache": {"hits": 5}},
+        }
+        with tempfile.TemporaryDirectory() as metrics_dir, patch(
+            "src.tools.metrics.METRICS_DIR", metrics_dir
+        ):
+            for pid in (os.getppid(), exited.pid):
+                with open(os.path.join(metrics_dir, f"{pid}.json"), "w") as f:
+                    json.dump(other, f)
+            metrics.observe("retrieval", 0.02)
+            metrics.request_started("upload_file")
+            metrics.register_stats("test_cache", lambda: {"hits": 3})
+
+            text = metrics.render()
+
+        self.assertIn('rag_stage_duration_seconds_count{stage="retrieval"} 3', text)
+        self.assertIn(
+            'rag_stage_duration_seconds_bucket{stage="retrieval",le="0.001"} 2', text
+        )
+        # The requests of the worker that exited are over.
+        self.assertIn('rag_requests_in_flight{endpoint="upload_file"} 2', text)
+        self.assertIn(f'rag_test_cache_hits{{pid="{os.getpid()}"}} 3', text)
+        self.assertIn(f'rag_test_cache_hits{{pid="{os.getppid()}"}} 5', text)
+        self.assertNotIn(f'pid="{exited.pid}"', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import threading
+import unittest
+from unittest.mock import patch
+from src.tools import pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_batched(self):
+        self.assertEqual(list(pipeline.batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(pipeline.batched([], 2)), [])
+
+    def test_tee(self):
+        seen = []
+
+        self.assertEqual(list(pipeline.tee([1, 2], seen.append)), [1, 2])
+        self.assertEqual(seen, [1, 2])
+
+    @patch("src.tools.pipeline.metrics.observe")
+    def test_timed(self, mock_observe):
+        self.assertEqual(list(pipeline.timed(iter([1, 2]), "extract")), [1, 2])
+
+        mock_observe.assert_called_once()
+        self.assertEqual(mock_observe.call_args.args[0], "extract")
+
+    def test_buffered_keeps_order(self):
+        self.assertEqual(
+            list(pipeline.buffered(range(100), maxsize=3)), list(range(100))
+        )
+
+    def test_buffered_applies_back_pressure(self):
+        produced = []
+
+        def items():
+            for item in range(10):
+                produced.append(item)
+                yield item
+
+        stream = pipeline.buffered(items(), maxsize=2)
+        self.assertEqual(next(stream), 0)
+        # The producer stops once the queue is full: two items wait, one is blocked on the way in.
+        for _ in range(50):
+            if len(produced) >= 4:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(len(produced), 4)
+        stream.close()
+
+    def test_buffered_raises_errors_of_the_stage(self):
+        def items():
+            yield 1
+            raise ValueError("bad page")
+
+        stream = pipeline.buffered(items())
+
+        self.assertEqual(next(stream), 1)
+        with self.assertRaises(ValueError):
+            next(stream)
+
+    def test_buffered_stops_the_stage_when_the_consumer_stops(self):
+        closed = threading.Event()
+
+        def items():
+            try:
+                while True:
+                    yield 1
+            finally:
+                closed.set()
+
+        stream = pipeline.buffered(items(), maxsize=1)
+        next(stream)
+        stream.close()
+
+        self.assertTrue(closed.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
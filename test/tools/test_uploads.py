@@ -0,0 +1,89 @@
+import io
+import os
+import tempfile
+import unittest
+import PyPDF2
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+from src.tools.blob_store import BlobStore
+from src.tools.chunk_cache import file_hash
+from src.tools.uploads import UploadTooLargeError, receive_files
+
+
+def make_pdf(page_count):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=72, height=72)
+    data = io.BytesIO()
+    writer.write(data)
+    return data.getvalue()
+
+
+def make_request(files, **kwargs):
+    data = {"file": [(io.BytesIO(contents), name) for name, contents in files]}
+    return Request(EnvironBuilder(method="POST", data=data, **kwargs).get_environ())
+
+
+class TestUploads(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = BlobStore(root=self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.temp_dir.name) for name in names]
+
+    def test_receive_files(self):
+        pdf = make_pdf(3)
+        request = make_request([("a.pdf", pdf), ("b.txt", b"plain text")])
+
+        uploads = receive_files(request, store=self.store)
+
+        self.assertEqual(
+            [tuple(upload) for upload in uploads],
+            [
+                ("a.pdf", file_hash(pdf), len(pdf), 3),
+                ("b.txt", file_hash(b"plain text"), 10, None),
+            ],
+        )
+        with self.store.open(uploads[1].sha256) as f:
+            self.assertEqual(f.read(), b"plain text")
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_file_size_limit(self):
+        request = make_request([("small.txt", b"x" * 10), ("big.txt", b"y" * 100)])
+
+        with self.assertRaises(UploadTooLargeError):
+            receive_files(request, store=self.store, max_file_bytes=50)
+
+        # The file that fit is dropped too, and no temporary files are left behind.
+        self.assertEqual(self.stored_files(), [])
+
+    def test_total_size_limit(self):
+        request = make_request([("a.txt", b"x" * 100), ("b.txt", b"y" * 100)])
+
+        with self.assertRaises(UploadTooLargeError):
+            receive_files(request, store=self.store, max_total_bytes=150)
+
+        self.assertEqual(self.stored_files(), [])
+
+    def test_file_count_limit(self):
+        request = make_request([("a.txt", b"a"), ("b.txt", b"b"), ("c.txt", b"c")])
+
+        with self.assertRaises(UploadTooLargeError):
+            receive_files(request, store=self.store, max_files=2)
+
+        self.assertEqual(self.stored_files(), [])
+
+    def test_empty_file_input(self):
+        request = make_request([("", b"")])
+
+        self.assertEqual(receive_files(request, store=self.store), [])
+        self.assertEqual(self.stored_files(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,17 @@
+import tempfile
 import unittest
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from unittest.mock import patch, MagicMock
-from src.tools.utils import find_available_port, extract_content
+import PyPDF2
+from benchmarks.pdfs import make_pdf
+from src.tools.utils import (
+    _extract_pages,
+    find_available_port,
+    extract_content,
+    extract_pages,
+    count_pages,
+    iter_pages,
+)
 
 
 class TestUtils(unittest.TestCase):
@@ -55,6 +66,120 @@ class TestUtils(unittest.TestCase):
         mock_pdf_reader.assert_called_once()
         self.assertEqual(mock_pdf_reader.call_args[0][0].getvalue(), file_data)
 
+    def test_count_pages(self):
+        self.assertEqual(count_pages(make_pdf(["One.", "Two.", "Three."])), 3)
+
+    def test_count_pages_from_path(self):
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+            f.write(make_pdf(["One.", "Two."]))
+            f.flush()
+
+            self.assertEqual(count_pages(f.name), 2)
+            self.assertEqual(extract_pages([f.name], max_workers=1), [["One.", "Two."]])
+
+    def test_extract_pages_single_worker(self):
+        files_data = [make_pdf(["A one.", "A two."]), make_pdf(["B one."])]
+
+        result = extract_pages(files_data, max_workers=1)
+
+        self.assertEqual(result, [["A one.", "A two."], ["B one."]])
+
+    @patch("src.tools.utils.PAGES_PER_TASK", 2)
+    @patch("src.tools.utils.PAGE_SPLIT_THRESHOLD", 3)
+    def test_extract_pages_process_pool_keeps_order(self):
+        big = make_pdf([f"Big page {i}." for i in range(5)])
+        small = make_pdf(["Small page."])
+        empty = make_pdf([])
+
+        result = extract_pages([big, empty, small], max_workers=2)
+
+        self.assertEqual(
+            result, [[f"Big page {i}." for i in range(5)], [], ["Small page."]]
+        )
+
+    @patch("src.tools.utils.PAGES_PER_TASK", 1)
+    @patch("src.tools.utils.PAGE_SPLIT_THRESHOLD", 1)
+    @patch("src.tools.utils.ProcessPoolExecutor")
+    def test_iter_pages_extracts_a_bounded_number_of_ranges_ahead(self, mock_executor):
+        def submit(function, source, start, stop):
+            future = MagicMock()
+            future.result.return_value = [f"Page {start}."]
+            return future
+
+        mock_executor.return_value.submit.side_effect = submit
+        pages = iter_pages(
+            [make_pdf([f"Page {i}." for i in range(10)])], max_workers=2, lookahead=2
+        )
+
+        self.assertEqual(next(pages), (0, "Page 0."))
+        # Four ranges were queued up front and one more as the first was handed out.
+        self.assertEqual(mock_executor.return_value.submit.call_count, 5)
+        # The bytes went to one temporary file, and each range only carries its path.
+        sources = {
+            call.args[1] for call in mock_executor.return_value.submit.call_args_list
+        }
+        self.assertEqual(len(sources), 1)
+        self.assertIsInstance(sources.pop(), str)
+        self.assertEqual(list(pages), [(0, f"Page {i}.") for i in range(1, 10)])
+
+    @patch("src.tools.utils._terminate_workers")
+    @patch("src.tools.utils.ProcessPoolExecutor")
+    def test_iter_pages_page_timeout(self, mock_executor, mock_terminate):
+        slow = MagicMock()
+        slow.result.side_effect = FutureTimeoutError
+        fast = MagicMock()
+        fast.result.return_value = ["Fast page."]
+        mock_executor.return_value.submit.side_effect = [slow, fast]
+
+        skipped = []
+
+        pages = iter_pages(
+            [make_pdf(["Slow."]), make_pdf(["Fast page."])],
+            max_workers=2,
+            page_timeout=0.5,
+            on_skip=skipped.append,
+        )
+
+        self.assertEqual(list(pages), [(0, ""), (1, "Fast page.")])
+        self.assertEqual(skipped, [0])
+        slow.result.assert_called_once_with(timeout=0.5)
+        mock_terminate.assert_called_once_with(mock_executor.return_value)
+        mock_executor.return_value.shutdown.assert_called_once_with(
+            wait=False, cancel_futures=True
+        )
+
+    @patch("src.tools.utils._terminate_workers")
+    @patch("src.tools.utils.ProcessPoolExecutor")
+    def test_iter_pages_single_range_timeout(self, mock_executor, mock_terminate):
+        slow = MagicMock()
+        slow.result.side_effect = FutureTimeoutError
+        mock_executor.return_value.submit.return_value = slow
+        skipped = []
+
+        pages = iter_pages(
+            [make_pdf(["Slow."])],
+            max_workers=1,
+            page_timeout=0.5,
+            on_skip=skipped.append,
+        )
+
+        self.assertEqual(list(pages), [(0, "")])
+        self.assertEqual(skipped, [0])
+        mock_terminate.assert_called_once_with(mock_executor.return_value)
+
+    def test_worker_parses_a_file_once_for_all_its_ranges(self):
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+            f.write(make_pdf(["One.", "Two.", "Three."]))
+            f.flush()
+
+            with patch(
+                "src.tools.utils.PyPDF2.PdfReader", wraps=PyPDF2.PdfReader
+            ) as mock_reader:
+                self.assertEqual(_extract_pages(f.name, 0, 2), ["One.", "Two."])
+                self.assertEqual(_extract_pages(f.name, 2, 3), ["Three."])
+
+            mock_reader.assert_called_once()
+
 
 if __name__ == "__main__":
     unittest.main()
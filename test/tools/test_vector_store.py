@@ -0,0 +1,202 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+import numpy as np
+from src.tools import vector_store
+from src.tools.vector_store import NumpyStore
+
+
+class TestNumpyStore(unittest.TestCase):
+    dtype = "float32"
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = NumpyStore(root=self.tmp_dir.name, dtype=self.dtype)
+        self.encode_query_patch = patch(
+            "src.tools.vector_store.embedding.encode_query",
+            side_effect=lambda query: np.array(
+                [1.0, 0.0, 0.0] if query == "x" else [0.0, 1.0, 0.0]
+            ),
+        )
+        self.encode_query_patch.start()
+
+    def tearDown(self):
+        self.encode_query_patch.stop()
+        self.tmp_dir.cleanup()
+
+    def add_file(self, file_id, chunks, vectors, session_id="session"):
+        uuids = [f"{file_id}-{index}" for index in range(len(chunks))]
+        return self.store.add(session_id, chunks, file_id, vectors=vectors, uuids=uuids)
+
+    def test_search(self):
+        report = self.add_file(1, ["a", "b"], [[2.0, 0.0, 0.0], [1.0, 1.0, 0.0]])
+        self.add_file(2, ["c"], [[0.0, 3.0, 0.0]])
+
+        self.assertEqual(report["objects"], 2)
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual(
+            self.store.search("session", "x", 2, "near_vector"),
+            [{"uuid": "1-0", "content": "a"}, {"uuid": "1-1", "content": "b"}],
+        )
+        self.assertEqual(
+            [c["content"] for c in self.store.search("session", "y", 5, "local")],
+            ["c", "b", "a"],
+        )
+        self.assertEqual(self.store.search("other", "x", 2, "near_vector"), [])
+
+    def test_vectors_are_normalized(self):
+        self.add_file(1, ["a"], [[3.0, 4.0, 0.0]])
+
+        self.assertEqual(
+            np.round(self.store.get_vectors("session", ["1-0"]), 6).tolist(),
+            [[0.6, 0.8, 0.0]],
+        )
+        self.assertIsNone(self.store.get_vectors("session", ["1-0", "missing"]))
+
+    def test_add_replaces_chunks_with_the_same_uuid(self):
+        self.add_file(1, ["a", "b"], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        self.add_file(1, ["a2"], [[0.0, 1.0, 0.0]])
+
+        self.assertEqual(
+            self.store.search("session", "y", 5, "near_vector"),
+            [{"uuid": "1-0", "content": "a2"}, {"uuid": "1-1", "content": "b"}],
+        )
+
+    def test_remove_file_and_drop(self):
+        self.add_file(1, ["a", "b"], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        self.add_file(2, ["c"], [[1.0, 1.0, 0.0]])
+
+        self.assertEqual(self.store.remove_file("session", 1), 2)
+        self.assertEqual(self.store.remove_file("session", 1), 0)
+        self.assertEqual(
+            [c["content"] for c in self.store.search("session", "x", 5, "local")],
+            ["c"],
+        )
+
+        self.store.drop("session")
+        self.assertEqual(self.store.search("session", "x", 5, "local"), [])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, "session")))
+
+    def test_uncommitted_append_is_ignored(self):
+        self.add_file(1, ["a"], [[1.0, 0.0, 0.0]])
+        # An append that was interrupted after writing the sidecar and the vectors, but before the header.
+        generation = self.store._generation("session")
+        paths = self.store._paths("session", generation)
+        with open(paths.chunks, "a") as f:
+            f.write('{"uuid": "torn", "file_id": 9, "content": "torn"}\n')
+        with open(paths.vectors, "ab") as f:
+            f.write(np.zeros(3, dtype=np.float32).tobytes())
+
+        self.assertEqual(len(self.store.search("session", "x", 5, "local")), 1)
+
+        self.add_file(2, ["b"], [[0.0, 1.0, 0.0]])
+        self.assertEqual(
+            [c["content"] for c in self.store.search("session", "x", 5, "local")],
+            ["a", "b"],
+        )
+
+    def test_changes_by_another_process_are_seen(self):
+        other = NumpyStore(root=self.tmp_dir.name)
+        self.add_file(1, ["a"], [[1.0, 0.0, 0.0]])
+        self.assertEqual(len(other.search("session", "x", 5, "local")), 1)
+
+        self.add_file(2, ["b"], [[0.0, 1.0, 0.0]])
+        self.assertEqual(len(other.search("session", "x", 5, "local")), 2)
+
+        self.store.remove_file("session", 1)
+        self.assertEqual(len(other.search("session", "x", 5, "local")), 1)
+
+    def test_appending_batches_reads_only_the_new_rows(self):
+        self.add_file(1, ["a", "b"], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        self.store.search("session", "x", 5, "local")
+
+        with patch(
+            "src.tools.vector_store._read_rows", wraps=vector_store._read_rows
+        ) as mock_read_rows, patch.object(
+            self.store, "_rewrite", wraps=self.store._rewrite
+        ) as mock_rewrite:
+            self.add_file(2, ["c"], [[1.0, 1.0, 0.0]])
+            results = self.store.search("session", "y", 5, "local")
+
+        self.assertEqual([c["content"] for c in results], ["b", "c", "a"])
+        mock_rewrite.assert_not_called()
+        self.assertEqual([call.args[1] for call in mock_read_rows.call_args_list], [1])
+
+    @unittest.skipIf(vector_store.fcntl is None, "needs fcntl")
+    def test_writers_of_another_process_are_waited_for(self):
+        self.add_file(1, ["a"], [[1.0, 0.0, 0.0]])
+        removed = []
+        # Another worker process holding the lock looks the same as another open file with a lock on it.
+        with open(os.path.join(self.tmp_dir.name, "session.lock"), "a") as lock_file:
+            vector_store.fcntl.flock(lock_file, vector_store.fcntl.LOCK_EX)
+            writer = threading.Thread(
+                target=lambda: removed.append(self.store.remove_file("session", 1))
+            )
+            writer.start()
+            writer.join(0.2)
+            self.assertTrue(writer.is_alive())
+        writer.join()
+
+        self.assertEqual(removed, [1])
+
+    def test_add_without_vectors(self):
+        with self.assertRaises(ValueError):
+            self.store.add("session", ["a"], 1)
+
+    def test_unknown_dtype(self):
+        with self.assertRaises(ValueError):
+            NumpyStore(root=self.tmp_dir.name, dtype="int4")
+
+    @patch("src.tools.vector_store._store", None)
+    @patch("src.tools.vector_store.VECTOR_STORE", "numpy")
+    def test_get_store(self):
+        self.assertIsInstance(vector_store.get_store(), NumpyStore)
+
+    @patch("src.tools.vector_store._store", None)
+    @patch("src.tools.vector_store.VECTOR_STORE", "bogus")
+    def test_get_store_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            vector_store.get_store()
+
+
+class TestFloat16NumpyStore(TestNumpyStore):
+    dtype = "float16"
+
+
+class TestInt8NumpyStore(TestNumpyStore):
+    dtype = "int8"
+
+    def test_vectors_take_a_quarter_of_the_memory(self):
+        self.add_file(1, ["a", "b"], np.random.default_rng(0).standard_normal((2, 384)))
+
+        vectors = self.store._load("session").vectors
+        self.assertEqual(vectors.dtype, np.int8)
+        self.assertEqual(vectors.nbytes, 2 * 384)
+
+    def test_shortlist_is_reranked_in_float32(self):
+        # Both second components round to 0 in int8, so only the float32 vectors tell them apart.
+        vectors = [[1.0, 0.001, 0.0], [1.0, 0.002, 0.0], [-1.0, 0.0, 0.0]]
+        self.add_file(1, ["a", "b", "c"], vectors)
+
+        self.assertEqual(
+            self.store.search("session", "y", 1, "near_vector"),
+            [{"uuid": "1-1", "content": "b"}],
+        )
+
+    def test_session_keeps_its_dtype(self):
+        self.add_file(1, ["a"], [[1.0, 0.0, 0.0]])
+        other = NumpyStore(root=self.tmp_dir.name, dtype="float32")
+        other.add("session", ["b"], 2, vectors=[[0.0, 1.0, 0.0]], uuids=["2-0"])
+        other.remove_file("session", 1)
+
+        self.assertEqual(other._load("session").vectors.dtype, np.int8)
+        self.assertEqual(
+            other.search("session", "y", 5, "near_vector"),
+            [{"uuid": "2-0", "content": "b"}],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from src.tools.weaviate_pool import ClientPool, PoolExhaustedError, connect
+
+
+class TestWeaviatePool(unittest.TestCase):
+
+    @patch("weaviate.connect_to_local")
+    def test_connect(self, mock_connect_to_local):
+        connect()
+
+        mock_connect_to_local.assert_called_once_with(
+            host="weaviate", port=8080, grpc_port=50051
+        )
+
+    def test_connection_reuses_released_client(self):
+        factory = MagicMock(side_effect=lambda: MagicMock())
+        pool = ClientPool(factory=factory, max_size=2)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        factory.assert_called_once()
+        self.assertEqual(
+            pool.stats(), {"open": 1, "idle": 1, "in_use": 0, "max_size": 2}
+        )
+
+    def test_acquire_times_out_when_exhausted(self):
+        pool = ClientPool(factory=MagicMock, max_size=1, acquire_timeout=0.01)
+        pool.acquire()
+
+        with self.assertRaises(PoolExhaustedError):
+            pool.acquire()
+
+    @patch("src.tools.weaviate_pool.time.monotonic")
+    def test_idle_clients_are_evicted(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        factory = MagicMock(side_effect=lambda: MagicMock())
+        pool = ClientPool(factory=factory, max_size=2, idle_timeout=10)
+        client = pool.acquire()
+        pool.release(client)
+
+        mock_monotonic.return_value = 100
+        new_client = pool.acquire()
+
+        self.assertIsNot(client, new_client)
+        client.close.assert_called_once()
+        self.assertEqual(pool.stats()["open"], 1)
+
+    @patch("src.tools.weaviate_pool.time.monotonic")
+    def test_unhealthy_client_is_replaced(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        factory = MagicMock(side_effect=lambda: MagicMock())
+        pool = ClientPool(
+            factory=factory, max_size=1, idle_timeout=100, health_check_interval=5
+        )
+        client = pool.acquire()
+        client.is_ready.return_value = False
+        pool.release(client)
+
+        mock_monotonic.return_value = 10
+        new_client = pool.acquire()
+
+        self.assertIsNot(client, new_client)
+        client.close.assert_called_once()
+        self.assertEqual(factory.call_count, 2)
+
+    def test_failed_connection_is_discarded(self):
+        client = MagicMock()
+        client.is_ready.return_value = False
+        pool = ClientPool(factory=MagicMock(return_value=client), max_size=1)
+
+        with self.assertRaises(RuntimeError):
+            with pool.connection():
+                raise RuntimeError("query failed")
+
+        client.close.assert_called_once()
+        self.assertEqual(pool.stats()["open"], 0)
+
+    def test_close_all(self):
+        pool = ClientPool(factory=MagicMock(side_effect=lambda: MagicMock()))
+        with pool.connection() as client:
+            pass
+
+        pool.close_all()
+
+        client.close.assert_called_once()
+        self.assertEqual(pool.stats()["open"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,287 @@
+import unittest
+import uuid
+from unittest.mock import patch, MagicMock
+import numpy as np
+from src.tools.weaviate_store import (
+    WeaviateStore,
+    fetch_vectors,
+    insert_chunks,
+    initiate_storage,
+)
+
+
+class TestWeaviateStore(unittest.TestCase):
+
+    def test_insert_chunks(self):
+        mock_collection = MagicMock()
+        mock_batch = (
+            mock_collection.batch.fixed_size.return_value.__enter__.return_value
+        )
+        mock_collection.batch.failed_objects = [MagicMock(message="boom")]
+
+        report = insert_chunks(
+            mock_collection, ["chunk 1", "chunk 2"], 7, batch_size=50, concurrency=4
+        )
+
+        mock_collection.batch.fixed_size.assert_called_once_with(
+            batch_size=50, concurrent_requests=4
+        )
+        mock_batch.add_object.assert_any_call(
+            properties={"content": "chunk 1", "file_id": 7}, uuid=None, vector=None
+        )
+        mock_batch.add_object.assert_any_call(
+            properties={"content": "chunk 2", "file_id": 7}, uuid=None, vector=None
+        )
+        self.assertEqual(report["objects"], 2)
+        self.assertEqual(report["failed"], 1)
+
+    def test_insert_chunks_with_vectors(self):
+        mock_collection = MagicMock()
+        mock_batch = (
+            mock_collection.batch.fixed_size.return_value.__enter__.return_value
+        )
+        mock_collection.batch.failed_objects = []
+
+        insert_chunks(
+            mock_collection,
+            ["chunk 1"],
+            7,
+            vectors=np.array([[0.5, 0.25]], dtype=np.float32),
+            uuids=["uuid-1"],
+        )
+
+        mock_batch.add_object.assert_called_once_with(
+            properties={"content": "chunk 1", "file_id": 7},
+            uuid="uuid-1",
+            vector=[0.5, 0.25],
+        )
+
+    def test_fetch_vectors(self):
+        uuid_1, uuid_2, uuid_3 = [str(uuid.uuid4()) for _ in range(3)]
+        mock_collection = MagicMock()
+        mock_collection.query.fetch_objects.return_value.objects = [
+            MagicMock(uuid=uuid_2, vector={"default": [0.0, 1.0]}),
+            MagicMock(uuid=uuid_1, vector={"default": [1.0, 0.0]}),
+        ]
+
+        vectors = fetch_vectors(mock_collection, [uuid_1, uuid_2])
+
+        self.assertEqual(vectors, [[1.0, 0.0], [0.0, 1.0]])
+        self.assertIsNone(fetch_vectors(mock_collection, [uuid_1, uuid_3]))
+
+    @patch("src.tools.weaviate_store.INGEST_BATCH_MODE", "dynamic")
+    def test_insert_chunks_dynamic(self):
+        mock_collection = MagicMock()
+        mock_collection.batch.failed_objects = []
+
+        report = insert_chunks(mock_collection, ["chunk 1"], 7)
+
+        mock_collection.batch.dynamic.assert_called_once_with()
+        mock_collection.batch.fixed_size.assert_not_called()
+        self.assertEqual(report["failed"], 0)
+
+    def test_initiate_storage(self):
+        mock_client = MagicMock()
+        mock_client.collections.exists.return_value = False
+
+        collection = initiate_storage(mock_client, "test-session")
+
+        mock_client.collections.delete_all.assert_not_called()
+        mock_client.collections.exists.assert_called_once_with("TextChunk_test_session")
+        mock_client.collections.create.assert_called_once()
+        self.assertEqual(
+            mock_client.collections.create.call_args.kwargs["name"],
+            "TextChunk_test_session",
+        )
+        self.assertIs(collection, mock_client.collections.get.return_value)
+        mock_client.close.assert_not_called()
+
+    def test_initiate_storage_vectorizes_only_the_text(self):
+        mock_client = MagicMock()
+        mock_client.collections.exists.return_value = False
+
+        initiate_storage(mock_client, "test-session")
+
+        config = mock_client.collections.create.call_args.kwargs
+        self.assertFalse(config["vectorizer_config"].vectorizeClassName)
+        content = next(p for p in config["properties"] if p.name == "content")
+        self.assertFalse(content.vectorize_property_name)
+
+    def test_initiate_storage_existing_collection(self):
+        mock_client = MagicMock()
+        mock_client.collections.exists.return_value = True
+
+        initiate_storage(mock_client, "test-session")
+
+        mock_client.collections.create.assert_not_called()
+        mock_client.collections.get.assert_called_once_with("TextChunk_test_session")
+
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    def test_remove_file(self, mock_connection):
+        mock_client = mock_connection.return_value.__enter__.return_value
+        mock_client.collections.exists.return_value = True
+        mock_collection = mock_client.collections.get.return_value
+        mock_collection.data.delete_many.side_effect = [
+            MagicMock(matches=4, successful=4, failed=0),
+            MagicMock(matches=0, successful=0, failed=0),
+        ]
+
+        removed = WeaviateStore().remove_file("test-session", 7)
+
+        self.assertEqual(removed, 4)
+        mock_client.collections.get.assert_called_once_with("TextChunk_test_session")
+        where = mock_collection.data.delete_many.call_args.kwargs["where"]
+        self.assertEqual(where.target, "file_id")
+        self.assertEqual(where.value, 7)
+
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    def test_remove_file_over_several_rounds(self, mock_connection):
+        mock_client = mock_connection.return_value.__enter__.return_value
+        mock_client.collections.exists.return_value = True
+        mock_collection = mock_client.collections.get.return_value
+        # The server caps each delete at 10,000 objects.
+        mock_collection.data.delete_many.side_effect = [
+            MagicMock(matches=10000, successful=10000, failed=0),
+            MagicMock(matches=10000, successful=10000, failed=0),
+            MagicMock(matches=2500, successful=2500, failed=0),
+            MagicMock(matches=0, successful=0, failed=0),
+        ]
+
+        removed = WeaviateStore().remove_file("test-session", 7)
+
+        self.assertEqual(removed, 22500)
+        self.assertEqual(mock_collection.data.delete_many.call_count, 4)
+
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    def test_remove_file_with_failed_deletes(self, mock_connection):
+        mock_client = mock_connection.return_value.__enter__.return_value
+        mock_client.collections.exists.return_value = True
+        mock_collection = mock_client.collections.get.return_value
+        mock_collection.data.delete_many.return_value = MagicMock(
+            matches=3, successful=2, failed=1
+        )
+
+        with self.assertRaises(RuntimeError):
+            WeaviateStore().remove_file("test-session", 7)
+
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    def test_drop(self, mock_connection):
+        mock_client = mock_connection.return_value.__enter__.return_value
+        mock_client.collections.exists.return_value = True
+
+        WeaviateStore().drop("test-session")
+
+        mock_client.collections.delete.assert_called_once_with("TextChunk_test_session")
+
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    @patch("src.tools.weaviate_store.embedding.encode_query")
+    def test_search(self, mock_encode_query, mock_connect):
+        mock_client = MagicMock()
+        mock_connect.return_value.__enter__.return_value = mock_client
+        mock_collection = MagicMock()
+        mock_client.collections.get.return_value = mock_collection
+
+        mock_response = MagicMock()
+        mock_response.objects = [
+            MagicMock(properties={"content": "Content 2"}),
+            MagicMock(properties={"content": "Content 1"}),
+        ]
+        mock_collection.query.near_vector.return_value = mock_response
+        mock_encode_query.return_value = np.array([1.0, 1.0, 0.0])
+
+        result = WeaviateStore().search("test-session", "test query", 2, "near_vector")
+
+        mock_connect.assert_called_once_with()
+        mock_client.collections.get.assert_called_once_with("TextChunk_test_session")
+        mock_encode_query.assert_called_once_with("test query")
+        mock_collection.query.near_vector.assert_called_once_with(
+            near_vector=[1.0, 1.0, 0.0], limit=2, return_properties=["content"]
+        )
+        mock_collection.query.fetch_objects.assert_not_called()
+        mock_client.close.assert_not_called()
+
+        self.assertEqual([c["content"] for c in result], ["Content 2", "Content 1"])
+
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    def test_search_near_text(self, mock_connect):
+        mock_client = mock_connect.return_value.__enter__.return_value
+        mock_collection = mock_client.collections.get.return_value
+        mock_collection.query.near_text.return_value.objects = [
+            MagicMock(properties={"content": "Content 1"}),
+        ]
+
+        result = WeaviateStore().search("test-session", "test query", 1, "near_text")
+
+        mock_collection.query.near_text.assert_called_once_with(
+            query="test query", limit=1, return_properties=["content"]
+        )
+        self.assertEqual([c["content"] for c in result], ["Content 1"])
+
+    @patch("src.tools.weaviate_store.FETCH_PAGE_SIZE", 2)
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    @patch("src.tools.weaviate_store.embedding.encode_query")
+    def test_search_local(self, mock_encode_query, mock_connect):
+        mock_client = MagicMock()
+        mock_connect.return_value.__enter__.return_value = mock_client
+        mock_collection = MagicMock()
+        mock_client.collections.get.return_value = mock_collection
+
+        first_page = MagicMock()
+        first_page.objects = [
+            MagicMock(
+                uuid="uuid-1",
+                vector={"default": [1, 0, 0]},
+                properties={"content": "Content 1"},
+            ),
+            MagicMock(
+                uuid="uuid-2",
+                vector={"default": [0, 1, 0]},
+                properties={"content": "Content 2"},
+            ),
+        ]
+        second_page = MagicMock()
+        second_page.objects = [
+            MagicMock(
+                uuid="uuid-3",
+                vector={"default": [0, 0, 1]},
+                properties={"content": "Content 3"},
+            ),
+        ]
+        mock_collection.query.fetch_objects.side_effect = [first_page, second_page]
+        mock_encode_query.return_value = np.array([2, 1, 0])
+
+        result = WeaviateStore().search("test-session", "test query", 2, "local")
+
+        self.assertEqual(mock_collection.query.fetch_objects.call_count, 2)
+        self.assertIsNone(
+            mock_collection.query.fetch_objects.call_args_list[0].kwargs["after"]
+        )
+        self.assertEqual(
+            mock_collection.query.fetch_objects.call_args_list[1].kwargs["after"],
+            "uuid-2",
+        )
+        mock_client.close.assert_not_called()
+        self.assertEqual([c["content"] for c in result], ["Content 1", "Content 2"])
+
+    @patch("src.tools.weaviate_store.weaviate_pool.connection")
+    def test_search_returns_uuids(self, mock_connect):
+        mock_client = mock_connect.return_value.__enter__.return_value
+        mock_collection = mock_client.collections.get.return_value
+        mock_collection.query.near_text.return_value.objects = [
+            MagicMock(uuid="uuid-2", properties={"content": "Content 2"}),
+            MagicMock(uuid="uuid-1", properties={"content": "Content 1"}),
+        ]
+
+        result = WeaviateStore().search("test-session", "test query", 2, "near_text")
+
+        self.assertEqual(
+            result,
+            [
+                {"uuid": "uuid-2", "content": "Content 2"},
+                {"uuid": "uuid-1", "content": "Content 1"},
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()